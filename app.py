@@ -1,25 +1,52 @@
 import streamlit as st
-import os, json, re, requests, time, tempfile
+import os, sys, json, re, requests, time, tempfile, hashlib, gzip, math, threading, zipfile, secrets, tarfile, glob
+import sqlite3, zlib
+import multiprocessing
+import cProfile, pstats
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, date
 from lxml import etree
-from io import BytesIO
+from io import BytesIO, StringIO
+from urllib.parse import urljoin, urlparse, unquote
 import openpyxl
+from openpyxl.styles import PatternFill
 from openpyxl.utils import get_column_letter
 from openpyxl.worksheet.table import Table, TableStyleInfo
-from msal import ConfidentialClientApplication
+from msal import ConfidentialClientApplication, SerializableTokenCache
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import streamlit.components.v1 as components
 from openai import AzureOpenAI
 import PyPDF2
 import docx
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import base64
+from collections import Counter, deque
+from contextlib import closing, nullcontext
+from cachetools import TTLCache
 from PIL import Image
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
 # ------------------- TRANSLATIONS -------------------
 TRANSLATIONS = {
     "en": {
         # Top bar
         "title": "TED Scraper & AI Assistant",
         "language": "Language",
+        "logout": "Log out",
         
         # Tab names
         "tab_scraper": "📄 TED Scraper",
@@ -53,17 +80,65 @@ TRANSLATIONS = {
         "date_start_label": "📆 Publication Start",
         "date_end_label": "📆 Publication End",
         "search_button": "🔍 Search Notices",
+        "batch_header": "🗂️ Saved searches and batch runs",
+        "batch_save_name": "Name for the current search",
+        "batch_save_button": "💾 Save current search",
+        "batch_saved": "✅ Saved search '{name}'",
+        "batch_none_saved": "No saved searches yet. Fill in the search criteria above and save them under a name.",
+        "batch_select": "Saved searches to run",
+        "batch_select_help": "Each search runs over the date range above. Notices found by several searches are fetched only once.",
+        "batch_run_button": "▶️ Run selected searches",
+        "batch_delete_button": "🗑️ Delete selected",
+        "batch_summary": "{hits} hits across {queries} searches, {fetched} distinct notices fetched",
+        "batch_sheet_all": "All",
+        "batch_query_failed": "⚠️ Search '{name}' failed and was skipped: {error}",
+        "filter_queries": "🗂️ Saved searches",
+        "archive_header": "🗄️ Re-extract from the XML archive",
+        "archive_stats": "{notices} notices archived, {stale} not yet parsed with parser version {version}",
+        "archive_current_only": "Only notices in the current results",
+        "archive_stale_only": "Only notices not yet parsed with the current parser version",
+        "archive_button": "🔁 Re-extract",
+        "archive_help": "Runs the current field extraction over the archived raw XML without contacting TED. Also available as: python app.py reprocess",
+        "archive_status": "{parsed} of {archived} archived notices re-extracted, {failed} failed",
+        "bulk_header": "📦 Bulk import from TED daily packages (offline)",
+        "bulk_path": "Path to a daily package (.tar.gz) or a folder of packages",
+        "bulk_help": "Reads the packages locally without network access and keeps notices matching the CPV codes and country above.",
+        "bulk_button": "📦 Import packages",
+        "bulk_status": "Scanned {scanned} notices, {matched} matching, {parsed} parsed",
+        "bulk_no_files": "❌ No .tar.gz packages found at this path",
+        "fields_label": "🧩 Fields to extract",
+        "fields_help": "Only the selected columns are extracted from each notice. Fewer fields make processing faster.",
+        "fields_cost": "Relative parse cost per notice: {cost} of {total}",
+        "latest_only": "Only the latest notice per procedure",
+        "latest_only_help": "Skips prior information notices and earlier versions of the same procedure; they are listed in the column 'Frühere Bekanntmachungen'. Untick to load every notice.",
+        "dedup_skipped": "ℹ️ Skipped {count} earlier notice(s) of {procedures} procedure(s)",
+        "incremental": "Only fetch what is new or changed since the last run",
+        "incremental_help": "Remembers the notices of each of your searches. Unchanged notices are taken from the last run, and the column 'Status' marks new and changed ones.",
+        "incremental_summary": "ℹ️ Since the last run of this search: {new} new, {changed} changed, {unchanged} unchanged",
+        "filter_changed_only": "Only new and changed notices",
+        "pushdown_header": "⚙️ Filter in the TED search (fewer downloads)",
+        "pushdown_enable": "Apply these filters in the TED query",
+        "pushdown_help": "Only matching notices are downloaded. Notices that do not state the field (e.g. no deadline or estimated value) are excluded.",
+        "pushdown_buyers": "Beschaffer (one per line)",
+        "pushdown_deadline_from": "⏰ Deadline from",
+        "pushdown_deadline_to": "⏰ Deadline until",
+        "pushdown_min_value": "Min. estimated value (EUR)",
         
         # Errors and warnings
         "error_no_keywords": "❌ Please enter either keywords or CPV codes (or both)!",
         "searching": "Searching TED database... This may take a few minutes.",
         "success_found": "✅ Found {count} notices!",
         "warning_no_results": "⚠️ No results found. Try adjusting your search criteria.",
+        "circuit_open": "⏸️ TED is not responding, pausing for {seconds} s...",
+        "retry_round": "🔁 Retrying {count} notice(s) in {seconds} s...",
+        "failures_header": "⚠️ {count} notice(s) could not be loaded",
+        "failures_download": "⬇️ Download failure report",
         "error_search": "❌ Error during search: {error}",
         
         # Results section
         "results_header": "📊 Search Results",
         "total_results": "📈 Total Results: **{count}** notices",
+        "results_footprint": "Results of this session: {memory:.1f} MB in memory, {disk:.1f} MB on disk · server: {sessions} session(s), {total:.1f} MB in memory",
         "filter_results": "🎯 Filter Results",
         "filter_beschaffer": "✅ Filter by Beschaffer",
         "filter_beschaffer_help": "Select multiple contractors using checkboxes",
@@ -78,14 +153,41 @@ TRANSLATIONS = {
         "filter_frist": "⏰ Frist Abgabedatum",
         "filter_frist_help": "Filter notices with submission deadline on or after this date",
         "filtered_results": "🎯 Filtered Results: **{count}** notices",
+        "grid_sort": "Sort by",
+        "grid_sort_none": "(unsorted)",
+        "grid_ascending": "Ascending",
+        "grid_page_size": "Rows per page",
+        "grid_page": "Page",
+        "grid_page_info": "Page {page} of {pages}",
+        "grid_details": "Details: {pubno}",
         "warning_volume": "⚠️ Invalid volume filter",
+        "enrich_button": "🤖 AI rating & summary",
+        "enrich_help": "Rates every notice for relevance to our service lines and summarizes it. Results are cached per notice.",
+        "enrich_running": "AI is rating {count} notices...",
+        "enrich_done": "✅ {count} notices rated ({failed} failed)",
+        "filter_relevance": "🤖 Min. AI relevance",
+        "filter_service_lines": "🤖 Service lines",
         
         # Download buttons
         "download_filtered": "⬇️ Download Filtered Results ({count} notices)",
         "download_all": "⬇️ Download All Results ({count} notices)",
+        "docs_header": "📥 Load tender documents into the AI Assistant",
+        "docs_select": "Notices",
+        "docs_select_help": "Documents linked from the procurement platform of these notices are downloaded and added to the document library",
+        "docs_button": "📥 Fetch documents",
+        "docs_running": "Fetching documents for {count} notices...",
+        "docs_done": "✅ {count} document(s) added to the AI Assistant",
+        "docs_errors": "⚠️ {count} link(s) could not be loaded",
         
         # Chatbot section
         "config_header": "## 🔑 Configuration",
+        "profiling_header": "⏱️ Profiling",
+        "profiling_rerun": "Profile next rerun",
+        "profiling_rerun_help": "The next interaction with the page is run under the profiler.",
+        "profiling_search": "Profile next search",
+        "profiling_search_help": "The next TED search is run under the profiler.",
+        "profiling_saved": "Saved profiles",
+        "profiling_download": "⬇️ Download .pstats",
         "azure_connected": "✅ Azure AI Connected",
         "azure_warning": "⚠️ Azure credentials missing",
         "doc_library": "## 📚 Document Library",
@@ -109,11 +211,15 @@ TRANSLATIONS = {
         "error_check_config": "Please check your Azure configuration in secrets.toml",
         "processing": "Processing {filename}...",
         "query_label": "🔍 Query: `{query}`",
+        "map_reduce_toggle": "📚 Whole-document mode",
+        "map_reduce_help": "Summarize large documents part by part (map-reduce) so questions can cover every section. Summaries are cached.",
+        "map_reduce_running": "Summarizing {filename} part by part...",
     },
     "de": {
         # Top bar
         "title": "TED Scraper & AI Assistent",
         "language": "Sprache",
+        "logout": "Abmelden",
         
         # Tab names
         "tab_scraper": "📄 TED Scraper",
@@ -147,17 +253,65 @@ TRANSLATIONS = {
         "date_start_label": "📆 Veröffentlichung Start",
         "date_end_label": "📆 Veröffentlichung Ende",
         "search_button": "🔍 Ausschreibungen suchen",
+        "batch_header": "🗂️ Gespeicherte Suchen und Stapelläufe",
+        "batch_save_name": "Name für die aktuelle Suche",
+        "batch_save_button": "💾 Aktuelle Suche speichern",
+        "batch_saved": "✅ Suche '{name}' gespeichert",
+        "batch_none_saved": "Noch keine gespeicherten Suchen. Suchkriterien oben ausfüllen und unter einem Namen speichern.",
+        "batch_select": "Auszuführende gespeicherte Suchen",
+        "batch_select_help": "Jede Suche läuft über den Zeitraum oben. Ausschreibungen, die mehrere Suchen finden, werden nur einmal abgerufen.",
+        "batch_run_button": "▶️ Ausgewählte Suchen ausführen",
+        "batch_delete_button": "🗑️ Auswahl löschen",
+        "batch_summary": "{hits} Treffer aus {queries} Suchen, {fetched} verschiedene Ausschreibungen abgerufen",
+        "batch_sheet_all": "Alle",
+        "batch_query_failed": "⚠️ Suche '{name}' ist fehlgeschlagen und wurde übersprungen: {error}",
+        "filter_queries": "🗂️ Gespeicherte Suchen",
+        "archive_header": "🗄️ Aus dem XML-Archiv neu auslesen",
+        "archive_stats": "{notices} Bekanntmachungen archiviert, {stale} noch nicht mit Parser-Version {version} ausgelesen",
+        "archive_current_only": "Nur Ausschreibungen aus den aktuellen Ergebnissen",
+        "archive_stale_only": "Nur Ausschreibungen, die noch nicht mit der aktuellen Parser-Version ausgelesen wurden",
+        "archive_button": "🔁 Neu auslesen",
+        "archive_help": "Wendet die aktuelle Feldextraktion auf das archivierte Roh-XML an, ohne TED abzufragen. Auch verfügbar als: python app.py reprocess",
+        "archive_status": "{parsed} von {archived} archivierten Bekanntmachungen neu ausgelesen, {failed} fehlgeschlagen",
+        "bulk_header": "📦 Massenimport aus TED-Tagespaketen (offline)",
+        "bulk_path": "Pfad zu einem Tagespaket (.tar.gz) oder einem Ordner mit Paketen",
+        "bulk_help": "Liest die Pakete lokal ohne Netzwerkzugriff und behält Ausschreibungen, die zu den CPV-Codes und dem Land oben passen.",
+        "bulk_button": "📦 Pakete importieren",
+        "bulk_status": "{scanned} Ausschreibungen gelesen, {matched} passend, {parsed} verarbeitet",
+        "bulk_no_files": "❌ Unter diesem Pfad wurden keine .tar.gz-Pakete gefunden",
+        "fields_label": "🧩 Zu extrahierende Felder",
+        "fields_help": "Nur die ausgewählten Spalten werden aus jeder Ausschreibung extrahiert. Weniger Felder beschleunigen die Verarbeitung.",
+        "fields_cost": "Relativer Parse-Aufwand pro Ausschreibung: {cost} von {total}",
+        "latest_only": "Nur die neueste Bekanntmachung je Verfahren",
+        "latest_only_help": "Überspringt Vorinformationen und ältere Versionen desselben Verfahrens; sie stehen in der Spalte 'Frühere Bekanntmachungen'. Abwählen, um alle Bekanntmachungen zu laden.",
+        "dedup_skipped": "ℹ️ {count} ältere Bekanntmachung(en) aus {procedures} Verfahren übersprungen",
+        "incremental": "Nur Neues und Geändertes seit dem letzten Lauf abrufen",
+        "incremental_help": "Merkt sich die Ausschreibungen jeder Ihrer Suchen. Unveränderte werden aus dem letzten Lauf übernommen, die Spalte 'Status' markiert neue und geänderte.",
+        "incremental_summary": "ℹ️ Seit dem letzten Lauf dieser Suche: {new} neu, {changed} geändert, {unchanged} unverändert",
+        "filter_changed_only": "Nur neue und geänderte Ausschreibungen",
+        "pushdown_header": "⚙️ In der TED-Suche filtern (weniger Downloads)",
+        "pushdown_enable": "Diese Filter in der TED-Abfrage anwenden",
+        "pushdown_help": "Nur passende Ausschreibungen werden heruntergeladen. Ausschreibungen ohne Angabe des Feldes (z.B. ohne Frist oder geschätzten Wert) werden ausgeschlossen.",
+        "pushdown_buyers": "Beschaffer (einer pro Zeile)",
+        "pushdown_deadline_from": "⏰ Abgabefrist ab",
+        "pushdown_deadline_to": "⏰ Abgabefrist bis",
+        "pushdown_min_value": "Min. geschätzter Wert (EUR)",
         
         # Errors and warnings
         "error_no_keywords": "❌ Bitte geben Sie entweder Schlüsselwörter oder CPV-Codes ein (oder beides)!",
         "searching": "Durchsuche TED-Datenbank... Dies kann einige Minuten dauern.",
         "success_found": "✅ {count} Ausschreibungen gefunden!",
         "warning_no_results": "⚠️ Keine Ergebnisse gefunden. Versuchen Sie, Ihre Suchkriterien anzupassen.",
+        "circuit_open": "⏸️ TED antwortet nicht, Pause für {seconds} s...",
+        "retry_round": "🔁 Erneuter Versuch für {count} Ausschreibung(en) in {seconds} s...",
+        "failures_header": "⚠️ {count} Ausschreibung(en) konnten nicht geladen werden",
+        "failures_download": "⬇️ Fehlerbericht herunterladen",
         "error_search": "❌ Fehler bei der Suche: {error}",
         
         # Results section
         "results_header": "📊 Suchergebnisse",
         "total_results": "📈 Gesamtergebnisse: **{count}** Ausschreibungen",
+        "results_footprint": "Ergebnisse dieser Sitzung: {memory:.1f} MB im Speicher, {disk:.1f} MB auf der Festplatte · Server: {sessions} Sitzung(en), {total:.1f} MB im Speicher",
         "filter_results": "🎯 Ergebnisse filtern",
         "filter_beschaffer": "✅ Nach Beschaffer filtern",
         "filter_beschaffer_help": "Wählen Sie mehrere Auftraggeber mit Checkboxen aus",
@@ -172,14 +326,41 @@ TRANSLATIONS = {
         "filter_frist": "⏰ Abgabefrist",
         "filter_frist_help": "Ausschreibungen mit Abgabefrist an oder nach diesem Datum filtern",
         "filtered_results": "🎯 Gefilterte Ergebnisse: **{count}** Ausschreibungen",
+        "grid_sort": "Sortieren nach",
+        "grid_sort_none": "(unsortiert)",
+        "grid_ascending": "Aufsteigend",
+        "grid_page_size": "Zeilen pro Seite",
+        "grid_page": "Seite",
+        "grid_page_info": "Seite {page} von {pages}",
+        "grid_details": "Details: {pubno}",
         "warning_volume": "⚠️ Ungültiger Volumenfilter",
+        "enrich_button": "🤖 KI-Bewertung & Zusammenfassung",
+        "enrich_help": "Bewertet jede Ausschreibung nach Relevanz für unsere Leistungsbereiche und fasst sie zusammen. Ergebnisse werden je Ausschreibung zwischengespeichert.",
+        "enrich_running": "KI bewertet {count} Ausschreibungen...",
+        "enrich_done": "✅ {count} Ausschreibungen bewertet ({failed} fehlgeschlagen)",
+        "filter_relevance": "🤖 Min. KI-Relevanz",
+        "filter_service_lines": "🤖 Leistungsbereiche",
         
         # Download buttons
         "download_filtered": "⬇️ Gefilterte Ergebnisse herunterladen ({count} Ausschreibungen)",
         "download_all": "⬇️ Alle Ergebnisse herunterladen ({count} Ausschreibungen)",
+        "docs_header": "📥 Vergabeunterlagen in den KI-Assistenten laden",
+        "docs_select": "Ausschreibungen",
+        "docs_select_help": "Die auf der Vergabeplattform dieser Ausschreibungen verlinkten Dokumente werden heruntergeladen und zur Dokumentenbibliothek hinzugefügt",
+        "docs_button": "📥 Dokumente abrufen",
+        "docs_running": "Lade Dokumente für {count} Ausschreibungen...",
+        "docs_done": "✅ {count} Dokument(e) zum KI-Assistenten hinzugefügt",
+        "docs_errors": "⚠️ {count} Link(s) konnten nicht geladen werden",
         
         # Chatbot section
         "config_header": "## 🔑 Konfiguration",
+        "profiling_header": "⏱️ Profiling",
+        "profiling_rerun": "Nächsten Seitenlauf profilieren",
+        "profiling_rerun_help": "Die nächste Interaktion mit der Seite läuft unter dem Profiler.",
+        "profiling_search": "Nächste Suche profilieren",
+        "profiling_search_help": "Die nächste TED-Suche läuft unter dem Profiler.",
+        "profiling_saved": "Gespeicherte Profile",
+        "profiling_download": "⬇️ .pstats herunterladen",
         "azure_connected": "✅ Azure AI Verbunden",
         "azure_warning": "⚠️ Azure-Anmeldedaten fehlen",
         "doc_library": "## 📚 Dokumentenbibliothek",
@@ -203,6 +384,9 @@ TRANSLATIONS = {
         "error_check_config": "Bitte überprüfen Sie Ihre Azure-Konfiguration in secrets.toml",
         "processing": "Verarbeite {filename}...",
         "query_label": "🔍 Abfrage: `{query}`",
+        "map_reduce_toggle": "📚 Gesamtdokument-Modus",
+        "map_reduce_help": "Große Dokumente abschnittsweise zusammenfassen (Map-Reduce), damit Fragen alle Abschnitte abdecken. Zusammenfassungen werden zwischengespeichert.",
+        "map_reduce_running": "Fasse {filename} abschnittsweise zusammen...",
     }
 }
 
@@ -227,16 +411,91 @@ CLIENT_SECRET = get_secret("CLIENT_SECRET")
 TENANT_ID = get_secret("TENANT_ID")
 REDIRECT_URI = get_secret("REDIRECT_URI", "http://localhost:8501")
 
-AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}" if TENANT_ID else ""
+# AUTHORITY_HOST points the sign-in at another Entra host or a local stand-in
+AUTHORITY_HOST = get_secret("AUTHORITY_HOST", "").rstrip("/")
+AUTHORITY = f"{AUTHORITY_HOST or 'https://login.microsoftonline.com'}/{TENANT_ID}" if TENANT_ID else ""
 SCOPE = ["https://graph.microsoft.com/User.Read"]
 
-API = "https://api.ted.europa.eu/v3/notices/search"
+# Overridable so the scraper can be pointed at a local stand-in (see loadtest.py)
+API = get_secret("TED_API_URL", "https://api.ted.europa.eu/v3/notices/search")
+TED_BASE_URL = get_secret("TED_BASE_URL", "https://ted.europa.eu").rstrip("/")
+
+AZURE_ENDPOINT = get_secret("AZURE_ENDPOINT", "")
+AZURE_API_KEY = get_secret("AZURE_API_KEY", "")
+DEPLOYMENT_NAME = get_secret("DEPLOYMENT_NAME", "gpt-4o-mini")
+AZURE_API_VERSION = "2024-08-01-preview"
 
 # Avatars
 JKM_LOGO_URL = "https://www.xing.com/imagecache/public/scaled_original_image/eyJ1dWlkIjoiMGE2MTk2MTYtODI4Zi00MWZlLWEzN2ItMjczZGM2ODc5MGJmIiwiYXBwX2NvbnRleHQiOiJlbnRpdHktcGFnZXMiLCJtYXhfd2lkdGgiOjMyMCwibWF4X2hlaWdodCI6MzIwfQ?signature=a21e5c1393125a94fc9765898c25d73a064665dc3aacf872667c902d7ed9c3f9"
 BOT_AVATAR_URL = "https://raw.githubusercontent.com/PratikSondkarJKM/AkquiseWescraper/refs/heads/main/botavatar.svg"
 
 # ------------------- AUTHENTICATION -------------------
+# The MSAL application is built once per process, so authority discovery is not
+# repeated for every login. Its token cache is persisted encrypted on disk, and
+# a random session id in a cookie lets a refresh or a new tab sign in silently
+# with the cached refresh token instead of a full OAuth redirect. Streamlit
+# cannot set HttpOnly cookies, so the cookie is written by a small component;
+# the id never appears in the URL and logging out deletes its session file.
+AUTH_SESSION_TTL = 12 * 3600
+AUTH_COOKIE = "akquise_sid"
+
+def _token_cache_path():
+    return get_secret("TOKEN_CACHE_PATH", "") or os.path.join(CACHE_DIR, "msal", "token_cache.bin")
+
+def _token_cache_salt():
+    path = os.path.join(os.path.dirname(_token_cache_path()), "token_cache.salt")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(16))
+    except FileExistsError:
+        pass
+    with open(path, "rb") as f:
+        return f.read()
+
+def _token_cache_fernet():
+    """Fernet for the token cache: TOKEN_CACHE_KEY, or a key derived from CLIENT_SECRET with HKDF."""
+    key = get_secret("TOKEN_CACHE_KEY", "")
+    if not key:
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=_token_cache_salt(), info=b"msal-token-cache")
+        key = base64.urlsafe_b64encode(hkdf.derive(CLIENT_SECRET.encode("utf-8")))
+    return Fernet(key)
+
+@st.cache_resource(show_spinner=False)
+def _msal_state():
+    cache = SerializableTokenCache()
+    try:
+        with open(_token_cache_path(), "rb") as f:
+            cache.deserialize(_token_cache_fernet().decrypt(f.read()).decode("utf-8"))
+    except (OSError, InvalidToken, ValueError):
+        pass
+    app = ConfidentialClientApplication(
+        client_id=CLIENT_ID,
+        authority=AUTHORITY,
+        client_credential=CLIENT_SECRET,
+        token_cache=cache,
+        http_cache={},
+        instance_discovery=False if AUTHORITY_HOST else None
+    )
+    return {"app": app, "cache": cache, "lock": threading.Lock()}
+
+def _persist_token_cache():
+    state = _msal_state()
+    with state["lock"]:
+        if not state["cache"].has_state_changed:
+            return
+        path = _token_cache_path()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(_token_cache_fernet().encrypt(state["cache"].serialize().encode("utf-8")))
+            os.replace(tmp_path, path)
+            state["cache"].has_state_changed = False
+        except OSError:
+            pass
+
 def build_msal_app():
     if not CLIENT_ID or not CLIENT_SECRET or not TENANT_ID:
         st.error("❌ Microsoft OAuth credentials not configured!")
@@ -252,15 +511,75 @@ def build_msal_app():
         """)
         st.stop()
     
-    return ConfidentialClientApplication(
-        client_id=CLIENT_ID,
-        authority=AUTHORITY,
-        client_credential=CLIENT_SECRET
-    )
+    return _msal_state()["app"]
 
 def fetch_token(auth_code):
     msal_app = build_msal_app()
-    return msal_app.acquire_token_by_authorization_code(auth_code, scopes=SCOPE, redirect_uri=REDIRECT_URI)
+    result = msal_app.acquire_token_by_authorization_code(auth_code, scopes=SCOPE, redirect_uri=REDIRECT_URI)
+    _persist_token_cache()
+    return result
+
+def _auth_session_path(sid):
+    return os.path.join(CACHE_DIR, "auth-sessions", hashlib.sha256(sid.encode("utf-8")).hexdigest())
+
+def save_auth_session(home_account_id):
+    """Remember which cached account belongs to a new session id and return the id."""
+    sid = secrets.token_urlsafe(32)
+    path = _auth_session_path(sid)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(_token_cache_fernet().encrypt(home_account_id.encode("utf-8")))
+    except OSError:
+        return None
+    return sid
+
+def _auth_session_account(sid):
+    path = _auth_session_path(sid)
+    try:
+        if time.time() - os.path.getmtime(path) > AUTH_SESSION_TTL:
+            os.remove(path)
+            return None
+        with open(path, "rb") as f:
+            home_account_id = _token_cache_fernet().decrypt(f.read()).decode("utf-8")
+    except (OSError, InvalidToken):
+        return None
+    accounts = [a for a in build_msal_app().get_accounts() if a.get("home_account_id") == home_account_id]
+    return accounts[0] if accounts else None
+
+def acquire_token_silently(sid):
+    """Return (access token, account) for the session id from the token cache, or (None, None)."""
+    account = _auth_session_account(sid)
+    if account is None:
+        return None, None
+    result = build_msal_app().acquire_token_silent(SCOPE, account=account)
+    _persist_token_cache()
+    token = (result or {}).get("access_token")
+    return (token, account) if token else (None, None)
+
+def _set_auth_cookie(sid, max_age):
+    secure = "; Secure" if REDIRECT_URI.startswith("https://") else ""
+    components.html(
+        f"<script>window.parent.document.cookie = {json.dumps(f'{AUTH_COOKIE}={sid}; Path=/; Max-Age={max_age}; SameSite=Strict{secure}')};</script>",
+        height=0,
+    )
+
+def logout():
+    """Sign the user out: forget the cached account, delete the session file and the cookie."""
+    sid = st.session_state.get("auth_sid") or st.context.cookies.get(AUTH_COOKIE)
+    if sid:
+        account = _auth_session_account(sid)
+        if account is not None:
+            state = _msal_state()
+            state["app"].remove_account(account)
+            state["cache"].has_state_changed = True
+            _persist_token_cache()
+        try:
+            os.remove(_auth_session_path(sid))
+        except OSError:
+            pass
+    for key in ("user_token", "user_id", "user_name", "auth_sid", "auth_cookie_pending"):
+        st.session_state.pop(key, None)
 
 def login_button():
     msal_app = build_msal_app()
@@ -327,6 +646,7 @@ def login_button():
     """, unsafe_allow_html=True)
 
 def auth_flow():
+    """Sign the user in; afterwards user_id ("oid.tid") and user_name (UPN) are in session state."""
     params = st.query_params
     if "code" in params and "user_token" not in st.session_state:
         code = params["code"]
@@ -336,17 +656,74 @@ def auth_flow():
         if "access_token" in token_data:
             st.session_state["user_token"] = token_data["access_token"]
             st.query_params.clear()
+            claims = token_data.get("id_token_claims") or {}
+            if claims.get("oid") and claims.get("tid"):
+                st.session_state["user_id"] = f"{claims['oid']}.{claims['tid']}"
+                st.session_state["user_name"] = claims.get("preferred_username", "")
+                sid = save_auth_session(st.session_state["user_id"])
+                if sid:
+                    st.session_state["auth_sid"] = sid
+                    st.session_state["auth_cookie_pending"] = True
             st.rerun()
         else:
             st.error("Microsoft login failed. Please try again.")
             st.stop()
+    sid = st.context.cookies.get(AUTH_COOKIE)
+    if "user_token" not in st.session_state and sid:
+        token, account = acquire_token_silently(sid)
+        if token:
+            st.session_state["user_token"] = token
+            st.session_state["user_id"] = account.get("home_account_id", "")
+            st.session_state["user_name"] = account.get("username", "")
+            st.session_state["auth_sid"] = sid
     if "user_token" not in st.session_state:
+        if sid:
+            _set_auth_cookie("", 0)
         login_button()
         st.stop()
+    if st.session_state.pop("auth_cookie_pending", False):
+        _set_auth_cookie(st.session_state["auth_sid"], AUTH_SESSION_TTL)
     return True
 
 # ---------------- TED SCRAPER FUNCTIONS ----------------
-def fetch_all_notices_to_json(cpv_codes, keywords, date_start, date_end, buyer_country, json_file):
+# TED expert-query fields used when result filters are pushed into the search
+TED_FILTER_FIELDS = {
+    "buyer_name": "buyer-name",
+    "deadline": "deadline-receipt-tender-date-lot",
+    "estimated_value": "estimated-value-proc",
+}
+
+def build_filter_clauses(query_filters):
+    """Turn result filters into TED expert-query clauses.
+
+    query_filters may contain "buyer_names" (list of str), "deadline_from" and
+    "deadline_to" (dates) and "min_value" (number).
+    """
+    clauses = []
+    buyer_names = [b.replace('"', '').strip() for b in query_filters.get("buyer_names") or [] if b.strip()]
+    if buyer_names:
+        field = TED_FILTER_FIELDS["buyer_name"]
+        clauses.append("(" + " OR ".join(f'{field}~("{b}")' for b in buyer_names) + ")")
+    deadline_from = query_filters.get("deadline_from")
+    deadline_to = query_filters.get("deadline_to")
+    if deadline_from or deadline_to:
+        bounds = ""
+        if deadline_from:
+            bounds += f">={deadline_from.strftime('%Y%m%d')}"
+        if deadline_to:
+            bounds += f"<={deadline_to.strftime('%Y%m%d')}"
+        clauses.append(f"({TED_FILTER_FIELDS['deadline']} {bounds})")
+    if query_filters.get("min_value"):
+        clauses.append(f"({TED_FILTER_FIELDS['estimated_value']} >={float(query_filters['min_value']):.0f})")
+    return clauses
+
+# procedure-identifier/notice-version let us group notices of one procedure
+# (prior information, contract notice, corrigenda) before any XML is fetched.
+# The deadline lets incremental runs notice a moved deadline without fetching the XML.
+SEARCH_FIELDS = ["publication-number", "links", "procedure-identifier", "notice-version", "publication-date",
+                 TED_FILTER_FIELDS["deadline"]]
+
+def fetch_all_notices_to_json(cpv_codes, keywords, date_start, date_end, buyer_country, json_file, query_filters=None):
     """Fetch TED notices with CORRECT TED API v3 query syntax"""
     query_parts = []
     
@@ -362,12 +739,15 @@ def fetch_all_notices_to_json(cpv_codes, keywords, date_start, date_end, buyer_c
     
     query_parts.append("(notice-type IN (pin-cfc-standard pin-cfc-social qu-sy cn-standard cn-social subco cn-desg))")
     
+    if query_filters:
+        query_parts.extend(build_filter_clauses(query_filters))
+    
     query = " AND ".join(query_parts)
     st.info(t("query_label", query=query))
     
     payload = {
         "query": query,
-        "fields": ["publication-number", "links"],
+        "fields": SEARCH_FIELDS,
         "scope": "ACTIVE",
         "checkQuerySyntax": False,
         "paginationMode": "PAGE_NUMBER",
@@ -424,6 +804,54 @@ def fetch_all_notices_to_json(cpv_codes, keywords, date_start, date_end, buyer_c
     
     return len(all_notices)
 
+def _search_value(notice, field):
+    """Search API values come as a string, a list or a per-language dict."""
+    value = notice.get(field)
+    if isinstance(value, dict):
+        value = next(iter(value.values()), None)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return str(value).strip() if value is not None else ""
+
+def _notice_recency(notice):
+    """Sort key: publication date, then notice version, then publication number."""
+    version = _search_value(notice, "notice-version")
+    number, _, year = _search_value(notice, "publication-number").partition("-")
+    return (
+        _norm_date(_search_value(notice, "publication-date")),
+        int(version) if version.isdigit() else 0,
+        int(year) if year.isdigit() else 0,
+        int(number) if number.isdigit() else 0,
+    )
+
+def latest_per_procedure(notices):
+    """Keep the newest notice of every procedure.
+
+    Returns (notices, superseded) where superseded maps the publication number
+    of each kept notice to the older publication numbers of its procedure.
+    Notices without a procedure identifier (legacy TED) are all kept.
+    """
+    procedures = {}
+    kept = []
+    for n in notices:
+        procedure = _search_value(n, "procedure-identifier")
+        if procedure:
+            procedures.setdefault(procedure, []).append(n)
+        else:
+            kept.append(n)
+    superseded = {}
+    for group in procedures.values():
+        group.sort(key=_notice_recency, reverse=True)
+        newest = group[0]
+        kept.append(newest)
+        if len(group) > 1:
+            superseded[_search_value(newest, "publication-number")] = [
+                _search_value(n, "publication-number") for n in group[1:]
+            ]
+    order = {id(n): idx for idx, n in enumerate(notices)}
+    kept.sort(key=lambda n: order[id(n)])
+    return kept, superseded
+
 def _get_links_block(notice: dict) -> dict:
     links = notice.get("links") or {}
     if isinstance(links, dict) and "links" in links and isinstance(links["links"], dict):
@@ -447,33 +875,56 @@ def _extract_xml_urls_from_notice(notice: dict) -> list:
         urls.append(xml_block)
     return urls
 
-def fetch_notice_xml(session: requests.Session, pubno: str, notice: dict) -> bytes:
+# (connect, read) seconds; a short connect timeout makes outages show up quickly
+XML_FETCH_TIMEOUT = (10, 60)
+# Budget for notice XML requests, shared by all sessions (and all replicas with SHARED_STATE_URL)
+TED_XML_REQUESTS_PER_SEC = 4
+TED_XML_BURST = 4
+
+def fetch_notice_xml(session: requests.Session, pubno: str, notice: dict, timeout=XML_FETCH_TIMEOUT, limiter=None) -> bytes:
+    """Try the XML links of a notice, then the public TED URLs.
+
+    Every request is charged to limiter (see get_rate_limiter), if given.
+    Raises requests.RequestException if TED did not answer properly (connection
+    error, timeout, 429/5xx) - worth retrying later - and RuntimeError if TED
+    answered but has no XML for the notice.
+    """
     xml_headers = {"Accept":"application/xml","User-Agent":"Mozilla/5.0"}
-    for url in _extract_xml_urls_from_notice(notice):
+    server_error = None
+
+    def get(url, headers):
+        # Connection errors and timeouts propagate: the other probes hit the same host.
+        nonlocal server_error
+        if limiter is not None:
+            rate_limiter_acquire(limiter)
         try:
-            r = session.get(url, headers=xml_headers, timeout=60)
-            if r.status_code == 200 and r.content.strip():
-                return r.content
+            r = session.get(url, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            raise
         except requests.RequestException:
-            pass
+            return None
+        if r.status_code == 429 or r.status_code >= 500:
+            server_error = requests.HTTPError(f"{r.status_code} from {url}", response=r)
+            return None
+        return r
+
+    for url in _extract_xml_urls_from_notice(notice):
+        r = get(url, xml_headers)
+        if r is not None and r.status_code == 200 and r.content.strip():
+            return r.content
     for lang in ("en","de","fr"):
-        url = f"https://ted.europa.eu/{lang}/notice/{pubno}/xml"
-        try:
-            r = session.get(url, headers=xml_headers, timeout=60)
-            if r.status_code == 200 and r.content.strip():
-                return r.content
-        except requests.RequestException:
-            pass
-    detail_url = f"https://ted.europa.eu/en/notice/-/detail/{pubno}"
-    try:
-        html = session.get(detail_url, headers={"User-Agent":"Mozilla/5.0"}, timeout=60).text
-        m = re.search(r'https://ted\.europa\.eu/(?:en|de|fr)/notice/' + re.escape(pubno) + r'/xml', html)
+        r = get(f"{TED_BASE_URL}/{lang}/notice/{pubno}/xml", xml_headers)
+        if r is not None and r.status_code == 200 and r.content.strip():
+            return r.content
+    detail = get(f"{TED_BASE_URL}/en/notice/-/detail/{pubno}", {"User-Agent":"Mozilla/5.0"})
+    if detail is not None:
+        m = re.search(re.escape(TED_BASE_URL) + r'/(?:en|de|fr)/notice/' + re.escape(pubno) + r'/xml', detail.text)
         if m:
-            r = session.get(m.group(0), headers=xml_headers, timeout=60)
-            if r.status_code == 200 and r.content.strip():
+            r = get(m.group(0), xml_headers)
+            if r is not None and r.status_code == 200 and r.content.strip():
                 return r.content
-    except requests.RequestException:
-        pass
+    if server_error is not None:
+        raise server_error
     raise RuntimeError(f"No XML found for {pubno}")
 
 def _first_text(nodes):
@@ -515,7 +966,7 @@ def _duration_to_days(val: str, unit: str) -> int or None:
         return int(round(num * 365))
     return None
 
-def parse_xml_fields(xml_bytes: bytes) -> dict:
+def _parse_notice_root(xml_bytes: bytes):
     parser = etree.XMLParser(recover=True, huge_tree=True)
     root = etree.parse(BytesIO(xml_bytes), parser)
     ns = {k: v for k, v in (root.getroot().nsmap or {}).items() if k}
@@ -523,22 +974,32 @@ def parse_xml_fields(xml_bytes: bytes) -> dict:
     ns.setdefault("cac","urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2")
     ns.setdefault("efac","http://data.europa.eu/p27/eforms-ubl-extension-aggregate-components/1")
     ns.setdefault("efbc","http://data.europa.eu/p27/eforms-ubl-extension-basic-components/1")
+    return root, ns
 
-    out = {}
-    out["Beschaffer"] = _first_text(
+def _extract_buyer(root, ns) -> dict:
+    return {"Beschaffer": _first_text(
         root.xpath(".//cac:ContractingParty//cac:PartyName/cbc:Name", namespaces=ns)
         or root.xpath(".//efac:Organizations//efac:Company/cac:PartyName/cbc:Name", namespaces=ns)
-    )
-    out["Projektbezeichnung"] = _clean_title(
+    )}
+
+def _extract_title(root, ns) -> dict:
+    return {"Projektbezeichnung": _clean_title(
         _first_text(root.xpath(".//cac:ProcurementProject/cbc:Name | .//cbc:Title | .//efbc:Title", namespaces=ns))
-    )
-    out["Ort/Region"] = _first_text(root.xpath("//cac:PostalAddress[1]/cbc:CityName", namespaces=ns))
-    out["Vergabeplattform"] = _first_text(
+    )}
+
+def _extract_region(root, ns) -> dict:
+    return {"Ort/Region": _first_text(root.xpath("//cac:PostalAddress[1]/cbc:CityName", namespaces=ns))}
+
+def _extract_platform(root, ns) -> dict:
+    return {"Vergabeplattform": _first_text(
         root.xpath(".//cbc:AccessToolsURI | .//cbc:WebsiteURI | .//cbc:URI | .//cbc:EndpointID", namespaces=ns)
-    )
+    )}
+
+def _extract_ted_link(root, ns) -> dict:
     pub_id = _first_text(root.xpath(".//efbc:NoticePublicationID[@schemeName='ojs-notice-id']", namespaces=ns))
-    out["Ted-Link"] = f"https://ted.europa.eu/en/notice/-/detail/{pub_id}" if pub_id else ""
+    return {"Ted-Link": f"https://ted.europa.eu/en/notice/-/detail/{pub_id}" if pub_id else ""}
 
+def _extract_project_period(root, ns) -> dict:
     start_nodes = root.xpath(
         ".//cac:ProcurementProject/cac:PlannedPeriod/cbc:StartDate "
         "| .//cac:ProcurementProjectLot//cac:ProcurementProject/cac:PlannedPeriod/cbc:StartDate",
@@ -571,20 +1032,25 @@ def parse_xml_fields(xml_bytes: bytes) -> dict:
             if end_dt:
                 start_norm = (end_dt - timedelta(days=days)).strftime("%Y-%m-%d")
 
-    out["Projektstart"] = start_norm
-    out["Projektende"] = end_norm
+    return {"Projektstart": start_norm, "Projektende": end_norm}
+
+def _criteria_columns(crit_text: str) -> dict:
+    crit_text = re.sub(r"\bslc-[a-z0-9\-]+\b", "", crit_text, flags=re.I).strip()
+    return {
+        "Geforderte Unternehmensreferenzen": crit_text,
+        "Geforderte Kriterien CVs": "CV" if re.search(
+            r"\b(CV|Lebenslauf|Schlüsselpersonal|key staff|personaleinsatz)\b", crit_text, re.I
+        ) else "",
+    }
 
+def _extract_criteria(root, ns) -> dict:
     crit_nodes = root.xpath(
         ".//*[contains(local-name(),'SelectionCriteria') or contains(local-name(),'SelectionCriterion')]/cbc:Description",
         namespaces=ns
     )
-    crit_text = " ".join((n.text or "").strip() for n in crit_nodes if (n.text or "").strip())
-    crit_text = re.sub(r"\bslc-[a-z0-9\-]+\b", "", crit_text, flags=re.I).strip()
-    out["Geforderte Unternehmensreferenzen"] = crit_text
-    out["Geforderte Kriterien CVs"] = "CV" if re.search(
-        r"\b(CV|Lebenslauf|Schlüsselpersonal|key staff|personaleinsatz)\b", crit_text, re.I
-    ) else ""
+    return _criteria_columns(" ".join((n.text or "").strip() for n in crit_nodes if (n.text or "").strip()))
 
+def _extract_volume(root, ns) -> dict:
     amount_nodes = root.xpath(
         ".//cbc:EstimatedOverallContractAmount | .//cbc:EstimatedOverallContractAmount/cbc:Value | .//efbc:EstimatedValue | .//cbc:PayableAmount",
         namespaces=ns
@@ -599,8 +1065,9 @@ def parse_xml_fields(xml_bytes: bytes) -> dict:
                 if currency:
                     value_text += f" {currency}"
                 break
-    out["Projektvolumen"] = value_text or ""
+    return {"Projektvolumen": value_text or ""}
 
+def _extract_deadline(root, ns) -> dict:
     tender_deadline_date = _norm_date(
         _first_text(root.xpath(".//cac:TenderSubmissionDeadlinePeriod/cbc:EndDate", namespaces=ns))
     )
@@ -623,13 +1090,15 @@ def parse_xml_fields(xml_bytes: bytes) -> dict:
         participation_deadline_date = _norm_date(
             _first_text(root.xpath(".//efac:ParticipationRequestReceptionPeriod/cbc:EndDate", namespaces=ns))
         )
-    out["Frist Abgabedatum"] = tender_deadline_date or participation_deadline_date
+    return {"Frist Abgabedatum": tender_deadline_date or participation_deadline_date}
 
+def _extract_publication_date(root, ns) -> dict:
     pub_date = _first_text(root.xpath(".//efbc:PublicationDate", namespaces=ns))
     if not pub_date:
         pub_date = _first_text(root.xpath(".//cbc:PublicationDate", namespaces=ns))
-    out["Veröffentlichung Datum"] = _norm_date(pub_date)
+    return {"Veröffentlichung Datum": _norm_date(pub_date)}
 
+def _extract_cpv(root, ns) -> dict:
     cpv_codes_set = set()
     main_cpv_nodes = root.xpath(".//cac:MainCommodityClassification/cbc:ItemClassificationCode", namespaces=ns)
     for node in main_cpv_nodes:
@@ -639,83 +1108,557 @@ def parse_xml_fields(xml_bytes: bytes) -> dict:
     for node in add_cpv_nodes:
         if node.text:
             cpv_codes_set.add(node.text.strip())
-    out["CPV Codes"] = ", ".join(sorted(cpv_codes_set))
+    return {"CPV Codes": ", ".join(sorted(cpv_codes_set))}
 
+def _extract_lots(root, ns) -> dict:
     lots = root.xpath(".//cac:ProcurementProjectLot", namespaces=ns)
     lot_names = []
     for lot in lots:
         lot_name = lot.xpath(".//cac:ProcurementProject/cbc:Name", namespaces=ns)
         if lot_name and len(lot_name) > 0:
-            text = lot_name[0].text.strip()
+            text = (lot_name[0].text or "").strip()
             if text:
                 lot_names.append(text)
-    out["Leistungen/Rollen"] = "; ".join(lot_names)
+    return {"Leistungen/Rollen": "; ".join(lot_names)}
+
+# ---- Legacy TED schema (TED_EXPORT, R2.0.x) ----
+def _legacy_xpath(node, path, ns):
+    # Very old exports have no namespace; drop the prefix for those
+    return node.xpath(path, namespaces=ns) if ns else node.xpath(path.replace("t:", ""))
+
+def _legacy_form(root, ns):
+    forms = _legacy_xpath(root, "t:FORM_SECTION/*[@CATEGORY='ORIGINAL']", ns) or _legacy_xpath(root, "t:FORM_SECTION/*", ns)
+    return forms[0] if forms else root
+
+def _legacy_text(node, path, ns):
+    return _first_text(_legacy_xpath(node, path, ns))
+
+def _legacy_paragraphs(node, path, ns):
+    return " ".join(
+        " ".join(el.itertext()).strip() for el in _legacy_xpath(node, path, ns) if " ".join(el.itertext()).strip()
+    )
+
+def _norm_legacy_date(d: str) -> str:
+    d = (d or "").strip()
+    m = re.match(r"^(\d{4})(\d{2})(\d{2})", d)
+    if m:
+        return f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
+    return _norm_date(d)
+
+def _legacy_buyer(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    return {"Beschaffer": _legacy_text(form, "t:CONTRACTING_BODY/t:ADDRESS_CONTRACTING_BODY/t:OFFICIALNAME", ns)}
+
+def _legacy_title(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    return {"Projektbezeichnung": _clean_title(_legacy_paragraphs(form, "t:OBJECT_CONTRACT/t:TITLE", ns))}
+
+def _legacy_region(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    return {"Ort/Region": _legacy_text(form, "t:CONTRACTING_BODY/t:ADDRESS_CONTRACTING_BODY/t:TOWN", ns)}
+
+def _legacy_platform(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    for path in ("t:CONTRACTING_BODY/t:URL_DOCUMENT", "t:CONTRACTING_BODY/t:URL_PARTICIPATION",
+                 "t:CONTRACTING_BODY/t:ADDRESS_CONTRACTING_BODY/t:URL_BUYER",
+                 "t:CONTRACTING_BODY/t:ADDRESS_CONTRACTING_BODY/t:URL_GENERAL"):
+        url = _legacy_text(form, path, ns)
+        if url:
+            return {"Vergabeplattform": url}
+    return {"Vergabeplattform": ""}
+
+def _legacy_ted_link(root, ns) -> dict:
+    pub_id = root.get("DOC_ID") or ""
+    if not pub_id:
+        m = re.match(r"(\d{4})/S \d+-0*(\d+)", _legacy_text(root, "t:CODED_DATA_SECTION/t:NOTICE_DATA/t:NO_DOC_OJS", ns))
+        if m:
+            pub_id = f"{m.group(2)}-{m.group(1)}"
+    return {"Ted-Link": f"https://ted.europa.eu/en/notice/-/detail/{pub_id}" if pub_id else ""}
+
+def _legacy_project_period(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    start_norm = _norm_legacy_date(_legacy_text(form, "t:OBJECT_CONTRACT/t:OBJECT_DESCR/t:DATE_START", ns))
+    end_norm = _norm_legacy_date(_legacy_text(form, "t:OBJECT_CONTRACT/t:OBJECT_DESCR/t:DATE_END", ns))
+    if not start_norm and end_norm:
+        for dn in _legacy_xpath(form, "t:OBJECT_CONTRACT/t:OBJECT_DESCR/t:DURATION", ns):
+            days = _duration_to_days((dn.text or "").strip(), dn.get("TYPE"))
+            end_dt = _parse_iso_date(end_norm)
+            if days and end_dt:
+                start_norm = (end_dt - timedelta(days=days)).strftime("%Y-%m-%d")
+                break
+    return {"Projektstart": start_norm, "Projektende": end_norm}
+
+def _legacy_criteria(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    return _criteria_columns(_legacy_paragraphs(form, "t:LEFTI/*", ns))
+
+def _legacy_volume(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    for path in ("t:OBJECT_CONTRACT/t:VAL_ESTIMATED_TOTAL", "t:OBJECT_CONTRACT/t:VAL_TOTAL",
+                 "t:OBJECT_CONTRACT/t:OBJECT_DESCR/t:VAL_OBJECT"):
+        for node in _legacy_xpath(form, path, ns):
+            if node.text and node.text.strip():
+                value_text = node.text.strip()
+                if node.get("CURRENCY"):
+                    value_text += f" {node.get('CURRENCY')}"
+                return {"Projektvolumen": value_text}
+    return {"Projektvolumen": ""}
+
+def _legacy_deadline(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    deadline = _legacy_text(form, "t:PROCEDURE/t:DATE_RECEIPT_TENDERS", ns) or _legacy_text(
+        root, "t:CODED_DATA_SECTION/t:CODIF_DATA/t:DT_DATE_FOR_SUBMISSION", ns
+    )
+    return {"Frist Abgabedatum": _norm_legacy_date(deadline)}
 
+def _legacy_publication_date(root, ns) -> dict:
+    return {"Veröffentlichung Datum": _norm_legacy_date(
+        _legacy_text(root, "t:CODED_DATA_SECTION/t:REF_OJS/t:DATE_PUB", ns)
+    )}
+
+def _legacy_cpv(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    nodes = _legacy_xpath(form, "t:OBJECT_CONTRACT/t:CPV_MAIN/t:CPV_CODE | t:OBJECT_CONTRACT//t:CPV_ADDITIONAL/t:CPV_CODE", ns)
+    nodes += _legacy_xpath(root, "t:CODED_DATA_SECTION/t:NOTICE_DATA/t:ORIGINAL_CPV", ns)
+    return {"CPV Codes": ", ".join(sorted({n.get("CODE").strip() for n in nodes if n.get("CODE")}))}
+
+def _legacy_lots(root, ns) -> dict:
+    form = _legacy_form(root, ns)
+    lot_names = []
+    for lot in _legacy_xpath(form, "t:OBJECT_CONTRACT/t:OBJECT_DESCR", ns):
+        text = _legacy_paragraphs(lot, "t:TITLE", ns)
+        if text:
+            lot_names.append(text)
+    return {"Leistungen/Rollen": "; ".join(lot_names)}
+
+# Registries of field extractors per notice schema, in output column order.
+# Every schema produces the same columns (ALL_FIELDS). "cost" is the relative
+# parse cost (1 = one targeted XPath, 10 = a scan over every element), so
+# callers can see what a column selection saves.
+FIELD_EXTRACTORS = {
+    "eforms": [
+        {"columns": ("Beschaffer",), "cost": 2, "func": _extract_buyer},
+        {"columns": ("Projektbezeichnung",), "cost": 1, "func": _extract_title},
+        {"columns": ("Ort/Region",), "cost": 1, "func": _extract_region},
+        {"columns": ("Vergabeplattform",), "cost": 1, "func": _extract_platform},
+        {"columns": ("Ted-Link",), "cost": 1, "func": _extract_ted_link},
+        {"columns": ("Projektstart", "Projektende"), "cost": 3, "func": _extract_project_period},
+        {"columns": ("Geforderte Unternehmensreferenzen", "Geforderte Kriterien CVs"), "cost": 10, "func": _extract_criteria},
+        {"columns": ("Projektvolumen",), "cost": 2, "func": _extract_volume},
+        {"columns": ("Frist Abgabedatum",), "cost": 4, "func": _extract_deadline},
+        {"columns": ("Veröffentlichung Datum",), "cost": 1, "func": _extract_publication_date},
+        {"columns": ("CPV Codes",), "cost": 2, "func": _extract_cpv},
+        {"columns": ("Leistungen/Rollen",), "cost": 3, "func": _extract_lots},
+    ],
+    "ted-legacy": [
+        {"columns": ("Beschaffer",), "cost": 1, "func": _legacy_buyer},
+        {"columns": ("Projektbezeichnung",), "cost": 1, "func": _legacy_title},
+        {"columns": ("Ort/Region",), "cost": 1, "func": _legacy_region},
+        {"columns": ("Vergabeplattform",), "cost": 1, "func": _legacy_platform},
+        {"columns": ("Ted-Link",), "cost": 1, "func": _legacy_ted_link},
+        {"columns": ("Projektstart", "Projektende"), "cost": 2, "func": _legacy_project_period},
+        {"columns": ("Geforderte Unternehmensreferenzen", "Geforderte Kriterien CVs"), "cost": 2, "func": _legacy_criteria},
+        {"columns": ("Projektvolumen",), "cost": 1, "func": _legacy_volume},
+        {"columns": ("Frist Abgabedatum",), "cost": 1, "func": _legacy_deadline},
+        {"columns": ("Veröffentlichung Datum",), "cost": 1, "func": _legacy_publication_date},
+        {"columns": ("CPV Codes",), "cost": 2, "func": _legacy_cpv},
+        {"columns": ("Leistungen/Rollen",), "cost": 1, "func": _legacy_lots},
+    ],
+}
+ALL_FIELDS = [col for extractor in FIELD_EXTRACTORS["eforms"] for col in extractor["columns"]]
+
+UBL_NAMESPACE_PREFIX = "urn:oasis:names:specification:ubl:schema:xsd:"
+
+def detect_notice_schema(root_el):
+    """Return (schema, version) of a notice: "eforms", "ted-legacy" or "unknown"."""
+    qname = etree.QName(root_el)
+    if qname.localname == "TED_EXPORT":
+        m = re.search(r"/(R[\d.]+)/", qname.namespace or "")
+        return "ted-legacy", m.group(1) if m else (root_el.get("VERSION") or "")
+    if (qname.namespace or "").startswith(UBL_NAMESPACE_PREFIX):
+        customization = root_el.find(f"{{{UBL_NAMESPACE_PREFIX}CommonBasicComponents-2}}CustomizationID")
+        version = (customization.text or "").strip() if customization is not None else ""
+        return "eforms", version
+    return "unknown", ""
+
+def fields_cost(fields=None, schema="eforms") -> int:
+    """Relative parse cost per notice of extracting the given columns."""
+    wanted = set(ALL_FIELDS if fields is None else fields)
+    return sum(e["cost"] for e in FIELD_EXTRACTORS[schema] if wanted.intersection(e["columns"]))
+
+# Recorded on rows parsed with all fields and in the XML archive. Bump it
+# whenever parse_xml_fields output changes, then run "python app.py reprocess --stale".
+PARSER_VERSION = "1"
+
+def _parse_notice(xml_bytes: bytes):
+    """Return (schema, root, ns) of a notice, ready for that schema's extractors."""
+    root, ns = _parse_notice_root(xml_bytes)
+    schema, _ = detect_notice_schema(root.getroot())
+    if schema == "ted-legacy":
+        root = root.getroot()
+        ns = {"t": etree.QName(root).namespace} if etree.QName(root).namespace else None
+    return schema, root, ns
+
+def parse_xml_fields(xml_bytes: bytes, fields=None) -> dict:
+    """Extract the requested columns (all of ALL_FIELDS by default) from a notice.
+
+    The notice schema is detected from the root element and only that
+    schema's extractors producing a requested column are run. Unknown schemas
+    go through the eForms extractors.
+    """
+    return _extract_notice_fields(*_parse_notice(xml_bytes), fields)
+
+def _extract_notice_fields(schema, root, ns, fields=None) -> dict:
+    wanted = set(ALL_FIELDS if fields is None else fields)
+    out = {}
+    for extractor in FIELD_EXTRACTORS.get(schema, FIELD_EXTRACTORS["eforms"]):
+        if wanted.intersection(extractor["columns"]):
+            values = extractor["func"](root, ns)
+            out.update((col, values[col]) for col in extractor["columns"] if col in wanted)
     return out
 
-def main_scraper(cpv_codes, keywords, date_start, date_end, buyer_country):
-    """Modified to return rows instead of saving to Excel directly"""
+RETRY_ROUNDS = 3
+RETRY_BACKOFF = 10  # seconds before the first retry round, doubled per round
+
+def search_notices(cpv_codes, keywords, date_start, date_end, buyer_country, query_filters=None):
+    """Run one TED search and return the notices it found."""
     temp_json = tempfile.mktemp(suffix=".json")
+    try:
+        count = fetch_all_notices_to_json(
+            cpv_codes, keywords, date_start, date_end, buyer_country, temp_json, query_filters
+        )
+        if count == 0:
+            return []
+        with open(temp_json, "r", encoding="utf-8") as f:
+            return json.load(f).get("notices", [])
+    finally:
+        if os.path.exists(temp_json):
+            os.remove(temp_json)
+
+def main_scraper(cpv_codes, keywords, date_start, date_end, buyer_country, query_filters=None, fields=None,
+                 latest_only=True, incremental=False):
+    """Modified to return rows instead of saving to Excel directly.
+
+    fields selects the columns to extract (default: ALL_FIELDS). With
+    latest_only, only the newest notice of each procedure is fetched and the
+    older ones are listed in its "Frühere Bekanntmachungen" column. With
+    incremental, only notices that are new or changed since the last run of
+    the same search are fetched (see fetch_incremental).
+    """
+    st.session_state.scrape_failures = []
+    notices = search_notices(cpv_codes, keywords, date_start, date_end, buyer_country, query_filters)
     
-    count = fetch_all_notices_to_json(cpv_codes, keywords, date_start, date_end, buyer_country, temp_json)
-    
-    if count == 0:
+    if not notices:
         st.warning(t("warning_no_results"))
         return []
     
-    with open(temp_json, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    
-    notices = data.get("notices", [])
-    
+    superseded = {}
+    if latest_only:
+        notices, superseded = latest_per_procedure(notices)
+        skipped = sum(len(v) for v in superseded.values())
+        if skipped:
+            st.info(t("dedup_skipped", count=skipped, procedures=len(superseded)))
+    if incremental:
+        query_key = query_history_key({
+            "cpv_codes": sorted(cpv_codes.split()), "keywords": keywords.strip(), "buyer_country": buyer_country.strip(),
+            "query_filters": query_filters, "fields": fields, "latest_only": latest_only,
+        })
+        return fetch_incremental(query_key, notices, fields, superseded, latest_only)
+    return fetch_and_parse_notices(notices, fields, superseded)
+
+def fetch_and_parse_notices(notices, fields=None, superseded=None):
+    """Fetch and parse each notice's XML into a row.
+
+    superseded maps publication numbers to the older notices of the same
+    procedure. Notices that could not be fetched because TED did not answer are
+    retried with backoff at the end of the run; whatever still fails is stored
+    as the run's failure report in st.session_state.scrape_failures.
+    """
+    superseded = superseded or {}
     s = requests.Session()
+    breaker = get_circuit_breaker("ted-xml")
+    ted_limiter = get_rate_limiter("ted-xml", TED_XML_REQUESTS_PER_SEC, TED_XML_BURST)
     rows = []
+    failures = {}
+    parse_seconds = 0.0
     
     progress_bar = st.progress(0)
     status_text = st.empty()
-    
-    for idx, n in enumerate(notices):
-        pubno = n.get("publication-number")
-        if not pubno:
-            continue
-        
-        status_text.text(f"Processing {idx+1}/{len(notices)}: {pubno}")
-        progress_bar.progress((idx + 1) / len(notices))
-        
+    try:
+        archive = _xml_archive()
+    except (OSError, sqlite3.Error):
+        archive = None
+
+    def fetch(n, report):
+        """Fetch and archive one notice's XML; None if that failed (see report)."""
+        pubno = n["publication-number"]
+        claimed = claim_notice_fetch(pubno)
+        if not claimed:
+            # Another session or replica is fetching this notice right now
+            xml_bytes = wait_for_notice_xml(pubno, conn=archive)
+            if xml_bytes is not None:
+                return xml_bytes
+        try:
+            while (pause := circuit_wait_time(breaker)) > 0:
+                status_text.text(t("circuit_open", seconds=math.ceil(pause)))
+                time.sleep(min(pause, 5))
+            try:
+                xml_bytes = fetch_notice_xml(s, pubno, n, limiter=ted_limiter)
+            except requests.RequestException as e:
+                circuit_record(breaker, False)
+                report.update({"Stage": "fetch", "Error": str(e), "Retryable": True})
+                return None
+            except Exception as e:
+                circuit_record(breaker, True)
+                report.update({"Stage": "fetch", "Error": str(e), "Retryable": False})
+                return None
+            circuit_record(breaker, True)
+            archive_notice_xml(pubno, xml_bytes, conn=archive)
+            return xml_bytes
+        finally:
+            if claimed:
+                release_notice_fetch(pubno)
+
+    def process(n):
+        """Fetch and parse one notice; returns False if it should be retried."""
+        nonlocal parse_seconds
+        pubno = n["publication-number"]
+        report = failures.setdefault(pubno, {"publication-number": pubno, "Attempts": 0})
+        report["Attempts"] += 1
+        xml_bytes = archived_notice_xml(pubno, archive)
+        archived = xml_bytes is not None
+        if not archived:
+            xml_bytes = fetch(n, report)
+            if xml_bytes is None:
+                return not report["Retryable"]
         try:
-            xml_bytes = fetch_notice_xml(s, pubno, n)
-            fields = parse_xml_fields(xml_bytes)
-            fields["publication-number"] = pubno
-            fields.setdefault("Ted-Link", f"https://ted.europa.eu/en/notice/-/detail/{pubno}")
-            rows.append(fields)
+            parse_started = time.perf_counter()
+            row = parse_xml_fields(xml_bytes, fields)
+            parse_seconds += time.perf_counter() - parse_started
         except Exception as e:
-            st.warning(f"⚠️ Error processing {pubno}: {e}")
+            report.update({"Stage": "parse", "Error": str(e), "Retryable": False})
+            return True
+        if fields is None:
+            row["Parser-Version"] = PARSER_VERSION
+            if not archived:
+                mark_archive_parsed([pubno], archive)
+        row["publication-number"] = pubno
+        if fields is None or "Ted-Link" in fields:
+            row.setdefault("Ted-Link", f"https://ted.europa.eu/en/notice/-/detail/{pubno}")
+        if pubno in superseded:
+            row["Frühere Bekanntmachungen"] = ", ".join(superseded[pubno])
+        rows.append(row)
+        del failures[pubno]
+        return True
+
+    try:
+        retry_queue = []
+        for idx, n in enumerate(notices):
+            pubno = n.get("publication-number")
+            if not pubno:
+                continue
+        
+            status_text.text(f"Processing {idx+1}/{len(notices)}: {pubno}")
+            progress_bar.progress((idx + 1) / len(notices))
         
-        time.sleep(0.25)
+            if not process(n):
+                retry_queue.append(n)
+
+        for round_no in range(RETRY_ROUNDS):
+            if not retry_queue:
+                break
+            delay = RETRY_BACKOFF * 2 ** round_no
+            status_text.text(t("retry_round", count=len(retry_queue), seconds=delay))
+            time.sleep(delay)
+            pending, retry_queue = retry_queue, []
+            for idx, n in enumerate(pending):
+                progress_bar.progress((idx + 1) / len(pending))
+                if not process(n):
+                    retry_queue.append(n)
+    finally:
+        if archive is not None:
+            archive.close()
     
     progress_bar.empty()
     status_text.empty()
-    
-    os.remove(temp_json)
+    if rows:
+        st.caption(f"⏱️ XML parsing: {parse_seconds * 1000 / len(rows):.1f} ms per notice")
+    st.session_state.scrape_failures = list(failures.values())
     return rows
 
-def save_to_excel(rows, output_excel):
-    """Save filtered rows to Excel with table formatting"""
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    headers = [
-        "publication-number","Beschaffer","Projektbezeichnung","Ort/Region",
-        "Vergabeplattform","Ted-Link","Projektstart","Projektende",
-        "Geforderte Unternehmensreferenzen","Geforderte Kriterien CVs",
-        "Projektvolumen", "Frist Abgabedatum", "Veröffentlichung Datum", "CPV Codes", "Leistungen/Rollen"
-    ]
+# ---------------- TED BULK IMPORT ----------------
+# Historical backfills read TED's daily publication packages (tar.gz archives of
+# one OJ S issue) from disk. Members are streamed without extracting them, a
+# cheap byte-level pass keeps notices with a matching CPV code and country, and
+# only those are parsed, in worker processes. The byte-level country match sees
+# every organisation of a notice, so the workers check the buyer's country.
+ISO3_TO_ISO2 = {
+    "AUT": "AT", "BEL": "BE", "BGR": "BG", "CHE": "CH", "CYP": "CY", "CZE": "CZ", "DEU": "DE", "DNK": "DK",
+    "ESP": "ES", "EST": "EE", "FIN": "FI", "FRA": "FR", "GBR": "UK", "GRC": "EL", "HRV": "HR", "HUN": "HU",
+    "IRL": "IE", "ISL": "IS", "ITA": "IT", "LIE": "LI", "LTU": "LT", "LUX": "LU", "LVA": "LV", "MLT": "MT",
+    "NLD": "NL", "NOR": "NO", "POL": "PL", "PRT": "PT", "ROU": "RO", "SVK": "SK", "SVN": "SI", "SWE": "SE",
+}
+_BULK_CPV_RE = re.compile(rb'(?:CODE="|listName="cpv"[^>]*>)(\d{8})')
+_BULK_COUNTRY_RE = re.compile(rb'(?:listName="country"[^>]*>|COUNTRY VALUE=")([A-Z]{2,3})')
+_BULK_PUBNO_RE = re.compile(rb'(?:ojs-notice-id"[^>]*>|DOC_ID=")0*(\d+-\d{4})')
+
+def _cpv_prefixes(cpv_codes):
+    """CPV codes match hierarchically: 71000000 covers every 71xxxxxx code."""
+    return tuple(code.rstrip("0").ljust(2, "0") for code in (cpv_codes or "").split() if code.strip())
+
+def _bulk_countries(buyer_country):
+    """Country filter in both code forms: eForms uses ISO 3166 alpha-3, TED_EXPORT alpha-2."""
+    iso2_to_iso3 = {v: k for k, v in ISO3_TO_ISO2.items()}
+    countries = set()
+    for code in (buyer_country or "").replace(",", " ").split():
+        code = code.upper()
+        countries.add(code)
+        if code in ISO3_TO_ISO2:
+            countries.add(ISO3_TO_ISO2[code])
+        if code in iso2_to_iso3:
+            countries.add(iso2_to_iso3[code])
+    return countries
+
+def notice_buyer_country(schema, root, ns):
+    """Country code of the contracting authority of a parsed notice, or ""."""
+    if schema == "ted-legacy":
+        nodes = _legacy_xpath(_legacy_form(root, ns), "t:CONTRACTING_BODY/t:ADDRESS_CONTRACTING_BODY/t:COUNTRY", ns)
+        return (nodes[0].get("VALUE") or "").strip().upper() if nodes else ""
+    buyer_ids = {
+        (n.text or "").strip()
+        for n in root.xpath(".//cac:ContractingParty/cac:Party/cac:PartyIdentification/cbc:ID", namespaces=ns)
+    }
+    for company in root.xpath(".//efac:Organizations/efac:Organization/efac:Company", namespaces=ns):
+        ids = {(n.text or "").strip() for n in company.xpath("cac:PartyIdentification/cbc:ID", namespaces=ns)}
+        if buyer_ids & ids:
+            return _first_text(
+                company.xpath("cac:PostalAddress/cac:Country/cbc:IdentificationCode", namespaces=ns)
+            ).upper()
+    return _first_text(
+        root.xpath(".//cac:ContractingParty//cac:Country/cbc:IdentificationCode", namespaces=ns)
+    ).upper()
+
+def bulk_member_matches(xml_bytes, cpv_prefixes, countries):
+    if cpv_prefixes:
+        codes = {m.decode() for m in _BULK_CPV_RE.findall(xml_bytes)}
+        if not any(code.startswith(cpv_prefixes) for code in codes):
+            return False
+    if countries:
+        if not countries.intersection(m.decode() for m in _BULK_COUNTRY_RE.findall(xml_bytes)):
+            return False
+    return True
+
+def _bulk_publication_number(member_name, xml_bytes):
+    m = _BULK_PUBNO_RE.search(xml_bytes)
+    if m:
+        return m.group(1).decode()
+    m = re.search(r"0*(\d+)[_-](\d{4})\.xml$", member_name)
+    return f"{m.group(1)}-{m.group(2)}" if m else os.path.basename(member_name)
+
+def parse_bulk_member(member_name, xml_bytes, fields=None, countries=None):
+    """Worker entry point: parse one notice from a daily package into a row.
+
+    Returns None if countries is given and the buyer is not in one of them.
+    """
+    pubno = _bulk_publication_number(member_name, xml_bytes)
+    schema, root, ns = _parse_notice(xml_bytes)
+    if countries and notice_buyer_country(schema, root, ns) not in countries:
+        return None
+    row = _extract_notice_fields(schema, root, ns, fields)
+    if fields is None:
+        row["Parser-Version"] = PARSER_VERSION
+    row["publication-number"] = pubno
+    if fields is None or "Ted-Link" in fields:
+        if not row.get("Ted-Link"):
+            row["Ted-Link"] = f"https://ted.europa.eu/en/notice/-/detail/{pubno}"
+    return row
+
+def _parse_bulk_member_safe(member_name, xml_bytes, fields=None, countries=None):
+    """parse_bulk_member that returns False instead of raising."""
+    try:
+        return parse_bulk_member(member_name, xml_bytes, fields, countries)
+    except Exception:
+        return False
+
+def find_bulk_packages(path):
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "**", "*.tar.gz"), recursive=True))
+    return [path] if os.path.isfile(path) else []
+
+def iter_bulk_members(package_paths, cpv_codes, buyer_country, stats, progress_callback=None):
+    """Yield (member name, xml bytes) of notices passing the byte-level prefilter; counts go into stats."""
+    cpv_prefixes = _cpv_prefixes(cpv_codes)
+    countries = _bulk_countries(buyer_country)
+    for package in package_paths:
+        with tarfile.open(package, mode="r|gz") as tar:
+            for member in tar:
+                if not member.isfile() or not member.name.lower().endswith(".xml"):
+                    continue
+                xml_bytes = tar.extractfile(member).read()
+                stats["scanned"] += 1
+                if progress_callback and stats["scanned"] % 500 == 0:
+                    progress_callback(stats)
+                if bulk_member_matches(xml_bytes, cpv_prefixes, countries):
+                    stats["matched"] += 1
+                    yield member.name, xml_bytes
+
+def import_bulk_packages(package_paths, cpv_codes, buyer_country, fields=None, progress_callback=None):
+    """Parse all matching notices of the given packages. Returns (rows, stats)."""
+    stats = {"scanned": 0, "matched": 0, "parsed": 0, "failed": 0}
+    rows = {}
+    countries = _bulk_countries(buyer_country)
+    members = iter_bulk_members(package_paths, cpv_codes, buyer_country, stats, progress_callback)
+    tasks = ((name, data, fields, countries) for name, data in members)
+    for _, row in run_in_processes("_parse_bulk_member_safe", tasks):
+        if row is False:
+            stats["failed"] += 1
+        elif row is None:
+            # Another organisation of the notice matched the country prefilter
+            stats["matched"] -= 1
+        else:
+            rows[row["publication-number"]] = row
+            stats["parsed"] += 1
+        if progress_callback:
+            progress_callback(stats)
+    return list(rows.values()), stats
+
+EXCEL_HEADERS = [
+    "publication-number","Status","Beschaffer","Projektbezeichnung","Ort/Region",
+    "Vergabeplattform","Ted-Link","Projektstart","Projektende",
+    "Geforderte Unternehmensreferenzen","Geforderte Kriterien CVs",
+    "Projektvolumen", "Frist Abgabedatum", "Veröffentlichung Datum", "CPV Codes", "Leistungen/Rollen",
+    "Frühere Bekanntmachungen", "Suchanfragen", "Parser-Version"
+]
+
+# Rows that are new or changed since the last run of an incremental search
+EXCEL_CHANGED_FILL = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
+
+def _excel_sheet_title(name, used):
+    """Excel sheet names are at most 31 characters and must not contain []:*?/\\."""
+    base = re.sub(r"[\[\]:*?/\\]", "_", name).strip("' ")[:31] or "Sheet"
+    title, n = base, 2
+    while title.lower() in used:
+        suffix = f" ({n})"
+        title, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(title.lower())
+    return title
+
+def _write_results_sheet(ws, rows, table_name):
+    headers = EXCEL_HEADERS + [h for h in ENRICHMENT_COLUMNS if any(h in r for r in rows)]
+    # Rows parsed with a column selection only carry those columns
+    headers = [h for h in headers if any(h in r for r in rows)] or EXCEL_HEADERS
     ws.append(headers)
     for r in rows:
         ws.append([r.get(h, "") for h in headers])
+        if r.get(STATUS_COLUMN) in (STATUS_NEW, STATUS_CHANGED):
+            for cell in ws[ws.max_row]:
+                cell.fill = EXCEL_CHANGED_FILL
+    if not rows:
+        return
     last_row = len(rows) + 1
     last_col = len(headers)
     table_range = f"A1:{get_column_letter(last_col)}{last_row}"
-    table = Table(displayName="Teddata", ref=table_range)
+    table = Table(displayName=table_name, ref=table_range)
     style = TableStyleInfo(
         name="TableStyleMedium9",
         showFirstColumn=False,
@@ -725,91 +1668,2153 @@ def save_to_excel(rows, output_excel):
     )
     table.tableStyleInfo = style
     ws.add_table(table)
+
+def save_to_excel(rows, output_excel, sheets=None):
+    """Save filtered rows to Excel with table formatting.
+
+    sheets optionally maps sheet names to further row lists, e.g. the results
+    of each query of a batch run; each gets its own sheet after the first.
+    """
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    used = set()
+    if sheets:
+        ws.title = _excel_sheet_title(t("batch_sheet_all"), used)
+    _write_results_sheet(ws, rows, "Teddata")
+    for idx, (name, sheet_rows) in enumerate((sheets or {}).items(), start=2):
+        _write_results_sheet(wb.create_sheet(_excel_sheet_title(name, used)), sheet_rows, f"Teddata{idx}")
     wb.save(output_excel)
 
-# ---------------- CHATBOT FUNCTIONS (keep all unchanged) ----------------
-def extract_text_from_pdf(file):
+def results_excel_bytes(table):
+    """The Excel export of a results table, with a sheet per query for batch results."""
+    rows = table.to_pylist()
+    output = BytesIO()
+    save_to_excel(rows, output, rows_by_query(rows) if QUERY_TAG_COLUMN in table.column_names else None)
+    return output.getvalue()
+
+def memoised_export(name, signature, build):
+    """Bytes of the session's export name, rebuilt only when signature changes.
+
+    Keeps one export per name, so a rerun that changes nothing in the
+    results or filters does not convert and write the table again.
+    """
+    exports = st.session_state.setdefault("exports", {})
+    if name not in exports or exports[name][0] != signature:
+        exports[name] = (signature, build())
+    return exports[name][1]
+
+# ---------------- RESULTS GRID ----------------
+# Only one page of the filtered results is sent to the browser. Filtering,
+# sorting and paging run on the Arrow table with pyarrow.compute, and only the
+# visible page is converted to pandas; long texts are cut in the grid and
+# shown in full for the selected row.
+RESULTS_PAGE_SIZES = [25, 50, 100, 250]
+RESULTS_TEXT_PREVIEW_CHARS = 120
+RESULTS_LINK_COLUMNS = {"Ted-Link": "TED Link", "Vergabeplattform": "Platform"}
+
+def _text_column(table, name):
+    """Column name of table as one plain string array."""
+    column = table[name]
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    if not pa.types.is_string(column.type):
+        column = column.cast(pa.string())
+    return column.combine_chunks()
+
+def _number_column(table, name):
+    """Numeric values of column name; for text, the first number in it (commas dropped), else null."""
+    column = table[name]
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+        return column.combine_chunks().cast(pa.float64())
+    text = _text_column(table, name)
+    if name == "Projektvolumen":
+        text = pc.struct_field(pc.extract_regex(text, r"(?P<n>[\d,.]+)"), "n")
+        text = pc.replace_substring(text, ",", "")
+    text = pc.utf8_trim_whitespace(text)
+    valid = pc.match_substring_regex(text, r"^-?\d+(\.\d*)?$")
+    return pc.if_else(valid, text, pa.scalar(None, pa.string())).cast(pa.float64())
+
+def _date_column(table, name):
+    """ISO dates (YYYY-MM-DD strings) of column name, null where there is none."""
+    text = pc.utf8_slice_codeunits(_text_column(table, name), 0, 10)
+    return pc.if_else(pc.match_substring_regex(text, r"^\d{4}-\d{2}-\d{2}$"), text, pa.scalar(None, pa.string()))
+
+def _contains_any(table, name, separator, values):
+    """Rows whose separator-joined column name contains one of values."""
+    lists = pc.split_pattern(pc.fill_null(_text_column(table, name), ""), separator)
+    hits = pc.is_in(pc.list_flatten(lists), value_set=pa.array(list(values), pa.string()))
+    rows = pc.filter(pc.list_parent_indices(lists), hits)
+    return pc.is_in(pa.array(range(len(table)), pa.int64()), value_set=rows.cast(pa.int64()))
+
+def column_options(table, name):
+    """Sorted distinct non-empty values of column name."""
+    return sorted(v for v in pc.unique(_text_column(table, name)).to_pylist() if v)
+
+def query_tag_options(table):
+    """Sorted distinct query names of a batch results table."""
+    lists = pc.split_pattern(pc.fill_null(_text_column(table, QUERY_TAG_COLUMN), ""), QUERY_TAG_SEPARATOR)
+    return sorted(v for v in pc.unique(pc.list_flatten(lists)).to_pylist() if v)
+
+def filter_results(table, filters):
+    """Return the rows of table that pass filters.
+
+    filters may contain "buyers", "regions", "service_lines" and "query_tags"
+    (lists of str), "min_volume" and "min_relevance" (numbers), "start_from",
+    "end_to" and "deadline_from" (dates; rows without a date are kept) and
+    "changed_only" (bool).
+    """
+    masks = []
+    if filters.get("buyers"):
+        masks.append(pc.is_in(_text_column(table, "Beschaffer"), value_set=pa.array(filters["buyers"], pa.string())))
+    if filters.get("regions"):
+        masks.append(pc.is_in(_text_column(table, "Ort/Region"), value_set=pa.array(filters["regions"], pa.string())))
+    if filters.get("min_volume") is not None:
+        masks.append(pc.greater_equal(_number_column(table, "Projektvolumen"), filters["min_volume"]))
+    for key, column, compare in (("start_from", "Projektstart", pc.greater_equal),
+                                 ("end_to", "Projektende", pc.less_equal),
+                                 ("deadline_from", "Frist Abgabedatum", pc.greater_equal)):
+        if filters.get(key) and column in table.column_names:
+            dates = _date_column(table, column)
+            masks.append(pc.or_kleene(pc.is_null(dates), compare(dates, filters[key].isoformat())))
+    if filters.get("min_relevance"):
+        masks.append(pc.greater_equal(_number_column(table, "KI Relevanz"), filters["min_relevance"]))
+    if filters.get("service_lines"):
+        masks.append(_contains_any(table, "KI Leistungsbereiche", "; ", filters["service_lines"]))
+    if filters.get("changed_only"):
+        masks.append(pc.is_in(_text_column(table, STATUS_COLUMN), value_set=pa.array([STATUS_NEW, STATUS_CHANGED])))
+    if filters.get("query_tags"):
+        masks.append(_contains_any(table, QUERY_TAG_COLUMN, QUERY_TAG_SEPARATOR, filters["query_tags"]))
+    if not masks:
+        return table
+    mask = masks[0]
+    for other in masks[1:]:
+        mask = pc.and_kleene(mask, other)
+    return table.filter(pc.fill_null(mask, False))
+
+def _results_sort_key(table, column):
+    if column == "Projektvolumen":
+        return _number_column(table, column)
+    values = table[column]
+    if pa.types.is_dictionary(values.type) or pa.types.is_string(values.type):
+        return pc.utf8_lower(pc.fill_null(_text_column(table, column), ""))
+    return values.combine_chunks()
+
+def results_page(table, sort_column, ascending, page, page_size):
+    """Sort table by sort_column and return rows of the 1-based page as a DataFrame."""
+    start = (page - 1) * page_size
+    if sort_column in table.column_names:
+        order = pc.array_sort_indices(_results_sort_key(table, sort_column),
+                                      order="ascending" if ascending else "descending", null_placement="at_end")
+        table = table.take(order[start:start + page_size])
+    else:
+        table = table.slice(start, page_size)
+    return table.to_pandas()
+
+def truncate_text_columns(df, limit=RESULTS_TEXT_PREVIEW_CHARS):
+    """Cut long strings for display; link columns are left intact."""
+    df = df.copy()
+    for col in df.columns:
+        if col in RESULTS_LINK_COLUMNS or df[col].dtype != object:
+            continue
+        df[col] = df[col].map(lambda v: v[:limit].rstrip() + "…" if isinstance(v, str) and len(v) > limit else v)
+    return df
+
+# ---------------- DISK CACHE ----------------
+# Shared by all sessions (and all processes pointing at the same directory).
+# Entries are gzip-compressed files named by their key, grouped by namespace.
+CACHE_DIR = get_secret("CACHE_DIR", "") or os.path.join(tempfile.gettempdir(), "akquise_cache")
+
+def _disk_cache_path(namespace, key):
+    return os.path.join(CACHE_DIR, namespace, key[:2], f"{key}.gz")
+
+def disk_cache_get(namespace, key):
+    """Return the cached bytes for key, or None. Hits refresh the entry's age."""
+    path = _disk_cache_path(namespace, key)
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page_num, page in enumerate(pdf_reader.pages):
-            text += f"\n--- Page {page_num + 1} ---\n"
-            text += page.extract_text()
-        return text
-    except Exception as e:
-        return f"Error reading PDF: {str(e)}"
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        return data
+    except (OSError, EOFError):
+        return None
 
-def extract_text_from_docx(file):
+@st.cache_resource(show_spinner=False)
+def _disk_cache_sizes():
+    """Running byte count per namespace, so a put does not have to walk the namespace."""
+    return {"bytes": {}, "lock": threading.Lock()}
+
+def disk_cache_put(namespace, key, data, max_bytes=None):
+    path = _disk_cache_path(namespace, key)
     try:
-        doc = docx.Document(file)
-        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        return text
-    except Exception as e:
-        return f"Error reading DOCX: {str(e)}"
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        new_size = os.path.getsize(path)
+    except OSError:
+        return
+    if max_bytes:
+        sizes = _disk_cache_sizes()
+        with sizes["lock"]:
+            total = sizes["bytes"].get(namespace)
+            # Other processes may write to the same directory; an eviction pass recounts exactly
+            total = _disk_cache_evict(namespace, None) if total is None else total + new_size - old_size
+            if total > max_bytes:
+                total = _disk_cache_evict(namespace, max_bytes)
+            sizes["bytes"][namespace] = total
 
-def extract_text_from_txt(file):
+def _disk_cache_evict(namespace, max_bytes):
+    """Delete least recently used entries until the namespace fits in max_bytes.
+
+    Returns the bytes left in the namespace; with max_bytes None it only counts.
+    """
+    entries = []
+    total = 0
+    for dirpath, _, filenames in os.walk(os.path.join(CACHE_DIR, namespace)):
+        for name in filenames:
+            if not name.endswith(".gz"):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+    if max_bytes is None or total <= max_bytes:
+        return total
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= max_bytes:
+            break
+    return total
+
+# ---------------- SHARED STATE ----------------
+# State that replicas of the app behind a load balancer share: archived notice
+# XML, search results, the notices being fetched right now and the request
+# budgets of the rate limiters. With SHARED_STATE_URL pointing at a Redis (or
+# Redis-compatible) server it lives there; otherwise it stays in this process.
+SHARED_STATE_URL = get_secret("SHARED_STATE_URL", "")
+SHARED_STATE_PREFIX = "akquise:"
+FETCH_CLAIM_TTL = 60
+
+@st.cache_resource(show_spinner=False)
+def get_shared_state():
+    if SHARED_STATE_URL:
+        if redis is None:
+            raise RuntimeError("SHARED_STATE_URL is set but the redis package is not installed")
+        return {"redis": redis.Redis.from_url(SHARED_STATE_URL), "values": None, "lock": None}
+    return {"redis": None, "values": {}, "lock": threading.Lock()}
+
+def shared_state_is_external():
+    return get_shared_state()["redis"] is not None
+
+def _local_shared_entry(state, key):
+    """(value, expires_at) of key in the in-process backend; the caller holds the lock."""
+    entry = state["values"].get(key)
+    if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+        del state["values"][key]
+        return None
+    return entry
+
+def shared_get(key):
+    state = get_shared_state()
+    if state["redis"] is not None:
+        return state["redis"].get(SHARED_STATE_PREFIX + key)
+    with state["lock"]:
+        entry = _local_shared_entry(state, key)
+    return entry[0] if entry else None
+
+def shared_set(key, value, ttl=None, only_if_new=False):
+    """Store bytes under key for ttl seconds. With only_if_new, return False instead if key exists."""
+    state = get_shared_state()
+    if state["redis"] is not None:
+        return bool(state["redis"].set(SHARED_STATE_PREFIX + key, value,
+                                       px=int(ttl * 1000) if ttl else None, nx=only_if_new))
+    with state["lock"]:
+        if only_if_new and _local_shared_entry(state, key) is not None:
+            return False
+        state["values"][key] = (value, time.monotonic() + ttl if ttl else None)
+    return True
+
+def shared_delete(key):
+    state = get_shared_state()
+    if state["redis"] is not None:
+        state["redis"].delete(SHARED_STATE_PREFIX + key)
+        return
+    with state["lock"]:
+        state["values"].pop(key, None)
+
+def shared_incr(key, ttl):
+    """Increment the counter under key and return it; a new counter expires after ttl seconds."""
+    state = get_shared_state()
+    if state["redis"] is not None:
+        count = state["redis"].incr(SHARED_STATE_PREFIX + key)
+        if count == 1:
+            state["redis"].pexpire(SHARED_STATE_PREFIX + key, int(ttl * 1000))
+        return count
+    with state["lock"]:
+        entry = _local_shared_entry(state, key)
+        count = int(entry[0]) + 1 if entry else 1
+        state["values"][key] = (str(count).encode(), entry[1] if entry else time.monotonic() + ttl)
+    return count
+
+def claim_notice_fetch(pubno):
+    """Register a fetch of pubno; False if another session or replica is already fetching it."""
+    return shared_set(f"fetching:{pubno}", b"1", FETCH_CLAIM_TTL, only_if_new=True)
+
+def release_notice_fetch(pubno):
+    shared_delete(f"fetching:{pubno}")
+
+def wait_for_notice_xml(pubno, timeout=FETCH_CLAIM_TTL, conn=None):
+    """Wait for the fetch someone else claimed to reach the archive; None if it did not."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        xml_bytes = archived_notice_xml(pubno, conn)
+        if xml_bytes is not None or shared_get(f"fetching:{pubno}") is None:
+            return xml_bytes
+        time.sleep(0.5)
+    return None
+
+# ---------------- XML ARCHIVE ----------------
+# Raw XML of every fetched notice, zlib-compressed in one SQLite file keyed by
+# publication number. TED does not change a notice once published, so the
+# archive also spares repeated fetches, and after parser changes
+# "python app.py reprocess" rebuilds rows from it without any network calls.
+# A run over many notices opens one connection and passes it as conn.
+XML_ARCHIVE_PATH = get_secret("XML_ARCHIVE_PATH", "") or os.path.join(CACHE_DIR, "xml_archive.sqlite")
+XML_SHARED_TTL = 30 * 24 * 3600
+
+def _xml_archive():
+    os.makedirs(os.path.dirname(XML_ARCHIVE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(XML_ARCHIVE_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS notices (publication_number TEXT PRIMARY KEY, xml BLOB NOT NULL, "
+        "archived_at TEXT NOT NULL, parser_version TEXT)"
+    )
+    return conn
+
+def _archive_connection(conn):
+    """Context for conn, or for a connection of its own (closed afterwards) if conn is None."""
+    return nullcontext(conn) if conn is not None else closing(_xml_archive())
+
+def archive_notice_xml(pubno, xml_bytes, parser_version=None, share=True, conn=None):
+    """Store a notice's raw XML; parser_version is None until it was parsed.
+
+    With a shared state backend the XML is also published there for the
+    other replicas, unless share is False.
+    """
+    compressed = zlib.compress(xml_bytes, 9)
+    if share and shared_state_is_external():
+        shared_set(f"xml:{pubno}", compressed, XML_SHARED_TTL)
     try:
-        return file.read().decode('utf-8')
-    except Exception as e:
-        return f"Error reading TXT: {str(e)}"
+        with _archive_connection(conn) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO notices VALUES (?, ?, ?, ?)",
+                (pubno, compressed, datetime.now().isoformat(timespec="seconds"), parser_version)
+            )
+    except sqlite3.Error:
+        return
 
-def extract_text_from_excel(file):
+def archived_notice_xml(pubno, conn=None):
+    """Return the archived XML of pubno, looking at the shared backend after the local archive."""
     try:
-        file_extension = file.name.split('.')[-1].lower()
-        if file_extension == 'csv':
-            df = pd.read_csv(file)
-        else:
-            df = pd.read_excel(file)
-        text = f"Excel File: {file.name}\n"
-        text += f"Rows: {len(df)}, Columns: {len(df.columns)}\n\n"
-        text += f"Column Names: {', '.join(df.columns.tolist())}\n\n"
-        text += "Data Preview (first 50 rows):\n"
-        text += df.head(50).to_string(index=False)
-        return text
-    except Exception as e:
-        return f"Error reading Excel file: {str(e)}"
+        with _archive_connection(conn) as db:
+            found = db.execute("SELECT xml FROM notices WHERE publication_number = ?", (pubno,)).fetchone()
+    except sqlite3.Error:
+        found = None
+    if found:
+        return zlib.decompress(found[0])
+    if shared_state_is_external():
+        compressed = shared_get(f"xml:{pubno}")
+        if compressed is not None:
+            xml_bytes = zlib.decompress(compressed)
+            archive_notice_xml(pubno, xml_bytes, share=False, conn=conn)
+            return xml_bytes
+    return None
 
-def extract_text_from_image(file):
+def mark_archive_parsed(pubnos, conn=None):
+    """Record that the archived XML of pubnos was parsed with PARSER_VERSION (all fields)."""
     try:
-        image = Image.open(file)
-        text = f"Image File: {file.name}\n"
-        text += f"Format: {image.format}\n"
-        text += f"Size: {image.size[0]}x{image.size[1]} pixels\n"
-        text += f"Mode: {image.mode}\n\n"
-        text += "Note: Image uploaded. Ask questions about its content."
-        return text
-    except Exception as e:
-        return f"Error reading image: {str(e)}"
+        with _archive_connection(conn) as db, db:
+            db.executemany(
+                "UPDATE notices SET parser_version = ? WHERE publication_number = ?",
+                [(PARSER_VERSION, pubno) for pubno in pubnos]
+            )
+    except sqlite3.Error:
+        return
 
-def process_uploaded_file(uploaded_file):
-    file_extension = uploaded_file.name.split('.')[-1].lower()
-    if file_extension == 'pdf':
-        return extract_text_from_pdf(uploaded_file)
-    elif file_extension == 'docx':
-        return extract_text_from_docx(uploaded_file)
-    elif file_extension == 'txt':
-        return extract_text_from_txt(uploaded_file)
-    elif file_extension in ['xlsx', 'xls', 'csv']:
-        return extract_text_from_excel(uploaded_file)
-    elif file_extension in ['png', 'jpg', 'jpeg']:
-        return extract_text_from_image(uploaded_file)
-    else:
-        return f"Unsupported file type: {file_extension}"
+def xml_archive_stats():
+    """Return {"notices": n, "stale": n not yet parsed with PARSER_VERSION}."""
+    try:
+        with closing(_xml_archive()) as conn:
+            total, stale = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(parser_version IS NOT ?), 0) FROM notices", (PARSER_VERSION,)
+            ).fetchone()
+    except sqlite3.Error:
+        return {"notices": 0, "stale": 0}
+    return {"notices": total, "stale": stale}
 
-def get_azure_chatbot_response(messages, azure_endpoint, azure_key, deployment_name, api_version="2024-08-01-preview"):
-    client = AzureOpenAI(
-        azure_endpoint=azure_endpoint,
-        api_key=azure_key,
-        api_version=api_version
-    )
-    stream = client.chat.completions.create(
-        model=deployment_name,
-        messages=messages,
+def reparse_archived_notice(pubno, compressed_xml, fields=None):
+    """Worker entry point: parse one archived notice into a row, or None.
+
+    With a subset of fields the row has no Parser-Version, as its other
+    columns were not re-extracted.
+    """
+    try:
+        row = parse_xml_fields(zlib.decompress(compressed_xml), fields)
+    except Exception:
+        return None
+    if fields is None:
+        row["Parser-Version"] = PARSER_VERSION
+    row["publication-number"] = pubno
+    if fields is None or "Ted-Link" in fields:
+        row.setdefault("Ted-Link", f"https://ted.europa.eu/en/notice/-/detail/{pubno}")
+    return row
+
+def reprocess_archive(pubnos=None, fields=None, stale_only=False, progress_callback=None):
+    """Re-extract archived notices with the current parser. Returns (rows, stats).
+
+    pubnos limits the run to those publication numbers; stale_only skips
+    notices already parsed with PARSER_VERSION. Only a run over all fields
+    marks the notices as parsed with PARSER_VERSION.
+    """
+    stats = {"archived": 0, "parsed": 0, "failed": 0}
+    wanted = set(pubnos) if pubnos is not None else None
+    rows = []
+    with closing(_xml_archive()) as conn:
+        query = "SELECT publication_number, xml FROM notices"
+        if stale_only:
+            query += " WHERE parser_version IS NOT ?"
+        cursor = conn.execute(query, (PARSER_VERSION,) if stale_only else ())
+
+        def tasks():
+            for pubno, compressed_xml in cursor:
+                if wanted is None or pubno in wanted:
+                    stats["archived"] += 1
+                    yield pubno, compressed_xml, fields
+
+        for _, row in run_in_processes("reparse_archived_notice", tasks()):
+            if row is None:
+                stats["failed"] += 1
+            else:
+                rows.append(row)
+                stats["parsed"] += 1
+            if progress_callback:
+                progress_callback(stats)
+        if fields is None:
+            mark_archive_parsed([row["publication-number"] for row in rows], conn)
+    return rows, stats
+
+def reprocess_command(argv):
+    """python app.py reprocess [--stale] [--output FILE]: re-extract the archive into an Excel file."""
+    import argparse
+    parser = argparse.ArgumentParser(prog="app.py reprocess", description=reprocess_command.__doc__)
+    parser.add_argument("--stale", action="store_true", help="only notices not yet parsed with the current parser")
+    parser.add_argument("--output", default=f"ted_reprocessed_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    rows, stats = reprocess_archive(stale_only=args.stale)
+    if rows:
+        save_to_excel(rows, args.output)
+    print(f"Parser version {PARSER_VERSION}: {stats['parsed']} of {stats['archived']} archived notices re-extracted, "
+          f"{stats['failed']} failed, in {time.perf_counter() - started:.1f} s")
+    if rows:
+        print(f"Rows written to {args.output}")
+
+# ---------------- QUERY HISTORY ----------------
+# Per user and query, the notices seen on earlier runs with a hash of their search
+# fields and the row parsed from them. Incremental runs only fetch and parse
+# notices that are new or changed and mark every row with its status.
+QUERY_HISTORY_PATH = get_secret("QUERY_HISTORY_PATH", "") or os.path.join(CACHE_DIR, "query_history.sqlite")
+QUERY_HISTORY_KEEP_DAYS = 90
+STATUS_COLUMN = "Status"
+STATUS_NEW, STATUS_CHANGED, STATUS_UNCHANGED = "Neu", "Geändert", "Unverändert"
+
+def _query_history():
+    os.makedirs(os.path.dirname(QUERY_HISTORY_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(QUERY_HISTORY_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS seen (query_key TEXT NOT NULL, item_key TEXT NOT NULL, "
+        "publication_number TEXT NOT NULL, field_hash TEXT NOT NULL, row TEXT NOT NULL, last_seen TEXT NOT NULL, "
+        "PRIMARY KEY (query_key, item_key))"
+    )
+    return conn
+
+def query_history_key(params):
+    """Key of the signed-in user's history of a query; params must not contain the date range."""
+    params = {**params, "user": st.session_state.get("user_id", "")}
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _history_item_key(notice, latest_only):
+    """With latest_only a procedure is one item, so a corrigendum counts as a change."""
+    procedure = _search_value(notice, "procedure-identifier") if latest_only else ""
+    return f"procedure:{procedure}" if procedure else _search_value(notice, "publication-number")
+
+def _notice_hash(notice):
+    values = {field: notice.get(field) for field in SEARCH_FIELDS if field != "links"}
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def fetch_incremental(query_key, notices, fields=None, superseded=None, latest_only=True):
+    """fetch_and_parse_notices, but rows of unchanged notices come from the query's history.
+
+    Every row gets a STATUS_COLUMN: new, changed (other notice of the procedure
+    or different search fields) or unchanged since the last run of the query.
+    """
+    today = date.today().isoformat()
+    try:
+        with closing(_query_history()) as conn:
+            history = {
+                item_key: (pubno, field_hash, row)
+                for item_key, pubno, field_hash, row in conn.execute(
+                    "SELECT item_key, publication_number, field_hash, row FROM seen WHERE query_key = ?", (query_key,)
+                )
+            }
+    except sqlite3.Error:
+        history = {}
+    to_fetch, rows, statuses, unchanged_keys = [], [], {}, []
+    for n in notices:
+        pubno = _search_value(n, "publication-number")
+        item_key = _history_item_key(n, latest_only)
+        seen = history.get(item_key)
+        if seen is None:
+            statuses[pubno] = STATUS_NEW
+        elif seen[0] != pubno or seen[1] != _notice_hash(n):
+            statuses[pubno] = STATUS_CHANGED
+        else:
+            row = json.loads(seen[2])
+            statuses[pubno] = STATUS_UNCHANGED
+            if row.get("Parser-Version") == PARSER_VERSION:
+                rows.append({STATUS_COLUMN: STATUS_UNCHANGED, **row})
+                unchanged_keys.append(item_key)
+                continue
+        to_fetch.append(n)
+    counts = Counter(statuses.values())
+    st.info(t("incremental_summary", new=counts[STATUS_NEW], changed=counts[STATUS_CHANGED],
+              unchanged=counts[STATUS_UNCHANGED]))
+
+    fetched = fetch_and_parse_notices(to_fetch, fields, superseded) if to_fetch else []
+    by_pubno = {_search_value(n, "publication-number"): n for n in to_fetch}
+    try:
+        with closing(_query_history()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO seen VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (query_key, _history_item_key(by_pubno[row["publication-number"]], latest_only),
+                     row["publication-number"], _notice_hash(by_pubno[row["publication-number"]]),
+                     json.dumps(row, ensure_ascii=False, default=str), today)
+                    for row in fetched
+                ]
+            )
+            conn.executemany(
+                "UPDATE seen SET last_seen = ? WHERE query_key = ? AND item_key = ?",
+                [(today, query_key, item_key) for item_key in unchanged_keys]
+            )
+            conn.execute(
+                "DELETE FROM seen WHERE last_seen < ?",
+                ((date.today() - timedelta(days=QUERY_HISTORY_KEEP_DAYS)).isoformat(),)
+            )
+    except sqlite3.Error:
+        pass
+    return [{STATUS_COLUMN: statuses[row["publication-number"]], **row} for row in fetched] + rows
+
+# ---------------- SAVED QUERIES ----------------
+# Named searches shared by everyone using this server, one row per name in a
+# SQLite file so concurrent saves and deletes do not overwrite each other. A
+# batch run searches each of them over the same date range, fetches and parses
+# every notice once even if several queries matched it, and tags the rows with
+# the query names.
+SAVED_QUERIES_PATH = get_secret("SAVED_QUERIES_PATH", "") or os.path.join(CACHE_DIR, "saved_queries.sqlite")
+QUERY_TAG_COLUMN = "Suchanfragen"
+QUERY_TAG_SEPARATOR = "; "
+
+def _saved_queries_db():
+    os.makedirs(os.path.dirname(SAVED_QUERIES_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(SAVED_QUERIES_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS saved_queries (name TEXT PRIMARY KEY, query TEXT NOT NULL, saved_at TEXT NOT NULL)"
+    )
+    return conn
+
+def load_saved_queries():
+    """Return {name: query} in the order saved, with query filters' dates parsed back into dates."""
+    try:
+        with closing(_saved_queries_db()) as conn:
+            stored = conn.execute("SELECT name, query FROM saved_queries ORDER BY rowid").fetchall()
+    except sqlite3.Error:
+        return {}
+    queries = {}
+    for name, query in stored:
+        query = json.loads(query)
+        filters = query.get("query_filters")
+        for key in ("deadline_from", "deadline_to"):
+            if filters and filters.get(key):
+                filters[key] = date.fromisoformat(filters[key])
+        queries[name] = query
+    return queries
+
+def save_query(name, query):
+    """Store query under name, replacing an existing query of that name."""
+    name = name.replace(QUERY_TAG_SEPARATOR.strip(), ",").strip()
+    with closing(_saved_queries_db()) as conn, conn:
+        conn.execute(
+            "INSERT INTO saved_queries (name, query, saved_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET query = excluded.query, saved_at = excluded.saved_at",
+            (name, json.dumps(query, ensure_ascii=False, default=lambda d: d.isoformat()),
+             datetime.now().isoformat(timespec="seconds"))
+        )
+    return name
+
+def delete_saved_queries(names):
+    with closing(_saved_queries_db()) as conn, conn:
+        conn.executemany("DELETE FROM saved_queries WHERE name = ?", [(name,) for name in names])
+
+def run_query_batch(queries, date_start, date_end, fields=None, latest_only=True, incremental=False):
+    """Run several saved queries and fetch each matching notice only once.
+
+    queries maps names to saved queries. Returns (rows, stats): every row's
+    QUERY_TAG_COLUMN lists the queries that matched it, and stats holds the
+    number of hits per query, the error of every query whose search failed
+    (the others still run) and the number of notices actually fetched.
+    With incremental, the batch as a whole keeps one history (see
+    fetch_incremental).
+    """
+    st.session_state.scrape_failures = []
+    notices = {}
+    tags = {}
+    stats = {"hits": {}, "failed": {}, "fetched": 0}
+    for name, query in queries.items():
+        try:
+            found = search_notices(
+                query.get("cpv_codes", ""), query.get("keywords", ""), date_start, date_end,
+                query.get("buyer_country", ""), query.get("query_filters")
+            )
+        except Exception as e:
+            stats["failed"][name] = str(e)
+            continue
+        stats["hits"][name] = len(found)
+        for n in found:
+            pubno = n.get("publication-number")
+            if not pubno:
+                continue
+            notices.setdefault(pubno, n)
+            if name not in tags.setdefault(pubno, []):
+                tags[pubno].append(name)
+
+    notices = list(notices.values())
+    superseded = {}
+    if latest_only:
+        notices, superseded = latest_per_procedure(notices)
+        # A query that only matched an older notice still matched the procedure
+        for newest, older in superseded.items():
+            for pubno in older:
+                for name in tags.get(pubno, []):
+                    if name not in tags[newest]:
+                        tags[newest].append(name)
+    stats["fetched"] = len(notices)
+    if not notices:
+        return [], stats
+
+    order = list(queries)
+    if incremental:
+        query_key = query_history_key({"queries": queries, "fields": fields, "latest_only": latest_only})
+        rows = fetch_incremental(query_key, notices, fields, superseded, latest_only)
+    else:
+        rows = fetch_and_parse_notices(notices, fields, superseded)
+    for row in rows:
+        row[QUERY_TAG_COLUMN] = QUERY_TAG_SEPARATOR.join(sorted(tags.get(row["publication-number"], []), key=order.index))
+    return rows, stats
+
+def rows_by_query(rows):
+    """Split batch rows into {query name: rows} for a per-query export."""
+    sheets = {}
+    for row in rows:
+        for name in (row.get(QUERY_TAG_COLUMN) or "").split(QUERY_TAG_SEPARATOR):
+            if name:
+                sheets.setdefault(name, []).append(row)
+    return sheets
+
+# ---------------- RESULT STORE ----------------
+# Search results live in a process-wide store rather than in session state, as
+# Arrow tables with dictionary-encoded text columns that repeat across notices.
+# Large tables are spilled to disk and memory-mapped on read, and results of
+# sessions that have been idle for a while are dropped.
+RESULT_DICTIONARY_COLUMNS = ("Beschaffer", "Ort/Region", "CPV Codes")
+RESULT_SPILL_BYTES = 16 * 1024 * 1024
+RESULT_IDLE_SECONDS = 30 * 60
+
+@st.cache_resource(show_spinner=False)
+def get_result_store():
+    return {"entries": {}, "lock": threading.Lock()}
+
+def results_to_table(rows):
+    """Build an Arrow table from row dicts; columns missing in a row are null."""
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    arrays = {}
+    for col in columns:
+        values = [row.get(col) for row in rows]
+        try:
+            array = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            array = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+        if col in RESULT_DICTIONARY_COLUMNS and pa.types.is_string(array.type):
+            array = array.dictionary_encode()
+        arrays[col] = array
+    return pa.table(arrays)
+
+def _drop_result_entry(entry):
+    if entry["path"]:
+        try:
+            os.remove(entry["path"])
+        except OSError:
+            pass
+
+def _evict_idle_results(store):
+    now = time.monotonic()
+    for key, entry in list(store["entries"].items()):
+        if now - entry["touched"] > RESULT_IDLE_SECONDS:
+            _drop_result_entry(store["entries"].pop(key))
+
+def _table_to_bytes(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def store_results(key, rows, share=True):
+    """Replace the results stored under key; rows is a list of dicts or a table.
+
+    With a shared state backend the results are also published there, so
+    another replica can pick up the session (unless share is False).
+    """
+    store = get_result_store()
+    entry = None
+    table = None
+    if len(rows):
+        table = rows if isinstance(rows, pa.Table) else results_to_table(rows)
+        entry = {"table": table, "path": None, "memory_bytes": table.nbytes, "disk_bytes": 0,
+                 "view_bytes": 0, "touched": time.monotonic(), "generation": secrets.token_hex(8)}
+        if table.nbytes > RESULT_SPILL_BYTES:
+            folder = os.path.join(CACHE_DIR, "results")
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{key}-{secrets.token_hex(4)}.arrow")
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            entry.update(table=None, path=path, memory_bytes=0, disk_bytes=os.path.getsize(path))
+    with store["lock"]:
+        _evict_idle_results(store)
+        old = store["entries"].pop(key, None)
+        if entry is not None:
+            store["entries"][key] = entry
+    if old is not None:
+        _drop_result_entry(old)
+    if share and shared_state_is_external():
+        if table is None:
+            shared_delete(f"results:{key}")
+        else:
+            shared_set(f"results:{key}", _table_to_bytes(table), RESULT_IDLE_SECONDS)
+
+def load_results(key):
+    """Return the table stored under key, or None if there is none (or it was evicted)."""
+    store = get_result_store()
+    with store["lock"]:
+        _evict_idle_results(store)
+        entry = store["entries"].get(key)
+        if entry is not None:
+            entry["touched"] = time.monotonic()
+    if entry is None:
+        data = shared_get(f"results:{key}") if shared_state_is_external() else None
+        if data is None:
+            return None
+        table = pa.ipc.open_stream(data).read_all()
+        store_results(key, table, share=False)
+        return table
+    if entry["table"] is not None:
+        return entry["table"]
+    try:
+        return pa.ipc.open_file(pa.memory_map(entry["path"])).read_all()
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+def results_generation(key):
+    """Token that changes whenever the results under key are replaced, or None."""
+    store = get_result_store()
+    with store["lock"]:
+        entry = store["entries"].get(key)
+        return entry["generation"] if entry is not None else None
+
+def note_result_view(key, nbytes):
+    """Record the size of the pandas copy last made from the results under key."""
+    store = get_result_store()
+    with store["lock"]:
+        entry = store["entries"].get(key)
+        if entry is not None:
+            entry["view_bytes"] = int(nbytes)
+
+def result_store_footprint(key=None):
+    """Memory and disk bytes held for key, or for all sessions if key is None.
+
+    Memory includes the pandas copy of the page each session displays, which
+    is the only copy held in memory for a spilled table.
+    """
+    store = get_result_store()
+    with store["lock"]:
+        if key is None:
+            entries = list(store["entries"].values())
+        else:
+            entries = [store["entries"][key]] if key in store["entries"] else []
+        return {
+            "sessions": len(entries),
+            "memory_bytes": sum(e["memory_bytes"] + e["view_bytes"] for e in entries),
+            "disk_bytes": sum(e["disk_bytes"] for e in entries),
+        }
+
+# ---------------- RATE LIMITING ----------------
+def new_rate_limiter(name, rate_per_sec, burst):
+    """Token bucket holding burst tokens, refilled at rate_per_sec."""
+    return {"name": name, "rate": rate_per_sec, "capacity": burst, "tokens": float(burst),
+            "updated": time.monotonic(), "lock": threading.Lock()}
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter(name, rate_per_sec, burst):
+    """Process-wide token bucket, shared by all sessions using the same name."""
+    return new_rate_limiter(name, rate_per_sec, burst)
+
+def rate_limiter_acquire(limiter):
+    """Block until the bucket has a token, then take it."""
+    if shared_state_is_external():
+        return _shared_rate_limiter_acquire(limiter)
+    while True:
+        with limiter["lock"]:
+            now = time.monotonic()
+            limiter["tokens"] = min(limiter["capacity"], limiter["tokens"] + (now - limiter["updated"]) * limiter["rate"])
+            limiter["updated"] = now
+            if limiter["tokens"] >= 1:
+                limiter["tokens"] -= 1
+                return
+            delay = (1 - limiter["tokens"]) / limiter["rate"]
+        time.sleep(delay)
+
+def _shared_rate_limiter_acquire(limiter):
+    """Across replicas: at most burst calls per window of burst / rate seconds."""
+    window = limiter["capacity"] / limiter["rate"]
+    while True:
+        now = time.time()
+        slot = int(now // window)
+        if shared_incr(f"rate:{limiter['name']}:{slot}", 2 * window) <= limiter["capacity"]:
+            return
+        time.sleep((slot + 1) * window - now)
+
+# ---------------- CIRCUIT BREAKER ----------------
+# When TED has an outage, every notice would otherwise run into its own timeouts.
+# A breaker opens once too many recent calls failed and pauses all callers for a
+# cooldown; afterwards it lets calls through again and reopens on the next failure.
+CIRCUIT_WINDOW = 10
+CIRCUIT_FAILURE_RATIO = 0.5
+CIRCUIT_COOLDOWN = 30
+
+@st.cache_resource(show_spinner=False)
+def get_circuit_breaker(name, window=CIRCUIT_WINDOW, failure_ratio=CIRCUIT_FAILURE_RATIO, cooldown=CIRCUIT_COOLDOWN):
+    """Process-wide breaker, shared by all sessions calling the same service."""
+    return {"ratio": failure_ratio, "cooldown": cooldown, "outcomes": deque(maxlen=window),
+            "opened_at": None, "half_open": False, "lock": threading.Lock()}
+
+def circuit_wait_time(breaker):
+    """Seconds until calls may go through again; 0 if the circuit is closed."""
+    with breaker["lock"]:
+        if breaker["opened_at"] is None:
+            return 0
+        remaining = breaker["opened_at"] + breaker["cooldown"] - time.monotonic()
+        if remaining > 0:
+            return remaining
+        breaker["opened_at"] = None
+        breaker["half_open"] = True
+        return 0
+
+def circuit_record(breaker, ok):
+    """Record the outcome of a call and open the circuit if the failure rate spikes."""
+    with breaker["lock"]:
+        outcomes = breaker["outcomes"]
+        if breaker["half_open"]:
+            breaker["half_open"] = False
+            if not ok:
+                breaker["opened_at"] = time.monotonic()
+                return
+        outcomes.append(ok)
+        failures = outcomes.count(False)
+        if len(outcomes) >= outcomes.maxlen // 2 and failures / len(outcomes) >= breaker["ratio"]:
+            breaker["opened_at"] = time.monotonic()
+            outcomes.clear()
+
+# ---------------- PARALLEL WORKERS ----------------
+# One process pool per server process, started lazily and shared by all
+# sessions. Workers come from a fork server (or are spawned) rather than being
+# forked from the multi-threaded Streamlit server, where a child could inherit
+# a lock held by another thread.
+PROCESS_POOL_WORKERS = max(1, min(4, os.cpu_count() or 1))
+PROCESS_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+@st.cache_resource(show_spinner=False)
+def _process_pool_state():
+    return {"pool": None, "lock": threading.Lock()}
+
+def get_process_pool():
+    """The shared process pool, or None if none can be started here."""
+    state = _process_pool_state()
+    with state["lock"]:
+        if state["pool"] is None:
+            try:
+                state["pool"] = ProcessPoolExecutor(
+                    max_workers=PROCESS_POOL_WORKERS, mp_context=multiprocessing.get_context(PROCESS_POOL_START_METHOD)
+                )
+            except (OSError, NotImplementedError, ValueError):
+                return None
+        return state["pool"]
+
+def _discard_process_pool(pool):
+    """Drop a broken pool so the next run starts a new one."""
+    state = _process_pool_state()
+    with state["lock"]:
+        if state["pool"] is pool:
+            state["pool"] = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def run_in_processes(func_name, tasks, max_workers=None):
+    """Run app.<func_name>(*args) for every args tuple in tasks.
+
+    tasks may be any iterable and is consumed lazily. Yields (index, result)
+    pairs in completion order. At most two tasks per worker (max_workers, by
+    default the whole shared pool) are in flight, so inputs and results never
+    pile up in memory. Falls back to running in-process if no pool can be used.
+    """
+    max_workers = min(max_workers or PROCESS_POOL_WORKERS, PROCESS_POOL_WORKERS)
+    func = globals()[func_name]
+    pool = get_process_pool() if max_workers > 1 else None
+    if pool is None:
+        for idx, args in enumerate(tasks):
+            yield idx, func(*args)
+        return
+    import workers
+    task_iter = enumerate(tasks)
+    pending = {}
+    leftover = []
+    try:
+        exhausted = False
+        while not leftover:
+            while not exhausted and len(pending) < 2 * max_workers:
+                try:
+                    idx, args = next(task_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:
+                    pending[pool.submit(workers.call, func_name, *args)] = (idx, args)
+                except (BrokenProcessPool, RuntimeError):
+                    leftover.append((idx, args))
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                idx, args = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except BrokenProcessPool:
+                    leftover.append((idx, args))
+                    continue
+                yield idx, result
+        # The pool died (e.g. a worker was killed): finish everything in-process
+        if leftover:
+            _discard_process_pool(pool)
+        leftover.extend(pending.values())
+        pending = {}
+        leftover.extend(task_iter)
+        for idx, args in leftover:
+            yield idx, func(*args)
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+# ---------------- CHATBOT FUNCTIONS ----------------
+# Limits for PDF extraction. Large tender dossiers are split into page ranges
+# that are extracted in worker processes.
+PDF_MAX_BYTES = 100 * 1024 * 1024
+PDF_MAX_PAGES = 1500
+PDF_MAX_CHARS = 5_000_000
+PDF_PAGES_PER_TASK = 20
+PDF_PARALLEL_MIN_PAGES = 40
+
+class ExtractionError(Exception):
+    """A file could not be read; the message is shown to the user."""
+
+def _extract_pdf_page_range(pdf_path, start, stop):
+    """Return the texts of pages [start, stop) of the PDF at pdf_path."""
+    reader = PyPDF2.PdfReader(pdf_path)
+    texts = []
+    for page_num in range(start, stop):
+        try:
+            texts.append(reader.pages[page_num].extract_text() or "")
+        except Exception as e:
+            texts.append(f"[Error reading page {page_num + 1}: {e}]")
+    return texts
+
+def extract_text_from_pdf(file, progress_callback=None):
+    try:
+        data = file.getvalue() if hasattr(file, "getvalue") else file.read()
+        if len(data) > PDF_MAX_BYTES:
+            raise ExtractionError(f"Error reading PDF: file is larger than {PDF_MAX_BYTES // (1024 * 1024)} MB")
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(data)
+            pdf_path = tmp.name
+        del data
+
+        try:
+            total_pages = len(PyPDF2.PdfReader(pdf_path).pages)
+            page_count = min(total_pages, PDF_MAX_PAGES)
+            ranges = [
+                (pdf_path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+                for start in range(0, page_count, PDF_PAGES_PER_TASK)
+            ]
+            max_workers = PROCESS_POOL_WORKERS if page_count >= PDF_PARALLEL_MIN_PAGES else 1
+            page_texts = [None] * page_count
+            pages_done = 0
+            chars_done = 0
+            results = run_in_processes("_extract_pdf_page_range", ranges, max_workers)
+            try:
+                for idx, texts in results:
+                    start = ranges[idx][1]
+                    page_texts[start:start + len(texts)] = texts
+                    pages_done += len(texts)
+                    chars_done += sum(len(x) for x in texts)
+                    if progress_callback:
+                        progress_callback(pages_done, page_count)
+                    if chars_done > PDF_MAX_CHARS:
+                        break
+            finally:
+                results.close()
+        finally:
+            os.remove(pdf_path)
+
+        parts = []
+        size = 0
+        for page_num, page_text in enumerate(page_texts):
+            if page_text is None or size + len(page_text) > PDF_MAX_CHARS:
+                parts.append(f"\n--- Truncated after page {page_num} (size limit) ---\n")
+                break
+            parts.append(f"\n--- Page {page_num + 1} ---\n")
+            parts.append(page_text)
+            size += len(page_text)
+        else:
+            if total_pages > page_count:
+                parts.append(f"\n--- Truncated: first {page_count} of {total_pages} pages ---\n")
+        return "".join(parts)
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"Error reading PDF: {e}") from e
+
+def extract_text_from_docx(file):
+    try:
+        doc = docx.Document(file)
+        text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        return text
+    except Exception as e:
+        raise ExtractionError(f"Error reading DOCX: {e}") from e
+
+def extract_text_from_txt(file):
+    try:
+        return file.read().decode('utf-8')
+    except Exception as e:
+        raise ExtractionError(f"Error reading TXT: {e}") from e
+
+# Spreadsheets are read in a streaming fashion (openpyxl read-only mode,
+# chunked CSV) so large sheets need little memory. Column summaries are
+# computed in the same single pass that collects the preview rows.
+SPREADSHEET_PREVIEW_ROWS = 50
+SPREADSHEET_CSV_CHUNK_ROWS = 50_000
+SPREADSHEET_DISTINCT_CAP = 1000
+SPREADSHEET_ALL_SHEETS = True
+SPREADSHEET_MAX_SHEETS = 20
+
+def _new_column_stats():
+    return {"non_null": 0, "types": Counter(), "distinct": set(), "distinct_capped": False, "range": {}}
+
+def _add_distinct(stats, values):
+    if stats["distinct_capped"]:
+        return
+    stats["distinct"].update(values)
+    if len(stats["distinct"]) > SPREADSHEET_DISTINCT_CAP:
+        stats["distinct_capped"] = True
+        stats["distinct"] = set()
+
+def _update_range(stats, kind, low, high):
+    current = stats["range"].get(kind)
+    if current is None:
+        stats["range"][kind] = [low, high]
+    else:
+        current[0] = min(current[0], low)
+        current[1] = max(current[1], high)
+
+def _update_column_stats(stats, value):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return
+    stats["non_null"] += 1
+    if isinstance(value, bool):
+        kind = "bool"
+    elif isinstance(value, (int, float)):
+        kind = "number"
+    elif isinstance(value, (datetime, date)):
+        kind = "date"
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+    else:
+        kind = "text"
+        value = str(value)
+    stats["types"][kind] += 1
+    if kind in ("number", "date"):
+        _update_range(stats, kind, value, value)
+    _add_distinct(stats, (value,))
+
+def _update_column_stats_series(stats, series):
+    values = series.dropna()
+    if values.dtype == object:
+        values = values[values.astype(str).str.strip() != ""]
+    if values.empty:
+        return
+    stats["non_null"] += len(values)
+    numeric = pd.to_numeric(values, errors="coerce").dropna()
+    if not numeric.empty:
+        stats["types"]["number"] += len(numeric)
+        _update_range(stats, "number", numeric.min().item(), numeric.max().item())
+    if len(values) > len(numeric):
+        stats["types"]["text"] += len(values) - len(numeric)
+    _add_distinct(stats, values.unique().tolist())
+
+def _format_column_summary(columns, stats_list):
+    lines = []
+    for col, stats in zip(columns, stats_list):
+        if not stats["non_null"]:
+            lines.append(f"- {col}: empty")
+            continue
+        kinds = stats["types"].most_common()
+        if len(kinds) == 1:
+            type_text = kinds[0][0]
+        else:
+            type_text = "mixed (" + ", ".join(f"{k} {n * 100 // stats['non_null']}%" for k, n in kinds) + ")"
+        distinct = f">{SPREADSHEET_DISTINCT_CAP}" if stats["distinct_capped"] else str(len(stats["distinct"]))
+        line = f"- {col}: {type_text}, {stats['non_null']} values, {distinct} distinct"
+        for kind, (low, high) in stats["range"].items():
+            if kind == "date":
+                low, high = low.strftime("%Y-%m-%d"), high.strftime("%Y-%m-%d")
+            line += f", {kind} min {low}, max {high}"
+        lines.append(line)
+    return "\n".join(lines)
+
+def _format_sheet(columns, row_count, preview_rows, stats_list, sheet_name=None):
+    text = f"Sheet: {sheet_name}\n" if sheet_name else ""
+    text += f"Rows: {row_count}, Columns: {len(columns)}\n\n"
+    text += f"Column Names: {', '.join(columns)}\n\n"
+    text += f"Column Summary:\n{_format_column_summary(columns, stats_list)}\n\n"
+    text += f"Data Preview (first {SPREADSHEET_PREVIEW_ROWS} rows):\n"
+    text += pd.DataFrame(preview_rows, columns=columns).to_string(index=False)
+    return text
+
+def _read_xlsx_sheet(ws):
+    rows = ws.iter_rows(values_only=True)
+    header = None
+    for row in rows:
+        if any(v is not None for v in row):
+            header = row
+            break
+    if header is None:
+        return [], 0, [], []
+    columns = [str(v) if v is not None else f"Unnamed: {i}" for i, v in enumerate(header)]
+    stats_list = [_new_column_stats() for _ in columns]
+    preview_rows = []
+    row_count = 0
+    for row in rows:
+        if not any(v is not None for v in row):
+            continue
+        row = (tuple(row) + (None,) * len(columns))[:len(columns)]
+        row_count += 1
+        if len(preview_rows) < SPREADSHEET_PREVIEW_ROWS:
+            preview_rows.append(row)
+        for stats, value in zip(stats_list, row):
+            _update_column_stats(stats, value)
+    return columns, row_count, preview_rows, stats_list
+
+def _read_csv_streaming(file):
+    columns, preview, stats_list = None, None, None
+    row_count = 0
+    for chunk in pd.read_csv(file, chunksize=SPREADSHEET_CSV_CHUNK_ROWS):
+        if columns is None:
+            columns = [str(c) for c in chunk.columns]
+            preview = chunk.head(SPREADSHEET_PREVIEW_ROWS).values.tolist()
+            stats_list = [_new_column_stats() for _ in columns]
+        row_count += len(chunk)
+        for stats, col in zip(stats_list, chunk.columns):
+            _update_column_stats_series(stats, chunk[col])
+    return columns or [], row_count, preview or [], stats_list or []
+
+def extract_text_from_excel(file, all_sheets=SPREADSHEET_ALL_SHEETS):
+    try:
+        file_extension = file.name.split('.')[-1].lower()
+        text = f"Excel File: {file.name}\n"
+        if file_extension == 'csv':
+            text += _format_sheet(*_read_csv_streaming(file))
+        elif file_extension == 'xlsx':
+            wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+            try:
+                sheets = wb.worksheets[:SPREADSHEET_MAX_SHEETS] if all_sheets else wb.worksheets[:1]
+                if len(sheets) > 1:
+                    text += f"Sheets: {', '.join(ws.title for ws in wb.worksheets)}\n\n"
+                text += "\n\n".join(
+                    _format_sheet(*_read_xlsx_sheet(ws), sheet_name=ws.title if len(sheets) > 1 else None)
+                    for ws in sheets
+                )
+            finally:
+                wb.close()
+        else:
+            # Legacy .xls has no streaming reader; summarize the frames pandas returns
+            frames = pd.read_excel(file, sheet_name=None if all_sheets else 0)
+            if not isinstance(frames, dict):
+                frames = {None: frames}
+            parts = []
+            for sheet_name, df in list(frames.items())[:SPREADSHEET_MAX_SHEETS]:
+                stats_list = [_new_column_stats() for _ in df.columns]
+                for stats, col in zip(stats_list, df.columns):
+                    _update_column_stats_series(stats, df[col])
+                parts.append(_format_sheet(
+                    [str(c) for c in df.columns], len(df), df.head(SPREADSHEET_PREVIEW_ROWS).values.tolist(),
+                    stats_list, sheet_name=sheet_name if len(frames) > 1 else None
+                ))
+            text += "\n\n".join(parts)
+        return text
+    except Exception as e:
+        raise ExtractionError(f"Error reading Excel file: {e}") from e
+
+def extract_text_from_image(file):
+    try:
+        image = Image.open(file)
+        text = f"Image File: {file.name}\n"
+        text += f"Format: {image.format}\n"
+        text += f"Size: {image.size[0]}x{image.size[1]} pixels\n"
+        text += f"Mode: {image.mode}\n\n"
+        text += "Note: Image uploaded. Ask questions about its content."
+        return text
+    except Exception as e:
+        raise ExtractionError(f"Error reading image: {e}") from e
+
+# Extracted document text is cached on disk by SHA-256 of the file content, so
+# the same file uploaded again (in any session, under any name) is not
+# re-extracted. Bump EXTRACTOR_VERSION when an extractor's output changes.
+EXTRACTOR_VERSION = "2"
+EXTRACTION_CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHEABLE_EXTENSIONS = {'pdf', 'docx', 'txt', 'xlsx', 'xls', 'csv'}
+
+def extraction_cache_key(data, file_extension):
+    digest = hashlib.sha256(data).hexdigest()
+    return hashlib.sha256(f"{EXTRACTOR_VERSION}:{file_extension}:{digest}".encode()).hexdigest()
+
+def process_uploaded_file(uploaded_file, progress_callback=None):
+    """Return the text of an uploaded file; raises ExtractionError if it cannot be read."""
+    file_extension = uploaded_file.name.split('.')[-1].lower()
+    cache_key = None
+    if file_extension in CACHEABLE_EXTENSIONS:
+        cache_key = extraction_cache_key(uploaded_file.getvalue(), file_extension)
+        cached = disk_cache_get("extract", cache_key)
+        if cached is not None:
+            text = cached.decode("utf-8")
+            if file_extension in ('xlsx', 'xls', 'csv'):
+                # The spreadsheet summary names the file it was built from
+                text = re.sub(r"^Excel File: [^\n]*", lambda m: f"Excel File: {uploaded_file.name}", text, count=1)
+            return text
+    text = _extract_uploaded_file(uploaded_file, file_extension, progress_callback)
+    if cache_key and text:
+        disk_cache_put("extract", cache_key, text.encode("utf-8"), EXTRACTION_CACHE_MAX_BYTES)
+    return text
+
+def _extract_uploaded_file(uploaded_file, file_extension, progress_callback=None):
+    if file_extension == 'pdf':
+        return extract_text_from_pdf(uploaded_file, progress_callback)
+    elif file_extension == 'docx':
+        return extract_text_from_docx(uploaded_file)
+    elif file_extension == 'txt':
+        return extract_text_from_txt(uploaded_file)
+    elif file_extension in ['xlsx', 'xls', 'csv']:
+        return extract_text_from_excel(uploaded_file)
+    elif file_extension in ['png', 'jpg', 'jpeg']:
+        return extract_text_from_image(uploaded_file)
+    else:
+        raise ExtractionError(f"Unsupported file type: {file_extension}")
+
+# ---------------- TENDER DOCUMENT DOWNLOADS ----------------
+# Documents linked from a notice's procurement platform (Vergabeplattform) are
+# fetched over a bounded thread pool. Requests to the same host are spaced by a
+# process-wide rate limiter, and downloads are cached on disk by URL and
+# deduplicated by content.
+DOWNLOAD_CONCURRENCY = 6
+DOWNLOAD_HOST_INTERVAL = 1.0
+DOWNLOAD_HOST_BURST = 2
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_MAX_BYTES = 50 * 1024 * 1024
+DOWNLOAD_MAX_FILES_PER_NOTICE = 25
+DOWNLOAD_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+DOWNLOAD_INDEX_MAX_BYTES = 16 * 1024 * 1024
+DOWNLOAD_HOST_LIMITERS_MAX = 1024
+DOWNLOAD_HOST_LIMITER_TTL = 60 * 60
+DOCUMENT_EXTENSIONS = ('pdf', 'docx', 'txt', 'xlsx', 'xls', 'csv', 'zip')
+
+def _url_extension(url):
+    name = unquote(urlparse(url).path).rsplit("/", 1)[-1]
+    return name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+_download_sessions = threading.local()
+
+def _download_session():
+    """requests.Session of the calling thread; Session objects are not thread-safe."""
+    session = getattr(_download_sessions, "session", None)
+    if session is None:
+        session = _download_sessions.session = requests.Session()
+    return session
+
+@st.cache_resource(show_spinner=False)
+def _host_rate_limiters():
+    """Process-wide token buckets per download host, at most DOWNLOAD_HOST_LIMITERS_MAX.
+
+    Hosts come from notice data, so they are kept in a bounded cache; a host
+    idle for DOWNLOAD_HOST_LIMITER_TTL seconds starts again with a full bucket.
+    """
+    return {"limiters": TTLCache(maxsize=DOWNLOAD_HOST_LIMITERS_MAX, ttl=DOWNLOAD_HOST_LIMITER_TTL),
+            "lock": threading.Lock()}
+
+def _host_rate_limiter(host):
+    state = _host_rate_limiters()
+    with state["lock"]:
+        limiter = state["limiters"].get(host)
+        if limiter is None:
+            limiter = new_rate_limiter(f"host:{host}", 1 / DOWNLOAD_HOST_INTERVAL, DOWNLOAD_HOST_BURST)
+        # Setting it again restarts its TTL, so busy hosts keep their bucket
+        state["limiters"][host] = limiter
+        return limiter
+
+def _polite_get(session, url):
+    host = urlparse(url).netloc.lower()
+    rate_limiter_acquire(_host_rate_limiter(host))
+    return session.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=DOWNLOAD_TIMEOUT, stream=True)
+
+def _read_limited(response):
+    data = BytesIO()
+    for block in response.iter_content(64 * 1024):
+        data.write(block)
+        if data.tell() > DOWNLOAD_MAX_BYTES:
+            response.close()
+            raise ValueError(f"larger than {DOWNLOAD_MAX_BYTES // (1024 * 1024)} MB")
+    return data.getvalue()
+
+def _response_filename(response, url):
+    disposition = response.headers.get("Content-Disposition", "")
+    m = re.search(r"filename\*=(?:UTF-8'')?([^;]+)|filename=\"?([^\";]+)", disposition, re.I)
+    if m:
+        return unquote((m.group(1) or m.group(2)).strip())
+    return unquote(urlparse(url).path).rsplit("/", 1)[-1] or "document"
+
+def _store_download(url, filename, data):
+    digest = hashlib.sha256(data).hexdigest()
+    disk_cache_put("download-blobs", digest, data, DOWNLOAD_CACHE_MAX_BYTES)
+    meta = json.dumps({"filename": filename, "sha256": digest}).encode("utf-8")
+    disk_cache_put("download-index", hashlib.sha256(url.encode("utf-8")).hexdigest(), meta, DOWNLOAD_INDEX_MAX_BYTES)
+
+def download_document(session, url):
+    """Return (filename, bytes) for url, from the disk cache when possible."""
+    meta = disk_cache_get("download-index", hashlib.sha256(url.encode("utf-8")).hexdigest())
+    if meta is not None:
+        meta = json.loads(meta)
+        data = disk_cache_get("download-blobs", meta["sha256"])
+        if data is not None:
+            return meta["filename"], data
+    r = _polite_get(session, url)
+    r.raise_for_status()
+    data = _read_limited(r)
+    filename = _response_filename(r, url)
+    _store_download(url, filename, data)
+    return filename, data
+
+def find_document_links(session, portal_url):
+    """Return the document URLs linked from a procurement platform page."""
+    if _url_extension(portal_url) in DOCUMENT_EXTENSIONS:
+        return [portal_url]
+    r = _polite_get(session, portal_url)
+    r.raise_for_status()
+    content = _read_limited(r)
+    if "html" not in r.headers.get("Content-Type", "").lower():
+        # The platform link points straight at a document or archive
+        _store_download(portal_url, _response_filename(r, portal_url), content)
+        return [portal_url]
+    tree = etree.HTML(content)
+    links = []
+    for href in (tree.xpath("//a/@href") if tree is not None else []):
+        url = urljoin(r.url, href.strip())
+        if url.startswith("http") and _url_extension(url) in DOCUMENT_EXTENSIONS and url not in links:
+            links.append(url)
+    return links[:DOWNLOAD_MAX_FILES_PER_NOTICE]
+
+def _expand_archive(filename, data):
+    if not filename.lower().endswith(".zip"):
+        return [(filename, data)]
+    files = []
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        for info in zf.infolist():
+            name = info.filename.rsplit("/", 1)[-1]
+            ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+            if info.is_dir() or info.file_size > DOWNLOAD_MAX_BYTES or ext not in DOCUMENT_EXTENSIONS or ext == "zip":
+                continue
+            files.append((name, zf.read(info)))
+    return files
+
+def fetch_tender_documents(notices, progress_callback=None):
+    """Download the documents of notices, given as (publication number, platform URL) pairs.
+
+    Returns (documents, errors): documents are (publication number, filename,
+    bytes) tuples without duplicate contents, errors are (publication number,
+    URL, message) tuples.
+    """
+    documents = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as pool:
+        link_futures = {pool.submit(lambda u: find_document_links(_download_session(), u), url): (pubno, url)
+                        for pubno, url in notices if url}
+        owners = {}
+        for fut in as_completed(link_futures):
+            pubno, portal_url = link_futures[fut]
+            try:
+                for url in fut.result():
+                    owners.setdefault(url, pubno)
+            except Exception as e:
+                errors.append((pubno, portal_url, str(e)))
+
+        futures = {pool.submit(lambda u: download_document(_download_session(), u), url): url for url in owners}
+        seen = set()
+        for done, fut in enumerate(as_completed(futures), 1):
+            url = futures[fut]
+            try:
+                files = _expand_archive(*fut.result())
+            except Exception as e:
+                errors.append((owners[url], url, str(e)))
+                files = []
+            for name, data in files:
+                digest = hashlib.sha256(data).digest()
+                if digest not in seen:
+                    seen.add(digest)
+                    documents.append((owners[url], name, data))
+            if progress_callback:
+                progress_callback(done, len(futures))
+    return documents, errors
+
+def named_bytes(data, name):
+    """Wrap bytes in a file-like object that the upload handlers accept."""
+    f = BytesIO(data)
+    f.name = name
+    return f
+
+# ---------------- DOCUMENT RETRIEVAL ----------------
+# Documents are split into overlapping chunks when they enter the library and
+# indexed with BM25. Each question only sends the best matching chunks that fit
+# into the token budget instead of a fixed prefix of every document.
+CHUNK_CHARS = 1500
+CHUNK_OVERLAP = 200
+RETRIEVAL_TOP_K = 8
+RETRIEVAL_TOKEN_BUDGET = 6000
+BM25_K1 = 1.5
+BM25_B = 0.75
+EMBEDDING_BACKEND = get_secret("EMBEDDING_BACKEND", "")
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = {
+    "the", "and", "for", "are", "was", "with", "this", "that", "from", "what", "when", "which", "who",
+    "der", "die", "das", "und", "ist", "den", "dem", "des", "ein", "eine", "einer", "mit", "von",
+    "für", "auf", "im", "in", "zu", "zum", "zur", "wie", "was", "wann", "wer", "welche", "sind",
+}
+_token_encoder = None
+
+def count_tokens(text):
+    """Count model tokens with tiktoken if available, else estimate ~4 chars per token."""
+    global _token_encoder
+    if tiktoken is not None and _token_encoder is None:
+        try:
+            _token_encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _token_encoder = False
+    if _token_encoder:
+        return len(_token_encoder.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def _terms(text):
+    return [w for w in _TERM_RE.findall(text.lower()) if len(w) > 1 and w not in _STOPWORDS]
+
+def chunk_document(text, chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """Split text into chunks of about chunk_chars, preferring paragraph breaks."""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n|\n(?=--- Page \d+ ---)", text) if p.strip()]
+    chunks = []
+    current = ""
+    for para in paragraphs:
+        while len(para) > chunk_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:chunk_chars])
+            para = para[chunk_chars - overlap:]
+        if current and len(current) + len(para) + 2 > chunk_chars:
+            chunks.append(current)
+            current = current[-overlap:] + "\n\n" + para
+        else:
+            current = f"{current}\n\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+# Optional local embedding backends: name -> callable(list of texts) -> list of
+# vectors. Select one with the EMBEDDING_BACKEND secret; rankings are then
+# fused with BM25.
+EMBEDDING_BACKENDS = {}
+
+def register_embedding_backend(name, embed_fn):
+    EMBEDDING_BACKENDS[name] = embed_fn
+
+def _embed(texts):
+    embed_fn = EMBEDDING_BACKENDS.get(EMBEDDING_BACKEND)
+    if not embed_fn or not texts:
+        return None
+    vectors = []
+    for vec in embed_fn(texts):
+        norm = sum(x * x for x in vec) ** 0.5 or 1.0
+        vectors.append([x / norm for x in vec])
+    return vectors
+
+def new_retrieval_index():
+    return {
+        "chunks": {},      # chunk id -> {"doc", "position", "text", "length", "tokens", "vector"}
+        "postings": {},    # term -> {chunk id: term frequency}
+        "docs": {},        # document name -> [chunk ids]
+        "hashes": {},      # document name -> SHA-256 of the indexed text
+        "total_length": 0,
+        "next_id": 0,
+    }
+
+def index_add_document(index, name, text):
+    if name in index["docs"]:
+        index_remove_document(index, name)
+    chunks = chunk_document(text)
+    vectors = _embed(chunks) or [None] * len(chunks)
+    ids = []
+    for position, (chunk, vector) in enumerate(zip(chunks, vectors)):
+        chunk_id = index["next_id"]
+        index["next_id"] += 1
+        terms = _terms(chunk)
+        for term, tf in Counter(terms).items():
+            index["postings"].setdefault(term, {})[chunk_id] = tf
+        index["chunks"][chunk_id] = {
+            "doc": name, "position": position, "text": chunk,
+            "length": len(terms), "tokens": count_tokens(chunk), "vector": vector,
+        }
+        index["total_length"] += len(terms)
+        ids.append(chunk_id)
+    index["docs"][name] = ids
+    index["hashes"][name] = _text_digest(text)
+
+def index_remove_document(index, name):
+    index["hashes"].pop(name, None)
+    for chunk_id in index["docs"].pop(name, []):
+        chunk = index["chunks"].pop(chunk_id)
+        index["total_length"] -= chunk["length"]
+        for term in set(_terms(chunk["text"])):
+            postings = index["postings"].get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del index["postings"][term]
+
+def _text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def sync_retrieval_index(index, document_store):
+    """Index new and changed documents and drop removed ones so the index mirrors the store.
+
+    Documents are compared by content, so a new upload under an existing name
+    replaces the old chunks.
+    """
+    for name in list(index["docs"]):
+        if name not in document_store:
+            index_remove_document(index, name)
+    for name, text in document_store.items():
+        if index["hashes"].get(name) != _text_digest(text):
+            index_add_document(index, name, text)
+
+def _bm25_ranking(index, query):
+    n_chunks = len(index["chunks"])
+    if not n_chunks:
+        return []
+    avg_len = index["total_length"] / n_chunks or 1.0
+    scores = {}
+    for term in set(_terms(query)):
+        postings = index["postings"].get(term)
+        if not postings:
+            continue
+        idf = max(0.0, math.log((n_chunks - len(postings) + 0.5) / (len(postings) + 0.5) + 1))
+        for chunk_id, tf in postings.items():
+            length = index["chunks"][chunk_id]["length"]
+            denom = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / denom
+    return sorted(scores, key=scores.get, reverse=True)
+
+def _embedding_ranking(index, query, limit):
+    query_vec = _embed([query])
+    if not query_vec:
+        return []
+    query_vec = query_vec[0]
+    scored = [
+        (sum(a * b for a, b in zip(query_vec, chunk["vector"])), chunk_id)
+        for chunk_id, chunk in index["chunks"].items() if chunk["vector"] is not None
+    ]
+    scored.sort(reverse=True)
+    return [chunk_id for _, chunk_id in scored[:limit]]
+
+def retrieve_chunks(index, query, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    """Return the best chunks for query that fit into token_budget, in document order."""
+    ranking = _bm25_ranking(index, query)
+    dense = _embedding_ranking(index, query, top_k * 4)
+    if dense:
+        # Reciprocal rank fusion of the lexical and the embedding ranking
+        fused = {}
+        for ranked in (ranking[:top_k * 4], dense):
+            for rank, chunk_id in enumerate(ranked):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (60 + rank)
+        ranking = sorted(fused, key=fused.get, reverse=True)
+    if not ranking:
+        # Nothing matched (e.g. "summarize this"): take documents from the start
+        ranking = [ids[i] for i in range(max(map(len, index["docs"].values()), default=0))
+                   for ids in index["docs"].values() if i < len(ids)]
+    selected = []
+    used = 0
+    for chunk_id in ranking:
+        chunk = index["chunks"][chunk_id]
+        if used + chunk["tokens"] > token_budget:
+            continue
+        selected.append(chunk)
+        used += chunk["tokens"]
+        if len(selected) >= top_k:
+            break
+    doc_order = {name: i for i, name in enumerate(index["docs"])}
+    return sorted(selected, key=lambda c: (doc_order[c["doc"]], c["position"]))
+
+@st.cache_resource(show_spinner=False)
+def get_azure_client(azure_endpoint, azure_key, api_version):
+    """One client (and HTTP connection pool) per endpoint, shared by all sessions."""
+    return AzureOpenAI(
+        azure_endpoint=azure_endpoint,
+        api_key=azure_key,
+        api_version=api_version
+    )
+
+# Answers are cached process-wide by normalized prompt, conversation so far,
+# document set and deployment, so a repeated question about the same tender
+# is answered without another model call.
+ANSWER_CACHE_TTL = 6 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 1000
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    return {"entries": TTLCache(maxsize=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL), "lock": threading.Lock()}
+
+def _normalize_prompt(prompt):
+    return re.sub(r"\s+", " ", prompt).strip().rstrip("?!. ").lower()
+
+def document_set_digest(document_store):
+    h = hashlib.sha256()
+    for name in sorted(document_store):
+        h.update(name.encode("utf-8"))
+        h.update(hashlib.sha256(document_store[name].encode("utf-8")).digest())
+    return h.hexdigest()
+
+def answer_cache_key(prompt, history, document_digest, deployment_name):
+    """history: the messages before prompt (empty for a first question)."""
+    h = hashlib.sha256()
+    for part in (_normalize_prompt(prompt), document_digest, deployment_name):
+        h.update(part.encode("utf-8") + b"\0")
+    for m in history:
+        h.update(f"{m['role']}:{m['content']}".encode("utf-8") + b"\0")
+    return h.hexdigest()
+
+def answer_cache_get(key):
+    cache = get_answer_cache()
+    with cache["lock"]:
+        return cache["entries"].get(key)
+
+def answer_cache_put(key, text):
+    cache = get_answer_cache()
+    with cache["lock"]:
+        cache["entries"][key] = text
+
+def get_azure_chatbot_response(messages, azure_endpoint, azure_key, deployment_name, api_version="2024-08-01-preview"):
+    client = get_azure_client(azure_endpoint, azure_key, api_version)
+    stream = client.chat.completions.create(
+        model=deployment_name,
+        messages=messages,
         stream=True,
         temperature=0.7,
     )
     return stream
 
+# UI updates while streaming are batched: a flush happens after this many
+# characters or seconds, whichever comes first.
+STREAM_FLUSH_CHARS = 40
+STREAM_FLUSH_SECONDS = 0.05
+
+def stream_response_text(stream, metrics, on_first_token=None):
+    """Yield the reply text in small batches as chunks arrive from the API.
+
+    metrics must contain "started" (perf_counter at request time); it receives
+    the full text, time to first token, token count and tokens per second. The
+    HTTP stream is closed when the generator is closed, e.g. when Streamlit
+    stops the script because the user sent a new message.
+    """
+    parts = []
+    buffer = []
+    buffered = 0
+    last_flush = time.perf_counter()
+    metrics.update({"text": "", "ttft": None, "tokens": 0, "tokens_per_sec": None})
+    try:
+        for chunk in stream:
+            if not getattr(chunk, "choices", None):
+                continue
+            content = getattr(getattr(chunk.choices[0], "delta", None), "content", None)
+            if not content:
+                continue
+            now = time.perf_counter()
+            if metrics["ttft"] is None:
+                metrics["ttft"] = now - metrics["started"]
+                if on_first_token:
+                    on_first_token()
+            parts.append(content)
+            buffer.append(content)
+            buffered += len(content)
+            if buffered >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_SECONDS:
+                yield "".join(buffer)
+                buffer = []
+                buffered = 0
+                last_flush = now
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+        metrics["text"] = "".join(parts)
+        metrics["tokens"] = count_tokens(metrics["text"]) if parts else 0
+        if metrics["ttft"] is not None:
+            generation_time = time.perf_counter() - metrics["started"] - metrics["ttft"]
+            if generation_time > 0:
+                metrics["tokens_per_sec"] = metrics["tokens"] / generation_time
+
+def format_reply_metrics(metrics):
+    if metrics and metrics.get("cached"):
+        return "⚡ Cached answer"
+    if not metrics or metrics.get("ttft") is None:
+        return ""
+    text = f"⏱️ {metrics['ttft']:.2f}s to first token · {metrics['tokens']} tokens"
+    if metrics.get("tokens_per_sec"):
+        text += f" · {metrics['tokens_per_sec']:.1f} tokens/s"
+    return text
+
+def get_azure_completion(messages, azure_endpoint, azure_key, deployment_name, api_version="2024-08-01-preview", max_tokens=None, temperature=0.2):
+    """Non-streaming completion for internal tasks such as summaries."""
+    client = get_azure_client(azure_endpoint, azure_key, api_version)
+    response = client.chat.completions.create(
+        model=deployment_name,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    return response.choices[0].message.content or ""
+
+# ---------------- MAP-REDUCE SUMMARIES ----------------
+# Documents too large for the excerpt budget are summarized part by part (map)
+# and the part notes are combined into one digest (reduce). Every call is
+# cached on disk by its input, so a document is only processed once.
+MAP_REDUCE_VERSION = "1"
+MAP_REDUCE_CHUNK_CHARS = 24000
+MAP_REDUCE_CONCURRENCY = 4
+MAP_REDUCE_NOTES_TOKENS = 600
+MAP_REDUCE_REDUCE_INPUT_TOKENS = 12000
+MAP_REDUCE_DIGEST_TOKENS = 1500
+MAP_REDUCE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+MAP_PROMPT = """You extract the essential content from one part of a procurement or tender document.
+Write compact notes in the document's language: subject and scope, deadlines and dates, requirements and
+suitability criteria, award criteria, quantities, values, lots, contacts and anything else a bidder must know.
+Keep section or page references. Do not invent information."""
+
+REDUCE_PROMPT = """You combine notes taken from consecutive parts of one procurement or tender document
+into a single structured summary in the document's language. Keep all concrete facts (dates, amounts, criteria,
+lots, section or page references), merge duplicates and keep the order of the document."""
+
+def _map_reduce_call(client, deployment_name, system_prompt, text, max_tokens):
+    key = hashlib.sha256(
+        f"{MAP_REDUCE_VERSION}\0{deployment_name}\0{max_tokens}\0{system_prompt}\0{text}".encode("utf-8")
+    ).hexdigest()
+    cached = disk_cache_get("mapreduce", key)
+    if cached is not None:
+        return cached.decode("utf-8")
+    response = client.chat.completions.create(
+        model=deployment_name,
+        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": text}],
+        temperature=0.0,
+        max_tokens=max_tokens,
+    )
+    result = response.choices[0].message.content or ""
+    if result:
+        disk_cache_put("mapreduce", key, result.encode("utf-8"), MAP_REDUCE_CACHE_MAX_BYTES)
+    return result
+
+def _run_map_reduce_calls(client, deployment_name, system_prompt, texts, max_tokens, progress_callback=None):
+    results = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=MAP_REDUCE_CONCURRENCY) as pool:
+        futures = {
+            pool.submit(_map_reduce_call, client, deployment_name, system_prompt, text, max_tokens): i
+            for i, text in enumerate(texts)
+        }
+        for done, fut in enumerate(as_completed(futures), 1):
+            results[futures[fut]] = fut.result()
+            if progress_callback:
+                progress_callback(done, len(texts))
+    return results
+
+def map_reduce_document(text, azure_endpoint, azure_key, deployment_name, api_version, progress_callback=None):
+    """Return a digest of the whole document built with bounded concurrent calls."""
+    client = get_azure_client(azure_endpoint, azure_key, api_version)
+    chunks = chunk_document(text, MAP_REDUCE_CHUNK_CHARS, CHUNK_OVERLAP)
+    notes = _run_map_reduce_calls(
+        client, deployment_name, MAP_PROMPT,
+        [f"Part {i + 1} of {len(chunks)}\n\n{chunk}" for i, chunk in enumerate(chunks)],
+        MAP_REDUCE_NOTES_TOKENS, progress_callback
+    )
+    notes = [f"[Part {i + 1}]\n{note}" for i, note in enumerate(notes)]
+    # Reduce in groups until the notes fit into a single call
+    while len(notes) > 1 and count_tokens("\n\n".join(notes)) > MAP_REDUCE_REDUCE_INPUT_TOKENS:
+        groups = []
+        current, current_tokens = [], 0
+        for note in notes:
+            tokens = count_tokens(note)
+            if current and current_tokens + tokens > MAP_REDUCE_REDUCE_INPUT_TOKENS:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(note)
+            current_tokens += tokens
+        groups.append(current)
+        if len(groups) == len(notes):
+            break
+        notes = _run_map_reduce_calls(
+            client, deployment_name, REDUCE_PROMPT,
+            ["\n\n".join(group) for group in groups], MAP_REDUCE_NOTES_TOKENS * 2
+        )
+    return _map_reduce_call(client, deployment_name, REDUCE_PROMPT, "\n\n".join(notes), MAP_REDUCE_DIGEST_TOKENS)
+
+# ---------------- AI ENRICHMENT OF NOTICES ----------------
+# Scraped notices are sent to the model in small batches to get a relevance
+# score, a short summary and the matching service lines. Results are cached
+# per publication number.
+ENRICH_VERSION = "1"
+ENRICH_BATCH_SIZE = 5
+ENRICH_CONCURRENCY = 4
+ENRICH_REQUESTS_PER_MINUTE = 60
+ENRICH_CACHE_MAX_BYTES = 64 * 1024 * 1024
+ENRICHMENT_COLUMNS = ["KI Relevanz", "KI Zusammenfassung", "KI Leistungsbereiche"]
+SERVICE_LINES = [
+    line.strip() for line in (get_secret("SERVICE_LINES", "") or
+        "Projektmanagement/Projektsteuerung, Objektplanung, Tragwerksplanung, Technische Ausrüstung, "
+        "Verkehrsanlagen, Bauüberwachung, Vermessung, Gutachten/Beratung").split(",") if line.strip()
+]
+
+ENRICH_PROMPT = """You assess public procurement notices for JKM Consult, an engineering and project management consultancy.
+Our service lines: {service_lines}.
+For every notice return an object with:
+- "publication_number": the notice's publication number
+- "relevance": integer 0-10, how well the notice fits our service lines (10 = perfect fit)
+- "summary": at most two sentences in German describing subject, scope and notable requirements
+- "service_lines": list of our service lines the notice matches (exact names from the list, may be empty)
+Answer with a JSON object {{"results": [...]}} and nothing else."""
+
+def _enrich_cache_key(pubno, deployment_name):
+    return hashlib.sha256(
+        f"{ENRICH_VERSION}\0{deployment_name}\0{','.join(SERVICE_LINES)}\0{pubno}".encode("utf-8")
+    ).hexdigest()
+
+def _notice_for_enrichment(row):
+    return {
+        "publication_number": row.get("publication-number", ""),
+        "title": row.get("Projektbezeichnung", ""),
+        "buyer": row.get("Beschaffer", ""),
+        "cpv": row.get("CPV Codes", ""),
+        "lots": (row.get("Leistungen/Rollen") or "")[:1500],
+        "criteria": (row.get("Geforderte Unternehmensreferenzen") or "")[:1500],
+        "volume": row.get("Projektvolumen", ""),
+        "deadline": row.get("Frist Abgabedatum", ""),
+    }
+
+def _enrich_batch(client, deployment_name, batch, limiter):
+    """Return {publication number: enrichment columns} for one batch of rows."""
+    rate_limiter_acquire(limiter)
+    response = client.chat.completions.create(
+        model=deployment_name,
+        messages=[
+            {"role": "system", "content": ENRICH_PROMPT.format(service_lines=", ".join(SERVICE_LINES))},
+            {"role": "user", "content": json.dumps([_notice_for_enrichment(r) for r in batch], ensure_ascii=False)},
+        ],
+        temperature=0.0,
+        response_format={"type": "json_object"},
+    )
+    data = json.loads(response.choices[0].message.content or "{}")
+    out = {}
+    for item in data.get("results") or []:
+        pubno = str(item.get("publication_number") or "")
+        try:
+            relevance = max(0, min(10, int(item.get("relevance"))))
+        except (TypeError, ValueError):
+            relevance = None
+        lines = [line for line in (item.get("service_lines") or []) if line in SERVICE_LINES]
+        out[pubno] = {
+            "KI Relevanz": relevance,
+            "KI Zusammenfassung": str(item.get("summary") or "").strip(),
+            "KI Leistungsbereiche": "; ".join(lines),
+        }
+    return out
+
+def enrich_notices(rows, azure_endpoint, azure_key, deployment_name, api_version, progress_callback=None):
+    """Add the ENRICHMENT_COLUMNS to rows in place. Returns (enriched, failed) counts."""
+    client = get_azure_client(azure_endpoint, azure_key, api_version)
+    limiter = get_rate_limiter("azure-enrichment", ENRICH_REQUESTS_PER_MINUTE / 60, ENRICH_CONCURRENCY)
+    pending = []
+    enriched = 0
+    for row in rows:
+        pubno = row.get("publication-number")
+        if not pubno:
+            continue
+        cached = disk_cache_get("enrich", _enrich_cache_key(pubno, deployment_name))
+        if cached is not None:
+            row.update(json.loads(cached))
+            enriched += 1
+        else:
+            pending.append(row)
+    batches = [pending[i:i + ENRICH_BATCH_SIZE] for i in range(0, len(pending), ENRICH_BATCH_SIZE)]
+    failed = 0
+    with ThreadPoolExecutor(max_workers=ENRICH_CONCURRENCY) as pool:
+        futures = {pool.submit(_enrich_batch, client, deployment_name, batch, limiter): batch for batch in batches}
+        for done, fut in enumerate(as_completed(futures), 1):
+            batch = futures[fut]
+            try:
+                results = fut.result()
+            except Exception:
+                results = {}
+            for row in batch:
+                columns = results.get(row["publication-number"])
+                if columns is None:
+                    failed += 1
+                    continue
+                row.update(columns)
+                enriched += 1
+                disk_cache_put(
+                    "enrich", _enrich_cache_key(row["publication-number"], deployment_name),
+                    json.dumps(columns, ensure_ascii=False).encode("utf-8"), ENRICH_CACHE_MAX_BYTES
+                )
+            if progress_callback:
+                progress_callback(done, len(batches))
+    return enriched, failed
+
+# ---------------- CHAT HISTORY BUDGET ----------------
+# Token budget per request. Recent turns are sent verbatim, older turns are
+# folded into a rolling summary, and the remainder is left for document
+# excerpts, so prompt size stays bounded however long the session runs.
+CHAT_MAX_PROMPT_TOKENS = 24000
+CHAT_SYSTEM_RESERVE = 1000
+CHAT_SUMMARY_MAX_TOKENS = 800
+CHAT_HISTORY_TOKENS = CHAT_MAX_PROMPT_TOKENS - CHAT_SYSTEM_RESERVE - CHAT_SUMMARY_MAX_TOKENS - RETRIEVAL_TOKEN_BUDGET
+CHAT_MESSAGE_OVERHEAD = 4
+
+def _message_tokens(message):
+    return count_tokens(message["content"]) + CHAT_MESSAGE_OVERHEAD
+
+def _recent_start(messages, lower, budget):
+    """Index of the oldest message after lower that still fits into budget (always keeps the last one)."""
+    start = len(messages)
+    used = 0
+    while start > lower:
+        tokens = _message_tokens(messages[start - 1])
+        if used + tokens > budget and start < len(messages):
+            break
+        used += tokens
+        start -= 1
+    return start
+
+def compact_chat_history(messages, summary, summarize_fn):
+    """Return (recent messages to send verbatim, updated summary).
+
+    summary is {"text": str, "upto": int}; messages[:upto] are already folded
+    into its text. When the unsummarized turns outgrow CHAT_HISTORY_TOKENS, the
+    oldest ones are passed to summarize_fn(previous_text, turns) until the
+    rest fits into half the budget, so compaction does not run on every turn.
+    """
+    start = _recent_start(messages, summary["upto"], CHAT_HISTORY_TOKENS)
+    if start > summary["upto"]:
+        start = _recent_start(messages, summary["upto"], CHAT_HISTORY_TOKENS // 2)
+        try:
+            text = summarize_fn(summary["text"], messages[summary["upto"]:start])
+        except Exception:
+            # Drop the old turns rather than overflow the context
+            text = summary["text"]
+        summary = {"text": text, "upto": start}
+    recent = [{"role": m["role"], "content": m["content"]} for m in messages[summary["upto"]:]]
+    return recent, summary
+
+def document_token_budget(recent, summary):
+    used = CHAT_SYSTEM_RESERVE + count_tokens(summary["text"]) + sum(_message_tokens(m) for m in recent)
+    return max(0, min(RETRIEVAL_TOKEN_BUDGET, CHAT_MAX_PROMPT_TOKENS - used))
+
+# Map-reduce digests share the document budget with the retrieved excerpts;
+# together they may use at most this part of it.
+CHAT_DIGEST_SHARE = 0.5
+CHAT_DIGEST_MIN_TOKENS = 200
+
+def _truncate_to_tokens(text, limit):
+    tokens = count_tokens(text)
+    while tokens > limit and text:
+        text = text[:max(0, int(len(text) * limit / tokens) - 1)]
+        tokens = count_tokens(text)
+    return text
+
+def fit_digests(digests, budget):
+    """Fit [(name, digest)] into budget tokens; returns the fitted list and the tokens it uses.
+
+    Short digests are kept whole and the rest share what is left equally.
+    If a share would fall under CHAT_DIGEST_MIN_TOKENS the last digests are dropped.
+    """
+    digests = digests[:budget // CHAT_DIGEST_MIN_TOKENS]
+    sizes = [count_tokens(text) for _, text in digests]
+    shares = [0] * len(digests)
+    left, pending = budget, sorted(range(len(digests)), key=sizes.__getitem__)
+    while pending:
+        i = pending.pop(0)
+        shares[i] = min(sizes[i], left // (len(pending) + 1))
+        left -= shares[i]
+    fitted = [(name, text if sizes[i] <= shares[i] else _truncate_to_tokens(text, shares[i]))
+              for i, (name, text) in enumerate(digests)]
+    return fitted, sum(count_tokens(text) for _, text in fitted)
+
+def summarize_chat_turns(previous_summary, turns, azure_endpoint, azure_key, deployment_name, api_version):
+    transcript = "\n\n".join(f"{m['role'].upper()}: {m['content']}" for m in turns)
+    messages = [
+        {"role": "system", "content": (
+            "You maintain a running summary of a conversation between a user and JKM AI Assistant. "
+            "Merge the new turns into the existing summary. Keep facts, figures, deadlines, document names, "
+            "decisions and open questions. Write in the language of the conversation and be concise."
+        )},
+        {"role": "user", "content": f"Existing summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"},
+    ]
+    return get_azure_completion(
+        messages, azure_endpoint, azure_key, deployment_name, api_version,
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS
+    )
+
+def build_api_messages(system_content, recent, summary):
+    api_messages = [{"role": "system", "content": system_content}]
+    if summary["text"]:
+        api_messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary['text']}"})
+    return api_messages + recent
+
+# ---------------- PROFILING ----------------
+# Opt-in via the PROFILING_ENABLED secret or environment variable, and only for
+# the users listed in PROFILING_ADMINS (comma-separated object ids or UPNs). The
+# sidebar then offers to profile the next rerun or the next search; each
+# profiled call is saved as cProfile stats (for pstats, snakeviz or flameprof)
+# next to a JSON file with its parameters. Users only see their own profiles.
+PROFILING_ENABLED = str(get_secret("PROFILING_ENABLED", "") or os.environ.get("PROFILING_ENABLED", "")).lower() in ("1", "true", "yes")
+PROFILING_ADMINS = {name.strip().lower() for name in get_secret("PROFILING_ADMINS", "").split(",") if name.strip()}
+PROFILE_DIR = get_secret("PROFILE_DIR", "") or os.path.join(CACHE_DIR, "profiles")
+PROFILE_KEEP = 50
+
+def profiling_allowed():
+    """Whether the signed-in user may profile: PROFILING_ENABLED and listed in PROFILING_ADMINS."""
+    if not PROFILING_ENABLED:
+        return False
+    oid = st.session_state.get("user_id", "").split(".")[0].lower()
+    upn = st.session_state.get("user_name", "").lower()
+    return bool(oid and oid in PROFILING_ADMINS or upn and upn in PROFILING_ADMINS)
+
+def _profile_owner():
+    """Short, file-name safe tag of the signed-in user."""
+    return hashlib.sha256(st.session_state.get("user_id", "").encode("utf-8")).hexdigest()[:12]
+
+def profile_call(label, params, func, *args, **kwargs):
+    """Run func under cProfile and save the stats with params. Returns func's result."""
+    profiler = cProfile.Profile()
+    started = time.time()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        _save_profile(label, params, profiler, started)
+
+def _save_profile(label, params, profiler, started):
+    name = f"{datetime.fromtimestamp(started).strftime('%Y%m%d-%H%M%S')}-{_profile_owner()}-{label}-{secrets.token_hex(3)}"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}.pstats"))
+        meta = {
+            "label": label,
+            "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+            "seconds": round(time.time() - started, 3),
+            "user": st.session_state.get("user_name", ""),
+            "params": params,
+        }
+        with open(os.path.join(PROFILE_DIR, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2, default=str)
+    except OSError:
+        return
+    for old in list_profiles(limit=None)[PROFILE_KEEP:]:
+        for ext in (".pstats", ".json"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old + ext))
+            except OSError:
+                pass
+
+def list_profiles(owner=None, limit=10):
+    """Names of saved profiles of owner (see _profile_owner; all if None), newest first."""
+    pattern = "*.pstats" if owner is None else f"*-{owner}-*.pstats"
+    names = sorted((os.path.basename(p)[:-len(".pstats")] for p in glob.glob(os.path.join(PROFILE_DIR, pattern))), reverse=True)
+    return names if limit is None else names[:limit]
+
+def profile_summary(name, lines=25):
+    """Parameters and the top functions by cumulative time of a saved profile."""
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{name}.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+    out = StringIO()
+    pstats.Stats(os.path.join(PROFILE_DIR, f"{name}.pstats"), stream=out).sort_stats("cumulative").print_stats(lines)
+    return meta, out.getvalue()
+
+def profiling_query_params():
+    """URL query parameters of the session, without sign-in secrets."""
+    return {k: v for k, v in st.query_params.to_dict().items() if k not in ("code", "state", "session_state", "results")}
+
 # ------------------- MAIN APP -------------------
 def main():
     st.set_page_config(page_title="TED Scraper & AI Assistant", layout="wide", initial_sidebar_state="collapsed")
@@ -859,6 +3864,10 @@ def main():
     header_col1, header_col2, header_col3 = st.columns([6, 1, 1])
     with header_col1:
         st.title(t("title"))
+    with header_col2:
+        if st.button(t("logout"), key="logout_button"):
+            logout()
+            st.rerun()
     with header_col3:
         selected_lang = st.selectbox(
             t("language"),
@@ -873,8 +3882,36 @@ def main():
             st.session_state.language = new_lang
             st.rerun()
     
-    if "scraped_data" not in st.session_state:
-        st.session_state.scraped_data = None
+    if "results_key" not in st.session_state:
+        # With shared state a token travels in the URL, so a reload served by another replica finds
+        # the results. The store key is derived from it and the signed-in user, so someone else
+        # opening the same link gets a key of their own and cannot read them.
+        token = st.query_params.get("results", "")
+        if not (shared_state_is_external() and re.fullmatch(r"[0-9a-f]{32}", token)):
+            token = secrets.token_hex(16)
+            if shared_state_is_external():
+                st.query_params["results"] = token
+        st.session_state.results_key = hashlib.sha256(
+            f"{st.session_state.get('user_id', '')}:{token}".encode("utf-8")
+        ).hexdigest()
+
+    if profiling_allowed():
+        with st.sidebar.expander(t("profiling_header"), expanded=False):
+            prof_col1, prof_col2 = st.columns(2)
+            with prof_col1:
+                if st.button(t("profiling_rerun"), help=t("profiling_rerun_help")):
+                    st.session_state.profile_rerun_pending = True
+            with prof_col2:
+                if st.button(t("profiling_search"), help=t("profiling_search_help")):
+                    st.session_state.profile_search_pending = True
+            profiles = list_profiles(_profile_owner())
+            if profiles:
+                profile_name = st.selectbox(t("profiling_saved"), options=profiles)
+                meta, stats_text = profile_summary(profile_name)
+                st.json(meta, expanded=False)
+                st.code(stats_text, language=None)
+                with open(os.path.join(PROFILE_DIR, f"{profile_name}.pstats"), "rb") as f:
+                    st.download_button(t("profiling_download"), data=f.read(), file_name=f"{profile_name}.pstats")
     
     tab1, tab2 = st.tabs([t("tab_scraper"), t("tab_assistant")])
     
@@ -930,14 +3967,57 @@ def main():
         date_start = start_date_obj.strftime("%Y%m%d")
         date_end = end_date_obj.strftime("%Y%m%d")
 
+        selected_fields = st.multiselect(
+            t("fields_label"),
+            options=ALL_FIELDS,
+            default=ALL_FIELDS,
+            help=t("fields_help")
+        )
+        if len(selected_fields) < len(ALL_FIELDS):
+            st.caption(t("fields_cost", cost=fields_cost(selected_fields), total=fields_cost()))
+        latest_only = st.checkbox(t("latest_only"), value=True, help=t("latest_only_help"))
+        incremental = st.checkbox(t("incremental"), value=False, help=t("incremental_help"))
+
+        with st.expander(t("pushdown_header"), expanded=False):
+            pushdown_enabled = st.checkbox(t("pushdown_enable"), help=t("pushdown_help"))
+            pushdown_buyers = st.text_area(t("pushdown_buyers"), height=80)
+            pd_col1, pd_col2, pd_col3 = st.columns(3)
+            with pd_col1:
+                pushdown_deadline_from = st.date_input(t("pushdown_deadline_from"), value=None)
+            with pd_col2:
+                pushdown_deadline_to = st.date_input(t("pushdown_deadline_to"), value=None)
+            with pd_col3:
+                pushdown_min_value = st.number_input(t("pushdown_min_value"), min_value=0, value=0, step=10000)
+        query_filters = None
+        if pushdown_enabled:
+            query_filters = {
+                "buyer_names": pushdown_buyers.splitlines(),
+                "deadline_from": pushdown_deadline_from,
+                "deadline_to": pushdown_deadline_to,
+                "min_value": pushdown_min_value,
+            }
+
         if st.button(t("search_button"), type="primary"):
             if not keywords.strip() and not cpv_codes.strip():
                 st.error(t("error_no_keywords"))
             else:
                 with st.spinner(t("searching")):
                     try:
-                        rows = main_scraper(cpv_codes, keywords, date_start, date_end, buyer_country)
-                        st.session_state.scraped_data = rows
+                        scrape_args = (
+                            cpv_codes, keywords, date_start, date_end, buyer_country, query_filters,
+                            None if len(selected_fields) == len(ALL_FIELDS) else selected_fields,
+                            latest_only, incremental
+                        )
+                        if profiling_allowed() and st.session_state.pop("profile_search_pending", False):
+                            params = dict(zip(
+                                ["cpv_codes", "keywords", "date_start", "date_end", "buyer_country",
+                                 "query_filters", "fields", "latest_only", "incremental"], scrape_args
+                            ))
+                            params["query_params"] = profiling_query_params()
+                            rows = profile_call("main_scraper", params, main_scraper, *scrape_args)
+                        else:
+                            rows = main_scraper(*scrape_args)
+                        store_results(st.session_state.results_key, rows)
                         if len(rows) > 0:
                             st.success(t("success_found", count=len(rows)))
                         else:
@@ -947,20 +4027,146 @@ def main():
                         import traceback
                         st.code(traceback.format_exc())
 
+        with st.expander(t("batch_header"), expanded=False):
+            save_col1, save_col2 = st.columns([3, 1])
+            with save_col1:
+                query_name = st.text_input(t("batch_save_name"))
+            with save_col2:
+                st.write("")
+                if st.button(t("batch_save_button")) and query_name.strip():
+                    query_name = save_query(query_name, {
+                        "keywords": keywords, "cpv_codes": cpv_codes,
+                        "buyer_country": buyer_country, "query_filters": query_filters,
+                    })
+                    st.success(t("batch_saved", name=query_name))
+            saved_queries = load_saved_queries()
+            if not saved_queries:
+                st.caption(t("batch_none_saved"))
+            else:
+                selected_queries = st.multiselect(
+                    t("batch_select"), options=list(saved_queries), default=list(saved_queries),
+                    help=t("batch_select_help")
+                )
+                run_col, delete_col = st.columns(2)
+                with delete_col:
+                    if st.button(t("batch_delete_button")) and selected_queries:
+                        delete_saved_queries(selected_queries)
+                        st.rerun()
+                with run_col:
+                    run_batch = st.button(t("batch_run_button"), type="primary", disabled=not selected_queries)
+                if run_batch:
+                    with st.spinner(t("searching")):
+                        try:
+                            rows, stats = run_query_batch(
+                                {name: saved_queries[name] for name in selected_queries}, date_start, date_end,
+                                None if len(selected_fields) == len(ALL_FIELDS) else selected_fields,
+                                latest_only, incremental
+                            )
+                            store_results(st.session_state.results_key, rows)
+                            st.info(t("batch_summary", hits=sum(stats["hits"].values()),
+                                      queries=len(stats["hits"]), fetched=stats["fetched"]))
+                            for name, error in stats["failed"].items():
+                                st.warning(t("batch_query_failed", name=name, error=error))
+                            if rows:
+                                st.success(t("success_found", count=len(rows)))
+                            else:
+                                st.warning(t("warning_no_results"))
+                        except Exception as e:
+                            st.error(t("error_search", error=str(e)))
+
+        with st.expander(t("bulk_header"), expanded=False):
+            bulk_path = st.text_input(t("bulk_path"), help=t("bulk_help"))
+            if st.button(t("bulk_button")) and bulk_path.strip():
+                packages = find_bulk_packages(bulk_path.strip())
+                if not packages:
+                    st.error(t("bulk_no_files"))
+                else:
+                    status_text = st.empty()
+                    rows, stats = import_bulk_packages(
+                        packages, cpv_codes, buyer_country,
+                        None if len(selected_fields) == len(ALL_FIELDS) else selected_fields,
+                        lambda stats: status_text.text(t("bulk_status", **{k: stats[k] for k in ("scanned", "matched", "parsed")}))
+                    )
+                    status_text.text(t("bulk_status", **{k: stats[k] for k in ("scanned", "matched", "parsed")}))
+                    store_results(st.session_state.results_key, rows)
+                    st.session_state.scrape_failures = []
+                    if rows:
+                        st.success(t("success_found", count=len(rows)))
+                    else:
+                        st.warning(t("warning_no_results"))
+
+        with st.expander(t("archive_header"), expanded=False):
+            archive_stats = xml_archive_stats()
+            st.caption(t("archive_stats", notices=archive_stats["notices"], stale=archive_stats["stale"], version=PARSER_VERSION))
+            current_results = load_results(st.session_state.results_key)
+            archive_current_only = st.checkbox(t("archive_current_only"), value=current_results is not None,
+                                               disabled=current_results is None)
+            archive_stale_only = st.checkbox(t("archive_stale_only"))
+            if st.button(t("archive_button"), help=t("archive_help"), disabled=not archive_stats["notices"]):
+                status_text = st.empty()
+                rows, stats = reprocess_archive(
+                    current_results.column("publication-number").to_pylist() if archive_current_only else None,
+                    None if len(selected_fields) == len(ALL_FIELDS) else selected_fields,
+                    archive_stale_only,
+                    lambda stats: status_text.text(t("archive_status", **stats))
+                )
+                status_text.text(t("archive_status", **stats))
+                if archive_current_only:
+                    # Update the re-extracted columns in place; rows that were not re-extracted
+                    # and columns that did not come from the parser (query tags, AI enrichment, ...)
+                    # stay as they were
+                    reprocessed = {row["publication-number"]: row for row in rows}
+                    rows = [{**row, **reprocessed.get(row["publication-number"], {})}
+                            for row in current_results.to_pylist()]
+                store_results(st.session_state.results_key, rows)
+                st.session_state.scrape_failures = []
+                if rows:
+                    st.success(t("success_found", count=len(rows)))
+                else:
+                    st.warning(t("warning_no_results"))
+
+        if st.session_state.get("scrape_failures"):
+            failures_df = pd.DataFrame(st.session_state.scrape_failures)
+            with st.expander(t("failures_header", count=len(failures_df)), expanded=False):
+                st.dataframe(failures_df, use_container_width=True)
+                st.download_button(
+                    label=t("failures_download"),
+                    data=failures_df.to_csv(index=False).encode("utf-8"),
+                    file_name=f"ted_failures_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime="text/csv"
+                )
+
         # Display results with MULTISELECT filtering
-        if st.session_state.scraped_data:
+        results_table = load_results(st.session_state.results_key)
+        if results_table is not None:
             st.markdown("---")
             st.subheader(t("results_header"))
             
-            df = pd.DataFrame(st.session_state.scraped_data)
-            st.info(t("total_results", count=len(df)))
+            result_columns = results_table.column_names
+            st.info(t("total_results", count=results_table.num_rows))
+            
+            if AZURE_ENDPOINT and AZURE_API_KEY:
+                if st.button(t("enrich_button"), help=t("enrich_help")):
+                    with st.spinner(t("enrich_running", count=results_table.num_rows)):
+                        progress = st.progress(0.0)
+                        rows = results_table.to_pylist()
+                        enriched, failed = enrich_notices(
+                            rows, AZURE_ENDPOINT, AZURE_API_KEY,
+                            DEPLOYMENT_NAME, AZURE_API_VERSION,
+                            lambda done, total: progress.progress(done / total)
+                        )
+                        progress.empty()
+                    st.success(t("enrich_done", count=enriched, failed=failed))
+                    store_results(st.session_state.results_key, rows)
+                    results_table = load_results(st.session_state.results_key)
+                    result_columns = results_table.column_names
             
             with st.expander(t("filter_results"), expanded=True):
                 filter_row1_col1, filter_row1_col2, filter_row1_col3 = st.columns(3)
                 
                 with filter_row1_col1:
-                    if "Beschaffer" in df.columns:
-                        beschaffer_options = sorted(df["Beschaffer"].dropna().unique().tolist())
+                    if "Beschaffer" in result_columns:
+                        beschaffer_options = column_options(results_table, "Beschaffer")
                         selected_beschaffer = st.multiselect(
                             t("filter_beschaffer"),
                             options=beschaffer_options,
@@ -971,8 +4177,8 @@ def main():
                         selected_beschaffer = []
                 
                 with filter_row1_col2:
-                    if "Ort/Region" in df.columns:
-                        region_options = sorted(df["Ort/Region"].dropna().unique().tolist())
+                    if "Ort/Region" in result_columns:
+                        region_options = column_options(results_table, "Ort/Region")
                         selected_regions = st.multiselect(
                             t("filter_region"),
                             options=region_options,
@@ -983,13 +4189,34 @@ def main():
                         selected_regions = []
                 
                 with filter_row1_col3:
-                    if "Projektvolumen" in df.columns:
+                    if "Projektvolumen" in result_columns:
                         volume_filter = st.text_input(t("filter_volume"), placeholder=t("filter_volume_placeholder"))
                     else:
                         volume_filter = ""
                 
                 filter_row2_col1, filter_row2_col2, filter_row2_col3 = st.columns(3)
                 
+                min_relevance = 0
+                selected_service_lines = []
+                if "KI Relevanz" in result_columns:
+                    filter_row3_col1, filter_row3_col2 = st.columns(2)
+                    with filter_row3_col1:
+                        min_relevance = st.slider(t("filter_relevance"), 0, 10, 0)
+                    with filter_row3_col2:
+                        selected_service_lines = st.multiselect(t("filter_service_lines"), options=SERVICE_LINES, default=[])
+
+                changed_only = False
+                if STATUS_COLUMN in result_columns:
+                    changed_only = st.checkbox(t("filter_changed_only"))
+
+                selected_query_tags = []
+                if QUERY_TAG_COLUMN in result_columns:
+                    selected_query_tags = st.multiselect(
+                        t("filter_queries"),
+                        options=query_tag_options(results_table),
+                        default=[]
+                    )
+
                 with filter_row2_col1:
                     filter_projektstart = st.date_input(
                         t("filter_projektstart"),
@@ -1012,105 +4239,139 @@ def main():
                     )
             
             # Apply filters
-            filtered_df = df.copy()
-            
-            if selected_beschaffer:
-                filtered_df = filtered_df[filtered_df["Beschaffer"].isin(selected_beschaffer)]
-            
-            if selected_regions:
-                filtered_df = filtered_df[filtered_df["Ort/Region"].isin(selected_regions)]
-            
+            min_volume = None
             if volume_filter:
                 try:
                     min_volume = float(volume_filter)
-                    filtered_df["volume_numeric"] = filtered_df["Projektvolumen"].str.extract(r'([\d,.]+)')[0].str.replace(',', '').astype(float, errors='ignore')
-                    filtered_df = filtered_df[filtered_df["volume_numeric"] >= min_volume]
-                    filtered_df = filtered_df.drop(columns=["volume_numeric"])
-                except:
+                except ValueError:
                     st.warning(t("warning_volume"))
+            result_filters = {
+                "buyers": selected_beschaffer,
+                "regions": selected_regions,
+                "min_volume": min_volume,
+                "start_from": filter_projektstart,
+                "end_to": filter_projektende,
+                "deadline_from": filter_frist,
+                "min_relevance": min_relevance,
+                "service_lines": selected_service_lines,
+                "changed_only": changed_only,
+                "query_tags": selected_query_tags,
+            }
+            filtered_table = filter_results(results_table, result_filters)
+
+            st.info(t("filtered_results", count=filtered_table.num_rows))
             
-            if filter_projektstart:
-                filtered_df["projektstart_date"] = pd.to_datetime(filtered_df["Projektstart"], errors='coerce')
-                filtered_df = filtered_df[
-                    (filtered_df["projektstart_date"].isna()) | 
-                    (filtered_df["projektstart_date"] >= pd.Timestamp(filter_projektstart))
-                ]
-                filtered_df = filtered_df.drop(columns=["projektstart_date"])
-            
-            if filter_projektende:
-                filtered_df["projektende_date"] = pd.to_datetime(filtered_df["Projektende"], errors='coerce')
-                filtered_df = filtered_df[
-                    (filtered_df["projektende_date"].isna()) | 
-                    (filtered_df["projektende_date"] <= pd.Timestamp(filter_projektende))
-                ]
-                filtered_df = filtered_df.drop(columns=["projektende_date"])
-            
-            if filter_frist:
-                filtered_df["frist_date"] = pd.to_datetime(filtered_df["Frist Abgabedatum"], errors='coerce')
-                filtered_df = filtered_df[
-                    (filtered_df["frist_date"].isna()) | 
-                    (filtered_df["frist_date"] >= pd.Timestamp(filter_frist))
-                ]
-                filtered_df = filtered_df.drop(columns=["frist_date"])
-            
-            st.info(t("filtered_results", count=len(filtered_df)))
-            
-            st.dataframe(
-                filtered_df,
+            grid_col1, grid_col2, grid_col3, grid_col4 = st.columns([3, 1, 1, 1])
+            with grid_col1:
+                sort_column = st.selectbox(t("grid_sort"), options=[None] + result_columns,
+                                           format_func=lambda c: t("grid_sort_none") if c is None else c)
+            with grid_col2:
+                sort_ascending = st.toggle(t("grid_ascending"), value=True)
+            with grid_col3:
+                page_size = st.selectbox(t("grid_page_size"), options=RESULTS_PAGE_SIZES)
+            page_count = max(1, math.ceil(filtered_table.num_rows / page_size))
+            if st.session_state.get("results_page", 1) > page_count:
+                st.session_state.results_page = page_count
+            with grid_col4:
+                page = st.number_input(t("grid_page"), min_value=1, max_value=page_count, step=1, key="results_page")
+            page_df = results_page(filtered_table, sort_column, sort_ascending, page, page_size)
+            note_result_view(st.session_state.results_key, page_df.memory_usage(deep=True).sum())
+
+            grid = st.dataframe(
+                truncate_text_columns(page_df),
                 use_container_width=True,
                 height=400,
-                column_config={
-                    "Ted-Link": st.column_config.LinkColumn("TED Link"),
-                    "Vergabeplattform": st.column_config.LinkColumn("Platform")
-                }
+                hide_index=True,
+                on_select="rerun",
+                selection_mode="single-row",
+                column_config={col: st.column_config.LinkColumn(label) for col, label in RESULTS_LINK_COLUMNS.items()}
             )
+            st.caption(t("grid_page_info", page=page, pages=page_count))
+            footprint = result_store_footprint(st.session_state.results_key)
+            server_footprint = result_store_footprint()
+            st.caption(t(
+                "results_footprint",
+                memory=footprint["memory_bytes"] / 1e6, disk=footprint["disk_bytes"] / 1e6,
+                sessions=server_footprint["sessions"], total=server_footprint["memory_bytes"] / 1e6
+            ))
+            if grid.selection.rows:
+                selected_row = page_df.iloc[grid.selection.rows[0]]
+                with st.expander(t("grid_details", pubno=selected_row.get("publication-number", "")), expanded=True):
+                    for col, value in selected_row.items():
+                        if isinstance(value, str) and value.strip():
+                            st.markdown(f"**{col}**")
+                            st.text(value)
             
             col_dl1, col_dl2 = st.columns(2)
+            results_version = (st.session_state.results_key, results_generation(st.session_state.results_key))
             
             with col_dl1:
-                if len(filtered_df) > 0:
-                    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as temp_excel:
-                        try:
-                            filtered_rows = filtered_df.to_dict('records')
-                            save_to_excel(filtered_rows, temp_excel.name)
-                            
-                            with open(temp_excel.name, "rb") as f:
-                                st.download_button(
-                                    label=t("download_filtered", count=len(filtered_df)),
-                                    data=f.read(),
-                                    file_name=f"ted_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                    type="primary"
-                                )
-                        finally:
-                            temp_excel.close()
-                            if os.path.exists(temp_excel.name):
-                                os.remove(temp_excel.name)
+                if filtered_table.num_rows > 0:
+                    st.download_button(
+                        label=t("download_filtered", count=filtered_table.num_rows),
+                        data=memoised_export("filtered", (results_version, repr(sorted(result_filters.items()))),
+                                             lambda: results_excel_bytes(filtered_table)),
+                        file_name=f"ted_filtered_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        type="primary"
+                    )
             
             with col_dl2:
-                with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as temp_excel:
-                    try:
-                        save_to_excel(st.session_state.scraped_data, temp_excel.name)
-                        
-                        with open(temp_excel.name, "rb") as f:
-                            st.download_button(
-                                label=t("download_all", count=len(df)),
-                                data=f.read(),
-                                file_name=f"ted_all_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                st.download_button(
+                    label=t("download_all", count=results_table.num_rows),
+                    data=memoised_export("all", results_version, lambda: results_excel_bytes(results_table)),
+                    file_name=f"ted_all_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+            
+            if "Vergabeplattform" in result_columns:
+                with st.expander(t("docs_header"), expanded=False):
+                    link_columns = [c for c in ("publication-number", "Projektbezeichnung", "Vergabeplattform") if c in result_columns]
+                    platforms = {
+                        row["publication-number"]: row
+                        for row in filtered_table.select(link_columns).to_pylist() if row.get("Vergabeplattform")
+                    }
+                    notice_labels = {
+                        pubno: f"{pubno} – {row.get('Projektbezeichnung') or ''}" for pubno, row in platforms.items()
+                    }
+                    selected_notices = st.multiselect(
+                        t("docs_select"),
+                        options=list(notice_labels),
+                        format_func=notice_labels.get,
+                        help=t("docs_select_help")
+                    )
+                    if selected_notices and st.button(t("docs_button")):
+                        if "document_store" not in st.session_state:
+                            st.session_state.document_store = {}
+                        with st.spinner(t("docs_running", count=len(selected_notices))):
+                            progress = st.progress(0.0)
+                            documents, errors = fetch_tender_documents(
+                                [(pubno, platforms[pubno]["Vergabeplattform"]) for pubno in selected_notices],
+                                lambda done, total: progress.progress(done / total)
                             )
-                    finally:
-                        temp_excel.close()
-                        if os.path.exists(temp_excel.name):
-                            os.remove(temp_excel.name)
+                            added = 0
+                            for pubno, filename, data in documents:
+                                try:
+                                    text = process_uploaded_file(named_bytes(data, filename))
+                                except ExtractionError as e:
+                                    errors.append((pubno, filename, str(e)))
+                                    continue
+                                if text:
+                                    st.session_state.document_store[f"{pubno} / {filename}"] = text
+                                    added += 1
+                            progress.empty()
+                        st.success(t("docs_done", count=added))
+                        if errors:
+                            st.warning(t("docs_errors", count=len(errors)))
+                            st.dataframe(pd.DataFrame(errors, columns=["publication-number", "URL", "Error"]), use_container_width=True)
     
     # ============= TAB 2: CHATBOT =============
     with tab2:
         with st.sidebar:
-            azure_endpoint = get_secret("AZURE_ENDPOINT", "")
-            azure_key = get_secret("AZURE_API_KEY", "")
-            deployment_name = get_secret("DEPLOYMENT_NAME", "gpt-4o-mini")
-            api_version = "2024-08-01-preview"
+            azure_endpoint = AZURE_ENDPOINT
+            azure_key = AZURE_API_KEY
+            deployment_name = DEPLOYMENT_NAME
+            api_version = AZURE_API_VERSION
             
             st.markdown(t("config_header"))
             if azure_endpoint and azure_key:
@@ -1141,14 +4402,33 @@ def main():
             )
             
             if library_files:
+                upload_digests = st.session_state.setdefault("upload_digests", {})
                 for uploaded_file in library_files:
-                    if uploaded_file.name not in st.session_state.document_store:
+                    # Re-read a file uploaded again under the same name with other content
+                    upload_digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+                    if upload_digests.get(uploaded_file.name) != upload_digest:
+                        upload_digests[uploaded_file.name] = upload_digest
                         with st.spinner(t("processing", filename=uploaded_file.name)):
-                            text = process_uploaded_file(uploaded_file)
+                            progress = st.progress(0.0)
+                            try:
+                                text = process_uploaded_file(
+                                    uploaded_file,
+                                    lambda done, total: progress.progress(done / total)
+                                )
+                            except ExtractionError as e:
+                                # upload_digests keeps the failed file from being retried on every rerun
+                                st.error(str(e))
+                                st.session_state.document_store.pop(uploaded_file.name, None)
+                                text = ""
+                            progress.empty()
                             if text:
                                 st.session_state.document_store[uploaded_file.name] = text
                                 st.success(t("file_added", filename=uploaded_file.name))
             
+            if "retrieval_index" not in st.session_state:
+                st.session_state.retrieval_index = new_retrieval_index()
+            sync_retrieval_index(st.session_state.retrieval_index, st.session_state.document_store)
+            
             if st.session_state.document_store:
                 st.markdown(f"**📁 {len(st.session_state.document_store)} document(s)**")
                 for doc_name in list(st.session_state.document_store.keys()):
@@ -1157,12 +4437,16 @@ def main():
                         st.caption(f"• {doc_name}")
                     with col2:
                         if st.button("🗑️", key=f"del_{doc_name}"):
-                            del st.session_state.document_store[doc_name]
+                            removed_text = st.session_state.document_store.pop(doc_name)
+                            st.session_state.get("upload_digests", {}).pop(doc_name, None)
+                            st.session_state.get("document_digests", {}).pop(_text_digest(removed_text), None)
                             st.rerun()
+                st.toggle(t("map_reduce_toggle"), key="map_reduce_mode", help=t("map_reduce_help"))
             
             st.markdown("---")
             if st.button(t("clear_chat"), use_container_width=True):
                 st.session_state.chat_messages = []
+                st.session_state.chat_summary = {"text": "", "upto": 0}
                 st.rerun()
         
         if not azure_endpoint or not azure_key:
@@ -1198,6 +4482,8 @@ def main():
                 avatar = JKM_LOGO_URL if message["role"] == "assistant" else BOT_AVATAR_URL
                 with st.chat_message(message["role"], avatar=avatar):
                     st.markdown(message["content"])
+                    if message.get("metrics"):
+                        st.caption(format_reply_metrics(message["metrics"]))
             
             st.markdown("---")
             quick_file = st.file_uploader(
@@ -1208,24 +4494,28 @@ def main():
             )
             
             if quick_file:
-                if quick_file.name not in st.session_state.document_store:
+                upload_digests = st.session_state.setdefault("upload_digests", {})
+                upload_digest = hashlib.sha256(quick_file.getvalue()).hexdigest()
+                if upload_digests.get(quick_file.name) != upload_digest:
+                    upload_digests[quick_file.name] = upload_digest
                     with st.spinner(t("processing", filename=quick_file.name)):
-                        text = process_uploaded_file(quick_file)
+                        progress = st.progress(0.0)
+                        try:
+                            text = process_uploaded_file(
+                                quick_file,
+                                lambda done, total: progress.progress(done / total)
+                            )
+                        except ExtractionError as e:
+                            st.error(str(e))
+                            st.session_state.document_store.pop(quick_file.name, None)
+                            text = ""
+                        progress.empty()
                         if text:
                             st.session_state.document_store[quick_file.name] = text
                             st.success(t("file_added", filename=quick_file.name))
                             st.rerun()
             
             if prompt := st.chat_input(t("chat_input")):
-                context_parts = []
-                
-                if st.session_state.document_store:
-                    library_context = "\n\n".join([
-                        f"=== DOCUMENT: {name} ===\n{content[:5000]}" 
-                        for name, content in st.session_state.document_store.items()
-                    ])
-                    context_parts.append(library_context)
-                
                 st.session_state.chat_messages.append({"role": "user", "content": prompt})
                 with st.chat_message("user", avatar=BOT_AVATAR_URL):
                     st.markdown(prompt)
@@ -1234,9 +4524,79 @@ def main():
                     thinking_placeholder = st.empty()
                     thinking_placeholder.markdown(f'<div class="thinking-indicator"><span class="thinking-dots">{t("thinking")}</span></div>', unsafe_allow_html=True)
                     
-                    if context_parts:
-                        full_context = "\n\n".join(context_parts)
-                        system_content = f"""You are JKM AI Assistant - a helpful AI assistant for tenders, procurement documents, and general tasks.
+                    try:
+                        cache_key = answer_cache_key(
+                            prompt,
+                            st.session_state.chat_messages[:-1],
+                            document_set_digest(st.session_state.document_store)
+                            + (":map-reduce" if st.session_state.get("map_reduce_mode") else ""),
+                            deployment_name
+                        )
+                        cached_answer = answer_cache_get(cache_key)
+                        if cached_answer is not None:
+                            thinking_placeholder.empty()
+                            st.markdown(cached_answer)
+                            st.caption(format_reply_metrics({"cached": True}))
+                            st.session_state.chat_messages.append(
+                                {"role": "assistant", "content": cached_answer, "metrics": {"cached": True}}
+                            )
+                        else:
+                            if "chat_summary" not in st.session_state:
+                                st.session_state.chat_summary = {"text": "", "upto": 0}
+                            recent_messages, st.session_state.chat_summary = compact_chat_history(
+                                st.session_state.chat_messages,
+                                st.session_state.chat_summary,
+                                lambda previous, turns: summarize_chat_turns(
+                                    previous, turns, azure_endpoint, azure_key, deployment_name, api_version
+                                )
+                            )
+                            
+                            context_parts = []
+                            
+                            if st.session_state.document_store:
+                                index = st.session_state.retrieval_index
+                                sync_retrieval_index(index, st.session_state.document_store)
+                                budget = document_token_budget(recent_messages, st.session_state.chat_summary)
+                                
+                                if st.session_state.get("map_reduce_mode"):
+                                    if "document_digests" not in st.session_state:
+                                        st.session_state.document_digests = {}
+                                    # Keyed by content, so a replaced document gets a new digest
+                                    digests = st.session_state.document_digests
+                                    document_digests = []
+                                    for name, content in st.session_state.document_store.items():
+                                        # Only documents the excerpts cannot cover need a digest
+                                        if len(content) // 4 <= RETRIEVAL_TOKEN_BUDGET:
+                                            continue
+                                        content_digest = _text_digest(content)
+                                        if content_digest not in digests:
+                                            with st.spinner(t("map_reduce_running", filename=name)):
+                                                progress = st.progress(0.0)
+                                                digests[content_digest] = map_reduce_document(
+                                                    content, azure_endpoint, azure_key, deployment_name, api_version,
+                                                    lambda done, total: progress.progress(done / total)
+                                                )
+                                                progress.empty()
+                                        document_digests.append((name, digests[content_digest]))
+                                    document_digests, digest_tokens = fit_digests(
+                                        document_digests, int(budget * CHAT_DIGEST_SHARE)
+                                    )
+                                    for name, digest in document_digests:
+                                        context_parts.append(f"=== DOCUMENT SUMMARY: {name} ===\n{digest}")
+                                    budget = max(0, budget - digest_tokens)
+                                
+                                library_context = "\n\n".join([
+                                    f"=== DOCUMENT: {chunk['doc']} (excerpt {chunk['position'] + 1}/{len(index['docs'][chunk['doc']])}) ===\n{chunk['text']}"
+                                    for chunk in retrieve_chunks(index, prompt, token_budget=budget)
+                                ])
+                                context_parts.append(
+                                    "Available documents: " + ", ".join(st.session_state.document_store) + "\n\n"
+                                    + "Relevant excerpts:\n\n" + library_context
+                                )
+                            
+                            if context_parts:
+                                full_context = "\n\n".join(context_parts)
+                                system_content = f"""You are JKM AI Assistant - a helpful AI assistant for tenders, procurement documents, and general tasks.
 
 You have access to the following documents:
 
@@ -1249,48 +4609,57 @@ INSTRUCTIONS:
 - Be precise, professional, and helpful
 - When analyzing PDFs: Look for specific sections, fields, tables, and requirements
 - Summarize key information clearly"""
-                    else:
-                        system_content = """You are JKM AI Assistant - a helpful AI assistant for general questions and tasks.
+                            else:
+                                system_content = """You are JKM AI Assistant - a helpful AI assistant for general questions and tasks.
 
 INSTRUCTIONS:
 - Answer general questions helpfully and precisely
 - Always respond in German when asked in German, otherwise in English
 - Be professional and friendly
 - For procurement/tender questions: If documents are uploaded, analyze them in detail"""
-                    
-                    system_message = {"role": "system", "content": system_content}
-                    
-                    api_messages = [system_message] + [
-                        {"role": m["role"], "content": m["content"]}
-                        for m in st.session_state.chat_messages
-                    ]
-                    
-                    try:
-                        stream = get_azure_chatbot_response(
-                            api_messages, 
-                            azure_endpoint, 
-                            azure_key, 
-                            deployment_name,
-                            api_version
-                        )
-                        
-                        response_text = ""
-                        for chunk in stream:
-                            if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
-                                if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
-                                    if chunk.choices[0].delta.content:
-                                        response_text += chunk.choices[0].delta.content
-                        
-                        thinking_placeholder.empty()
-                        st.markdown(response_text)
-                        
-                        st.session_state.chat_messages.append({"role": "assistant", "content": response_text})
+                            
+                            api_messages = build_api_messages(
+                                system_content, recent_messages, st.session_state.chat_summary
+                            )
+                            
+                            metrics = {"started": time.perf_counter()}
+                            stream = get_azure_chatbot_response(
+                                api_messages, 
+                                azure_endpoint, 
+                                azure_key, 
+                                deployment_name,
+                                api_version
+                            )
+                            
+                            text_stream = stream_response_text(stream, metrics, on_first_token=thinking_placeholder.empty)
+                            completed = False
+                            try:
+                                st.write_stream(text_stream)
+                                completed = True
+                            finally:
+                                # Also runs when the reply is cancelled by a rerun; keep what arrived so far
+                                text_stream.close()
+                                thinking_placeholder.empty()
+                                response_text = metrics["text"]
+                                if completed or response_text:
+                                    reply_metrics = {k: metrics[k] for k in ("ttft", "tokens", "tokens_per_sec")}
+                                    st.session_state.chat_messages.append(
+                                        {"role": "assistant", "content": response_text, "metrics": reply_metrics}
+                                    )
+                            if response_text:
+                                answer_cache_put(cache_key, response_text)
+                            st.caption(format_reply_metrics(metrics))
                         
                     except Exception as e:
                         thinking_placeholder.empty()
                         st.error(f"❌ Error: {str(e)}")
                         st.info(t("error_check_config"))
 
-if __name__ == "__main__":
-    main()
+if __name__ == "__main__" and sys.argv[1:2] == ["reprocess"]:
+    reprocess_command(sys.argv[2:])
+elif __name__ == "__main__":
+    if profiling_allowed() and st.session_state.pop("profile_rerun_pending", False):
+        profile_call("rerun", {"query_params": profiling_query_params()}, main)
+    else:
+        main()
 
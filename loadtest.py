@@ -0,0 +1,653 @@
+"""Load test for app.py: concurrent browser sessions against local stand-ins.
+
+Starts `streamlit run app.py` servers and a local HTTPS server that stands
+in for Microsoft sign-in, the TED search API, the TED notice XML endpoints and
+an OpenAI-compatible (Azure) chat API; the app is pointed at it through
+secrets. Every simulated user opens its own websocket session like a browser
+tab and goes through sign-in, search, filter, paging/sorting and chat. The
+Excel exports are built on every rerun that shows results, so they are part
+of the filter and page steps.
+
+Usage:
+    python loadtest.py --users 1,5,10,20 --rounds 2 --notices 20 --slo 3
+    python loadtest.py --users 4,8 --replicas 2 --shared-state
+
+For every user count it reports latency percentiles per step, flows per second,
+requests that reached the TED stand-in, and CPU and RSS of the server
+processes (including their worker processes). The scaling limit is the
+highest user count whose p95 latency of --slo-steps stays within --slo
+seconds without errors. --json writes the report to a file so releases can be
+compared. CPU and RSS are read from /proc (Linux).
+
+Every stage starts fresh app servers with an empty cache directory (and so an
+empty XML archive and query history) and, with --shared-state, an empty Redis
+stand-in, so no stage is served from notices fetched by an earlier one.
+
+--replicas starts several app servers with separate cache directories, as on
+separate machines, and spreads the users over them. --shared-state points
+them at a local Redis stand-in (SHARED_STATE_URL; needs the redis package).
+"""
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState, WidgetStates
+from streamlit.testing.v1.element_tree import parse_tree_from_messages
+from tornado.websocket import websocket_connect
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+STEPS = ["login", "search", "filter", "page", "chat"]
+LABELS = {
+    "keywords": "🔤 Keywords (single or multi-word)",
+    "search": "🔍 Search Notices",
+    "filter": "✅ Filter by Beschaffer",
+    "sort": "Sort by",
+}
+
+NOTICE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ContractNotice xmlns="urn:oasis:names:specification:ubl:schema:xsd:ContractNotice-2"
+ xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+ xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+ xmlns:efac="http://data.europa.eu/p27/eforms-ubl-extension-aggregate-components/1"
+ xmlns:efbc="http://data.europa.eu/p27/eforms-ubl-extension-basic-components/1">
+<cbc:CustomizationID>eforms-sdk-1.10</cbc:CustomizationID>
+<efbc:NoticePublicationID schemeName="ojs-notice-id">{pubno}</efbc:NoticePublicationID>
+<efbc:PublicationDate>2025-01-15+01:00</efbc:PublicationDate>
+<cac:ContractingParty><cac:Party><cac:PartyName><cbc:Name>{buyer}</cbc:Name></cac:PartyName>
+<cac:PostalAddress><cbc:CityName>{city}</cbc:CityName></cac:PostalAddress></cac:Party>
+<cbc:WebsiteURI>https://vergabe.example.org/{pubno}</cbc:WebsiteURI></cac:ContractingParty>
+<cac:TenderingProcess><cac:TenderSubmissionDeadlinePeriod><cbc:EndDate>2025-03-01+01:00</cbc:EndDate>
+</cac:TenderSubmissionDeadlinePeriod></cac:TenderingProcess>
+<cac:ProcurementProject><cbc:Name>Projektsteuerung Neubau {pubno}</cbc:Name>
+<cbc:Description>{description}</cbc:Description>
+<cac:MainCommodityClassification><cbc:ItemClassificationCode listName="cpv">71541000</cbc:ItemClassificationCode></cac:MainCommodityClassification>
+<cac:RequestedTenderTotal><cbc:EstimatedOverallContractAmount currencyID="EUR">{value}</cbc:EstimatedOverallContractAmount></cac:RequestedTenderTotal>
+<cac:PlannedPeriod><cbc:StartDate>2025-06-01+01:00</cbc:StartDate><cbc:EndDate>2027-06-01+01:00</cbc:EndDate></cac:PlannedPeriod>
+</cac:ProcurementProject>
+</ContractNotice>
+"""
+
+
+# ---------------- STAND-IN SERVER ----------------
+# MSAL only accepts https authorities, so the stand-in serves everything over
+# TLS with a throwaway certificate that the app process is told to trust.
+def make_certificate(folder):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(folder, "stub-cert.pem"), os.path.join(folder, "stub-key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+def _stub_handler(notices, ted_delay, llm_delay, llm_chunks, counts):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _base(self):
+            return f"https://{self.headers['Host']}"
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")
+            if self.path.endswith("/.well-known/openid-configuration"):
+                tenant = f"{self._base()}/{parts[0]}"
+                config = {
+                    "issuer": f"{tenant}/v2.0",
+                    "authorization_endpoint": f"{tenant}/oauth2/v2.0/authorize",
+                    "token_endpoint": f"{tenant}/oauth2/v2.0/token",
+                }
+                return self._send(200, json.dumps(config).encode())
+            if len(parts) == 4 and parts[1] == "notice" and parts[3] == "xml":
+                counts["ted_xml"] += 1
+                time.sleep(ted_delay)
+                idx = int(parts[2].split("-")[0]) % 7
+                xml = NOTICE_XML.format(
+                    pubno=parts[2], buyer=f"Stadt {idx}", city=f"Region {idx % 3}",
+                    value=100000 * (idx + 1), description="Leistungen nach HOAI " * 40,
+                )
+                return self._send(200, xml.encode(), "application/xml")
+            self._send(404, b"{}")
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            path = self.path.split("?")[0]
+            if path.endswith("/oauth2/v2.0/token"):
+                token = {"access_token": "loadtest", "token_type": "Bearer", "expires_in": 3600, "scope": "User.Read"}
+                return self._send(200, json.dumps(token).encode())
+            body = json.loads(raw or b"{}")
+            if path.endswith("/v3/notices/search"):
+                counts["ted_search"] += 1
+                time.sleep(ted_delay)
+                limit = int(body.get("limit", 100))
+                first = (int(body.get("page", 1)) - 1) * limit
+                page = [
+                    {
+                        "publication-number": f"{100000 + i}-2025",
+                        "links": {"xml": {"MUL": f"{self._base()}/en/notice/{100000 + i}-2025/xml"}},
+                        "procedure-identifier": f"proc-{i}",
+                        "notice-version": "01",
+                        "publication-date": "2025-01-15+01:00",
+                    }
+                    for i in range(first, min(first + limit, notices))
+                ]
+                return self._send(200, json.dumps({"notices": page, "totalNoticeCount": notices}).encode())
+            if path.endswith("/chat/completions"):
+                return self._chat(body)
+            self._send(404, b"{}")
+
+        def _chat(self, body):
+            words = ["Die", "Ausschreibung", "betrifft", "Projektsteuerung", "für", "einen", "Neubau."]
+            if not body.get("stream"):
+                time.sleep(llm_delay * llm_chunks)
+                text = " ".join(words[i % len(words)] for i in range(llm_chunks))
+                reply = {
+                    "id": "loadtest", "object": "chat.completion", "created": int(time.time()), "model": "loadtest",
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": llm_chunks, "total_tokens": 10 + llm_chunks},
+                }
+                return self._send(200, json.dumps(reply).encode())
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i in range(llm_chunks):
+                time.sleep(llm_delay)
+                chunk = {
+                    "id": "loadtest", "object": "chat.completion.chunk", "created": int(time.time()), "model": "loadtest",
+                    "choices": [{"index": 0, "delta": {"content": words[i % len(words)] + " "}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def start_stubs(args, cert_path, key_path, counts):
+    handler = _stub_handler(args.notices, args.ted_delay, args.llm_delay, args.llm_chunks, counts)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"https://127.0.0.1:{server.server_address[1]}"
+
+
+# ---------------- REDIS STAND-IN ----------------
+# Speaks just enough of the Redis protocol (RESP) for the app's shared state:
+# GET, SET with EX/PX/NX, DEL, INCR(BY) and (P)EXPIRE, plus connection setup.
+def _redis_handler(store, lock):
+    class Handler(socketserver.StreamRequestHandler):
+        def _read_command(self):
+            line = self.rfile.readline()
+            if not line:
+                return None
+            if not line.startswith(b"*"):
+                return line.split()
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            return args
+
+        def handle(self):
+            while (args := self._read_command()) is not None:
+                if args:
+                    self.wfile.write(self._execute(args[0].decode().upper(), args[1:]))
+                    self.wfile.flush()
+
+        def _execute(self, name, args):
+            now = time.monotonic()
+            with lock:
+                for key in [key for key, (_, expires) in store.items() if expires is not None and expires <= now]:
+                    del store[key]
+                if name == "PING":
+                    return b"+PONG\r\n"
+                if name in ("CLIENT", "SELECT"):
+                    return b"+OK\r\n"
+                if name == "GET":
+                    value = store.get(args[0], (None, None))[0]
+                    return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+                if name == "SET":
+                    options = [arg.upper() for arg in args[2:]]
+                    expires = None
+                    for flag, seconds in ((b"EX", 1), (b"PX", 0.001)):
+                        if flag in options:
+                            expires = now + int(args[2 + options.index(flag) + 1]) * seconds
+                    if b"NX" in options and args[0] in store:
+                        return b"$-1\r\n"
+                    store[args[0]] = (args[1], expires)
+                    return b"+OK\r\n"
+                if name == "DEL":
+                    return b":%d\r\n" % sum(store.pop(key, None) is not None for key in args)
+                if name in ("INCR", "INCRBY"):
+                    value, expires = store.get(args[0], (b"0", None))
+                    count = int(value) + (int(args[1]) if name == "INCRBY" else 1)
+                    store[args[0]] = (b"%d" % count, expires)
+                    return b":%d\r\n" % count
+                if name in ("EXPIRE", "PEXPIRE"):
+                    if args[0] not in store:
+                        return b":0\r\n"
+                    seconds = int(args[1]) * (0.001 if name == "PEXPIRE" else 1)
+                    store[args[0]] = (store[args[0]][0], now + seconds)
+                    return b":1\r\n"
+            return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+    return Handler
+
+
+def start_redis_stand_in():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _redis_handler({}, threading.Lock()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"redis://127.0.0.1:{server.server_address[1]}/0"
+
+
+# ---------------- APP SERVER ----------------
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(workdir, stub_url, cert_path, shared_state_url=None):
+    """Run app.py under `streamlit run` with secrets pointing at the stand-ins."""
+    secrets = {
+        "CLIENT_ID": "loadtest",
+        "CLIENT_SECRET": "loadtest",
+        "TENANT_ID": "loadtest",
+        "AUTHORITY_HOST": stub_url,
+        "TED_API_URL": f"{stub_url}/v3/notices/search",
+        "TED_BASE_URL": stub_url,
+        "AZURE_ENDPOINT": stub_url,
+        "AZURE_API_KEY": "loadtest",
+        "DEPLOYMENT_NAME": "loadtest",
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+    }
+    if shared_state_url:
+        secrets["SHARED_STATE_URL"] = shared_state_url
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        f.writelines(f"{key} = {json.dumps(value)}\n" for key, value in secrets.items())
+    port = _free_port()
+    env = dict(os.environ, REQUESTS_CA_BUNDLE=cert_path, SSL_CERT_FILE=cert_path)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless=true", f"--server.port={port}",
+         "--server.address=127.0.0.1", "--server.enableXsrfProtection=false", "--server.fileWatcherType=none",
+         "--browser.gatherUsageStats=false"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).ok:
+                return process, port
+        except requests.RequestException:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.5)
+    process.kill()
+    raise RuntimeError("streamlit server did not start")
+
+
+def start_apps(stage_dir, replicas, stub_url, cert_path, shared_state):
+    """Start replicas app servers (and a Redis stand-in if shared_state) with empty caches under stage_dir."""
+    redis_stand_in, shared_state_url = start_redis_stand_in() if shared_state else (None, None)
+    apps = []
+    try:
+        for replica in range(replicas):
+            apps.append(start_app(os.path.join(stage_dir, f"replica-{replica}"), stub_url, cert_path, shared_state_url))
+    except Exception:
+        stop_apps([app[0] for app in apps], redis_stand_in)
+        raise
+    return [app[0] for app in apps], [app[1] for app in apps], redis_stand_in
+
+
+def stop_apps(app_processes, redis_stand_in):
+    for app_process in app_processes:
+        app_process.terminate()
+    for app_process in app_processes:
+        try:
+            app_process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            app_process.kill()
+    if redis_stand_in is not None:
+        redis_stand_in.shutdown()
+
+
+def process_tree_usage(pid):
+    """(CPU seconds, RSS bytes) of pid and all its descendants, from /proc."""
+    ticks, page_size = os.sysconf("SC_CLK_TCK"), os.sysconf("SC_PAGE_SIZE")
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{entry}/statm") as f:
+                rss_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        stats[int(entry)] = (int(fields[1]), (int(fields[11]) + int(fields[12])) / ticks, rss_pages * page_size)
+    tree, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [p for p, (ppid, _, _) in stats.items() if ppid == parent and p not in tree]
+        tree.update(children)
+        frontier.extend(children)
+    members = [stats[p] for p in tree if p in stats]
+    return sum(m[1] for m in members), sum(m[2] for m in members)
+
+
+# ---------------- BROWSER SESSIONS ----------------
+def _find(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"widget {label!r} not found")
+
+
+def _choice_state(widget, choice):
+    """Widget state selecting one option (selectbox) or a list of options (multiselect)."""
+    state = WidgetState(id=widget.id)
+    if isinstance(choice, list):
+        state.string_array_value.data[:] = choice
+    else:
+        state.string_value = choice
+    return state
+
+
+class BrowserSession:
+    """One websocket session, driven like a browser tab."""
+
+    def __init__(self, port, timeout):
+        self.url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        self.timeout = timeout
+        self.query_string = ""
+        self.ws = None
+
+    async def open(self, query_string):
+        self.ws = await websocket_connect(self.url, subprotocols=["streamlit"], max_message_size=512 * 1024 * 1024)
+        self.query_string = query_string
+        return await self.rerun()
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    async def rerun(self, *states):
+        """Rerun with the given widget states; return the new element tree.
+
+        Only changed widgets need to be sent: the server keeps the previous
+        values of all others.
+        """
+        msg = BackMsg()
+        msg.rerun_script.query_string = self.query_string
+        msg.rerun_script.widget_states.CopyFrom(WidgetStates(widgets=states))
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        return await asyncio.wait_for(self._collect_run(), self.timeout)
+
+    async def _collect_run(self):
+        messages = []
+        while True:
+            raw = await self.ws.read_message()
+            if raw is None:
+                raise ConnectionError("websocket closed by the server")
+            fwd = ForwardMsg()
+            fwd.ParseFromString(raw)
+            kind = fwd.WhichOneof("type")
+            if kind == "new_session":
+                messages = []
+            elif kind == "page_info_changed":
+                self.query_string = fwd.page_info_changed.query_string
+            elif kind == "script_finished":
+                if fwd.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return parse_tree_from_messages(messages)
+            elif kind == "delta":
+                messages.append(fwd)
+
+
+async def run_user(user, rounds, port, timeout):
+    """Drive one user through the flow `rounds` times; returns [(step, seconds, error)]."""
+    results = []
+
+    async def step(name, action):
+        started = time.perf_counter()
+        tree, error = None, None
+        try:
+            tree = await action()
+            if tree.exception:
+                error = tree.exception[0].value
+            elif tree.error:
+                error = tree.error[0].value
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        results.append((name, time.perf_counter() - started, error))
+        return tree if error is None else None
+
+    for round_no in range(rounds):
+        session = BrowserSession(port, timeout)
+        try:
+            tree = await step("login", lambda: session.open(f"code=loadtest-{user}-{round_no}"))
+            if tree is None:
+                continue
+
+            async def search():
+                keywords = _find(tree.text_input, LABELS["keywords"]).set_value("Projektsteuerung")
+                button = _find(tree.button, LABELS["search"]).click()
+                return await session.rerun(keywords._widget_state, button._widget_state)
+            tree = await step("search", search)
+            if tree is None:
+                continue
+
+            async def filter_buyers():
+                buyers = _find(tree.multiselect, LABELS["filter"])
+                return await session.rerun(_choice_state(buyers, buyers.options[:1]))
+            tree = await step("filter", filter_buyers)
+            if tree is None:
+                continue
+
+            async def sort_page():
+                sort = _find(tree.selectbox, LABELS["sort"])
+                return await session.rerun(_choice_state(sort, sort.options[-1]))
+            tree = await step("page", sort_page)
+            if tree is None:
+                continue
+
+            async def chat():
+                prompt = tree.chat_input[0].set_value(f"Worum geht es? (user {user}, round {round_no})")
+                return await session.rerun(prompt._widget_state)
+            await step("chat", chat)
+        finally:
+            session.close()
+    return results
+
+
+# ---------------- MEASUREMENT ----------------
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))]
+
+
+def apps_usage(app_processes):
+    """(CPU seconds, RSS bytes) summed over all app servers."""
+    usage = [process_tree_usage(process.pid) for process in app_processes]
+    return sum(u[0] for u in usage), sum(u[1] for u in usage)
+
+
+def run_stage(users, rounds, app_processes, ports, timeout, counts):
+    """Run users concurrent sessions and summarize latency, throughput, TED requests, CPU and RSS."""
+    cpu_before, rss_before = apps_usage(app_processes)
+    counts_before = dict(counts)
+    rss_samples = [rss_before]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(0.5):
+            rss_samples.append(apps_usage(app_processes)[1])
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+
+    async def all_users():
+        return await asyncio.gather(*(run_user(user, rounds, ports[user % len(ports)], timeout) for user in range(users)))
+
+    sessions = asyncio.run(all_users())
+    wall = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+    cpu_after, rss_after = apps_usage(app_processes)
+
+    records = [record for session in sessions for record in session]
+    completed = sum(1 for name, _, error in records if name == "chat" and error is None)
+    steps = {}
+    for name in STEPS:
+        timings = [seconds for step_name, seconds, error in records if step_name == name and error is None]
+        steps[name] = {
+            "count": len(timings),
+            "errors": sum(1 for step_name, _, error in records if step_name == name and error is not None),
+            "p50": percentile(timings, 50),
+            "p95": percentile(timings, 95),
+            "p99": percentile(timings, 99),
+        }
+    return {
+        "users": users,
+        "wall_seconds": wall,
+        "flows_completed": completed,
+        "flows_per_second": completed / wall if wall else 0.0,
+        "cpu_seconds": cpu_after - cpu_before,
+        "cpu_cores_used": (cpu_after - cpu_before) / wall if wall else 0.0,
+        "rss_peak_mb": max(rss_samples + [rss_after]) / 1e6,
+        "rss_end_mb": rss_after / 1e6,
+        "ted_requests": {name: counts[name] - counts_before[name] for name in counts},
+        "steps": steps,
+        "errors": sorted({str(error) for _, _, error in records if error is not None})[:10],
+    }
+
+
+def within_slo(stage, slo, slo_steps):
+    if any(row["errors"] for row in stage["steps"].values()):
+        return False
+    return all(stage["steps"][name]["p95"] is not None and stage["steps"][name]["p95"] <= slo for name in slo_steps)
+
+
+def print_stage(stage):
+    print(f"\n== {stage['users']} user(s): {stage['flows_completed']} flows in {stage['wall_seconds']:.1f} s "
+          f"({stage['flows_per_second']:.2f}/s), CPU {stage['cpu_cores_used']:.2f} cores, "
+          f"RSS peak {stage['rss_peak_mb']:.0f} MB, TED requests: {stage['ted_requests']['ted_search']} searches, "
+          f"{stage['ted_requests']['ted_xml']} notice XML")
+    print(f"   {'step':<8}{'n':>5}{'err':>5}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}")
+    fmt = lambda v: f"{v:9.2f}" if v is not None else f"{'-':>9}"
+    for name, row in stage["steps"].items():
+        print(f"   {name:<8}{row['count']:>5}{row['errors']:>5}{fmt(row['p50'])}{fmt(row['p95'])}{fmt(row['p99'])}")
+    for error in stage["errors"]:
+        print(f"   ! {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", default="1,5,10", help="comma-separated concurrent user counts to ramp through")
+    parser.add_argument("--rounds", type=int, default=1, help="flows per user and stage")
+    parser.add_argument("--notices", type=int, default=20, help="notices returned by the TED stand-in")
+    parser.add_argument("--ted-delay", type=float, default=0.05, help="seconds the TED stand-in takes per request")
+    parser.add_argument("--llm-delay", type=float, default=0.02, help="seconds between streamed chat chunks")
+    parser.add_argument("--llm-chunks", type=int, default=40, help="chunks per chat answer")
+    parser.add_argument("--slo", type=float, default=3.0, help="p95 latency limit in seconds")
+    parser.add_argument("--slo-steps", default="filter,page,chat", help="steps the SLO applies to")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds one script run may take")
+    parser.add_argument("--keep-going", action="store_true", help="run all stages even after the SLO is broken")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--replicas", type=int, default=1, help="app servers to spread the users over")
+    parser.add_argument("--shared-state", action="store_true", help="let the replicas share state via a Redis stand-in")
+    args = parser.parse_args()
+    slo_steps = [name.strip() for name in args.slo_steps.split(",") if name.strip()]
+
+    workdir = tempfile.mkdtemp(prefix="akquise_loadtest_")
+    cert_path, key_path = make_certificate(workdir)
+    counts = {"ted_search": 0, "ted_xml": 0}
+    stubs, stub_url = start_stubs(args, cert_path, key_path, counts)
+
+    report = {"started": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "stages": []}
+    limit = 0
+    try:
+        for number, users in enumerate(int(u) for u in args.users.split(",") if u.strip()):
+            app_processes, ports, redis_stand_in = start_apps(
+                os.path.join(workdir, f"stage-{number}"), args.replicas, stub_url, cert_path, args.shared_state
+            )
+            try:
+                stage = run_stage(users, args.rounds, app_processes, ports, args.timeout, counts)
+            finally:
+                stop_apps(app_processes, redis_stand_in)
+            stage["within_slo"] = within_slo(stage, args.slo, slo_steps)
+            report["stages"].append(stage)
+            print_stage(stage)
+            if stage["within_slo"]:
+                limit = max(limit, users)
+            elif not args.keep_going:
+                break
+    finally:
+        stubs.shutdown()
+
+    report["max_users_within_slo"] = limit
+    print(f"\nScaling limit: {limit} concurrent user(s) with p95 of {', '.join(slo_steps)} <= {args.slo} s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Shared fixtures: small sample files of every format the chatbot accepts."""
+import os
+import sys
+from io import BytesIO
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Upload(BytesIO):
+    """Stand-in for Streamlit's UploadedFile: bytes plus a file name."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def _pdf_bytes(lines):
+    """A minimal one-page PDF with one text line per entry of lines."""
+    stream = "BT /F1 12 Tf 72 720 Td 14 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R"
+        " /Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+@pytest.fixture
+def pdf_file():
+    return Upload(_pdf_bytes(["Ausschreibung Kanalsanierung", "Los 2 Tiefbau"]), "notice.pdf")
+
+
+@pytest.fixture
+def docx_file():
+    import docx
+    document = docx.Document()
+    document.add_paragraph("Leistungsbeschreibung")
+    document.add_paragraph("Objektplanung Ingenieurbauwerke")
+    data = BytesIO()
+    document.save(data)
+    return Upload(data.getvalue(), "scope.docx")
+
+
+@pytest.fixture
+def txt_file():
+    return Upload("Vergabeunterlagen für Straßenbau\nFrist: 2025-03-01".encode("utf-8"), "notes.txt")
+
+
+@pytest.fixture
+def xlsx_file():
+    import openpyxl
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Lose"
+    ws.append(["Los", "Volumen"])
+    ws.append(["Tiefbau", 120000])
+    ws.append(["Hochbau", 80000])
+    data = BytesIO()
+    wb.save(data)
+    return Upload(data.getvalue(), "lots.xlsx")
+
+
+@pytest.fixture
+def csv_file():
+    return Upload(b"Los,Volumen\nTiefbau,120000\nHochbau,80000\n", "lots.csv")
+
+
+@pytest.fixture
+def png_file():
+    from PIL import Image
+    data = BytesIO()
+    Image.new("RGB", (40, 20), "white").save(data, format="PNG")
+    return Upload(data.getvalue(), "plan.png")
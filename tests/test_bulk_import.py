@@ -0,0 +1,66 @@
+"""Bulk import from daily packages: prefilter, buyer-country check and parsed rows."""
+import io
+import os
+import tarfile
+
+import pytest
+
+import app
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+def _notice(name):
+    with open(os.path.join(DATA_DIR, name), "rb") as f:
+        return f.read()
+
+
+def _package(tmp_path, members):
+    path = tmp_path / "20240101_001.tar.gz"
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+def _review_body_abroad(xml):
+    # Same notice, but the second organisation (not the buyer) is in Austria
+    head, tail = xml.split(b"ORG-0002", 1)
+    return head + b"ORG-0002" + tail.replace(b">DEU<", b">AUT<", 1)
+
+
+@pytest.mark.parametrize("name, country", [
+    ("eforms_contract_notice.xml", "DEU"),
+    ("ted_export_r209.xml", "DE"),
+])
+def test_buyer_country(name, country):
+    assert app.notice_buyer_country(*app._parse_notice(_notice(name))) == country
+
+
+def test_country_filter_accepts_both_code_forms():
+    assert app._bulk_countries("deu") == {"DEU", "DE"}
+    assert app._bulk_countries("AT, CH") == {"AT", "AUT", "CH", "CHE"}
+
+
+def test_import_keeps_matching_buyers(tmp_path):
+    package = _package(tmp_path, {
+        "654321_2024.xml": _notice("eforms_contract_notice.xml"),
+        "301234_2019.xml": _notice("ted_export_r209.xml"),
+    })
+    rows, stats = app.import_bulk_packages([package], "71000000", "DEU")
+    assert sorted(r["publication-number"] for r in rows) == ["301234-2019", "654321-2024"]
+    assert all(r["Parser-Version"] == app.PARSER_VERSION for r in rows)
+    assert stats == {"scanned": 2, "matched": 2, "parsed": 2, "failed": 0}
+
+
+def test_import_checks_the_buyer_not_any_organisation(tmp_path):
+    xml = _review_body_abroad(_notice("eforms_contract_notice.xml"))
+    assert b"AUT" in xml
+    package = _package(tmp_path, {"654321_2024.xml": xml})
+    rows, stats = app.import_bulk_packages([package], "71000000", "AUT")
+    assert rows == []
+    assert stats == {"scanned": 1, "matched": 0, "parsed": 0, "failed": 0}
+    rows, _ = app.import_bulk_packages([package], "71000000", "DEU")
+    assert [r["Beschaffer"] for r in rows] == ["Landeshauptstadt München"]
@@ -0,0 +1,110 @@
+"""Notice parsing per schema (eForms UBL and legacy TED_EXPORT): expected rows and a time bound."""
+import os
+import time
+
+import pytest
+from lxml import etree
+
+import app
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+# Parses of a small notice take well under a millisecond each; a regression
+# to whole-document scans per column shows up well above this bound.
+REPEATS = 200
+MAX_SECONDS = 5.0
+
+EXPECTED = {
+    "eforms_contract_notice.xml": {
+        "Beschaffer": "Landeshauptstadt München",
+        "Projektbezeichnung": "Generalplanung Grundschule Am Hart",
+        "Ort/Region": "München",
+        "Vergabeplattform": "https://vergabe.muenchen.de/NetServer/TenderingProcedureDetails?id=42",
+        "Ted-Link": "https://ted.europa.eu/en/notice/-/detail/654321-2024",
+        "Projektstart": "2025-02-15",
+        "Projektende": "2028-01-31",
+        "Geforderte Unternehmensreferenzen": "Lebenslauf der Projektleitung",
+        "Geforderte Kriterien CVs": "CV",
+        "Projektvolumen": "2500000 EUR",
+        "Frist Abgabedatum": "2024-12-02",
+        "Veröffentlichung Datum": "2024-10-28",
+        "CPV Codes": "71000000, 71221000",
+        "Leistungen/Rollen": "Objektplanung Gebäude LPH 1-9",
+    },
+    "ted_export_r209.xml": {
+        "Beschaffer": "Stadt Köln",
+        "Projektbezeichnung": "Projektsteuerung Neubau",
+        "Ort/Region": "Köln",
+        "Vergabeplattform": "https://vergabe.koeln.de/x",
+        "Ted-Link": "https://ted.europa.eu/en/notice/-/detail/301234-2019",
+        "Projektstart": "2019-10-01",
+        "Projektende": "2021-09-30",
+        "Geforderte Unternehmensreferenzen": "Eignung Referenzen und Lebenslauf CV des Projektleiters",
+        "Geforderte Kriterien CVs": "CV",
+        "Projektvolumen": "500000 EUR",
+        "Frist Abgabedatum": "2019-08-05",
+        "Veröffentlichung Datum": "2019-07-03",
+        "CPV Codes": "71500000, 71541000",
+        "Leistungen/Rollen": "Los 1 PS; Los 2 Bauüberwachung",
+    },
+}
+
+SCHEMAS = {
+    "eforms_contract_notice.xml": ("eforms", "eforms-sdk-1.10"),
+    "ted_export_r209.xml": ("ted-legacy", "R2.0.9"),
+}
+
+
+def _notice(name):
+    with open(os.path.join(DATA_DIR, name), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", sorted(SCHEMAS))
+def test_detects_schema(name):
+    root, _ = app._parse_notice_root(_notice(name))
+    assert app.detect_notice_schema(root.getroot()) == SCHEMAS[name]
+
+
+def test_unknown_root_is_not_a_notice_schema():
+    assert app.detect_notice_schema(etree.fromstring(b"<html/>")) == ("unknown", "")
+
+
+def test_every_schema_produces_all_fields():
+    for schema, extractors in app.FIELD_EXTRACTORS.items():
+        assert [col for e in extractors for col in e["columns"]] == app.ALL_FIELDS, schema
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_parses_expected_row(name):
+    assert app.parse_xml_fields(_notice(name)) == EXPECTED[name]
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_parses_field_subset(name):
+    fields = ["Beschaffer", "Projektende", "CPV Codes"]
+    assert app.parse_xml_fields(_notice(name), fields) == {col: EXPECTED[name][col] for col in fields}
+
+
+def test_legacy_notice_without_namespace():
+    xml = _notice("ted_export_r209.xml").replace(
+        b' xmlns="http://publications.europa.eu/resource/schema/ted/R2.0.9/publication"', b""
+    )
+    assert app.parse_xml_fields(xml) == EXPECTED["ted_export_r209.xml"]
+
+
+def test_legacy_duration_gives_project_start():
+    # 24 months are counted as 720 days back from the end date
+    xml = _notice("ted_export_r209.xml").replace(b"<DATE_START>2019-10-01</DATE_START>", b"")
+    assert app.parse_xml_fields(xml, ["Projektstart", "Projektende"]) == {
+        "Projektstart": "2019-10-11", "Projektende": "2021-09-30",
+    }
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED))
+def test_parse_time_bound(name):
+    xml = _notice(name)
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        app.parse_xml_fields(xml)
+    assert time.perf_counter() - start < MAX_SECONDS
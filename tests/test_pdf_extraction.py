@@ -0,0 +1,45 @@
+"""PDF extraction in page ranges: text, page markers, limits and a time bound."""
+import time
+from io import BytesIO
+
+import pytest
+
+import app
+from conftest import Upload, _pdf_bytes
+
+# Generous bound for the tiny fixtures; a regression to per-page process
+# start-up shows up well above it.
+MAX_SECONDS = 5.0
+
+
+def test_extracts_text_with_page_markers(pdf_file):
+    start = time.perf_counter()
+    text = app.extract_text_from_pdf(pdf_file)
+    assert time.perf_counter() - start < MAX_SECONDS
+    assert "--- Page 1 ---" in text
+    assert "Ausschreibung Kanalsanierung" in text
+    assert "Los 2 Tiefbau" in text
+
+
+def test_reports_progress(pdf_file):
+    calls = []
+    app.extract_text_from_pdf(pdf_file, lambda done, total: calls.append((done, total)))
+    assert calls[-1] == (1, 1)
+
+
+def test_truncates_at_char_limit(monkeypatch):
+    monkeypatch.setattr(app, "PDF_MAX_CHARS", 10)
+    text = app.extract_text_from_pdf(Upload(_pdf_bytes(["A line longer than ten characters"]), "long.pdf"))
+    assert "Truncated after page 0" in text
+    assert "A line longer" not in text
+
+
+def test_rejects_oversized_file(monkeypatch, pdf_file):
+    monkeypatch.setattr(app, "PDF_MAX_BYTES", 10)
+    with pytest.raises(app.ExtractionError, match="larger than"):
+        app.extract_text_from_pdf(pdf_file)
+
+
+def test_unreadable_pdf_raises():
+    with pytest.raises(app.ExtractionError, match="Error reading PDF"):
+        app.extract_text_from_pdf(BytesIO(b"not a real file"))
@@ -0,0 +1,43 @@
+"""Streaming spreadsheet summaries: preview, one-pass column statistics and a time bound."""
+import time
+
+import pytest
+
+import app
+from conftest import Upload
+
+# Generous bound for the tiny fixtures; a regression to full-sheet scans
+# shows up well above it.
+MAX_SECONDS = 5.0
+
+
+@pytest.mark.parametrize("fixture, expected", [
+    ("xlsx_file", ["Excel File: lots.xlsx", "Rows: 2, Columns: 2", "Column Names: Los, Volumen", "Tiefbau"]),
+    ("csv_file", ["Excel File: lots.csv", "Rows: 2, Columns: 2", "Column Names: Los, Volumen", "Hochbau"]),
+])
+def test_extracts_summary(request, fixture, expected):
+    start = time.perf_counter()
+    text = app.extract_text_from_excel(request.getfixturevalue(fixture))
+    assert time.perf_counter() - start < MAX_SECONDS
+    for part in expected:
+        assert part in text
+
+
+@pytest.mark.parametrize("fixture", ["xlsx_file", "csv_file"])
+def test_column_summary_has_ranges(request, fixture):
+    text = app.extract_text_from_excel(request.getfixturevalue(fixture))
+    assert "- Volumen: number, 2 values, 2 distinct, number min 80000, max 120000" in text
+
+
+def test_preview_is_capped(monkeypatch):
+    monkeypatch.setattr(app, "SPREADSHEET_PREVIEW_ROWS", 3)
+    rows = "".join(f"{i},{i * 10}\n" for i in range(100))
+    text = app.extract_text_from_excel(Upload(f"Nr,Wert\n{rows}".encode("utf-8"), "many.csv"))
+    assert "Rows: 100, Columns: 2" in text
+    assert "Data Preview (first 3 rows)" in text
+    assert "- Nr: number, 100 values, 100 distinct, number min 0, max 99" in text
+
+
+def test_unreadable_workbook_raises():
+    with pytest.raises(app.ExtractionError, match="Error reading Excel file"):
+        app.extract_text_from_excel(Upload(b"not a real file", "broken.xlsx"))
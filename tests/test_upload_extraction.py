@@ -0,0 +1,72 @@
+"""Text extraction from uploaded files: expected text, errors, the extraction cache and a time bound."""
+import time
+from io import BytesIO
+
+import pytest
+
+import app
+
+# Generous bound for the tiny fixtures; a regression to a slow reader
+# shows up well above it.
+MAX_SECONDS = 5.0
+
+
+def _extract(upload):
+    start = time.perf_counter()
+    text = app._extract_uploaded_file(upload, upload.name.rsplit(".", 1)[-1])
+    return text, time.perf_counter() - start
+
+
+@pytest.mark.parametrize("fixture, expected", [
+    ("docx_file", ["Leistungsbeschreibung\nObjektplanung Ingenieurbauwerke"]),
+    ("txt_file", ["Vergabeunterlagen für Straßenbau", "Frist: 2025-03-01"]),
+    ("png_file", ["Image File: plan.png", "Format: PNG", "Size: 40x20 pixels"]),
+])
+def test_extracts_text(request, fixture, expected):
+    text, elapsed = _extract(request.getfixturevalue(fixture))
+    for part in expected:
+        assert part in text
+    assert elapsed < MAX_SECONDS
+
+
+@pytest.mark.parametrize("name", ["broken.docx", "broken.png"])
+def test_unreadable_file_raises(name):
+    upload = BytesIO(b"not a real file")
+    upload.name = name
+    with pytest.raises(app.ExtractionError):
+        _extract(upload)
+
+
+def test_invalid_utf8_text_raises():
+    upload = BytesIO(b"\xff\xfe\xfa")
+    upload.name = "latin.txt"
+    with pytest.raises(app.ExtractionError):
+        _extract(upload)
+
+
+def test_unsupported_type_raises():
+    upload = BytesIO(b"data")
+    upload.name = "archive.rar"
+    with pytest.raises(app.ExtractionError, match="Unsupported file type"):
+        _extract(upload)
+
+
+def test_repeated_upload_is_served_from_cache(monkeypatch, tmp_path, docx_file):
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path))
+    first = app.process_uploaded_file(docx_file)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("extracted again")
+
+    monkeypatch.setattr(app, "_extract_uploaded_file", fail)
+    assert app.process_uploaded_file(docx_file) == first
+
+
+def test_failed_extraction_is_not_cached(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "CACHE_DIR", str(tmp_path))
+    upload = BytesIO(b"not a real file")
+    upload.name = "broken.docx"
+    for _ in range(2):
+        with pytest.raises(app.ExtractionError):
+            app.process_uploaded_file(upload)
+    assert not any(tmp_path.rglob("*.gz"))
@@ -0,0 +1,12 @@
+"""Process-pool entry point for app.py.
+
+Streamlit executes app.py as a script, so functions defined there cannot be
+pickled by reference for a ProcessPoolExecutor. Worker processes import the
+app module by name instead and call the requested function from it.
+"""
+import importlib
+
+
+def call(func_name, *args):
+    app = importlib.import_module("app")
+    return getattr(app, func_name)(*args)